@@ -12,7 +12,21 @@
 ###############################################################################
 
 import os, sys
+import io
+import asyncio
 import getopt
+import time
+import threading
+import queue
+import csv
+import json
+import struct
+import concurrent.futures
+import mmap
+import heapq
+import itertools
+import weakref
+from math import floor, ceil
 
 # E importaremos o pygame tambem para esse exemplo
 import pygame
@@ -24,6 +38,421 @@ images_dir = os.path.join( "..", "imagens" )
 # a monotonia
 import random as Random
 
+from collections import OrderedDict, deque
+
+# O NumPy é opcional: sem ele os tiros continuam sendo sprites comuns
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Início do programa, usado para medir o tempo até o primeiro quadro
+process_start = time.perf_counter()
+
+
+
+class SpriteAtlas:
+    """
+    Todas as imagens do diretório de imagens empacotadas em uma só
+    superfície.
+
+    O atlas é montado por build() (prateleiras de imagens, das mais altas
+    para as mais baixas) e guardado em cache_dir como atlas.png e
+    atlas.json, este com o retângulo de cada imagem e o tamanho e a data
+    de modificação dos arquivos de origem. load() usa o atlas guardado se
+    ele ainda corresponder às imagens, ou o monta de novo caso contrário.
+
+    Cada imagem é entregue como uma subsuperfície do atlas (region()),
+    então todos os sprites desenham a partir da mesma superfície e, ao
+    iniciar, só um arquivo precisa ser aberto.
+    """
+    extensions = ( ".png", ".jpg", ".jpeg", ".jfif" )
+
+    def __init__( self, source_dir=images_dir, cache_dir=None, width=1024,
+                  padding=1 ):
+        self.source_dir = source_dir
+        self.cache_dir  = cache_dir or os.path.join( "..", "cache" )
+        self.width      = width
+        self.padding    = padding
+        self.surface    = None
+        self.rects      = {}
+        self.regions    = {}
+        self.rebuilt    = False
+    # __init__()
+
+
+
+    def sources( self ):
+        sources = {}
+        for name in sorted( os.listdir( self.source_dir ) ):
+            if not name.lower().endswith( self.extensions ):
+                continue
+            st = os.stat( os.path.join( self.source_dir, name ) )
+            sources[ name ] = [ st.st_mtime_ns, st.st_size ]
+        return sources
+    # sources()
+
+
+
+    def paths( self ):
+        return ( os.path.join( self.cache_dir, "atlas.png" ),
+                 os.path.join( self.cache_dir, "atlas.json" ) )
+    # paths()
+
+
+
+    def build( self, sources ):
+        images = {}
+        for name in sources:
+            images[ name ] = pygame.image.load(
+                os.path.join( self.source_dir, name ) )
+
+        # Prateleiras: enfileira as imagens da esquerda para a direita e
+        # abre uma nova prateleira quando a largura acaba
+        pad   = self.padding
+        order = sorted( images, key=lambda n: -images[ n ].get_height() )
+        rects = {}
+        x = y = shelf = 0
+        width = max( [ self.width ] +
+                     [ i.get_width() + pad for i in images.values() ] )
+        for name in order:
+            w, h = images[ name ].get_size()
+            if x + w > width:
+                x  = 0
+                y += shelf + pad
+                shelf = 0
+            rects[ name ] = [ x, y, w, h ]
+            x    += w + pad
+            shelf = max( shelf, h )
+
+        surface = pygame.Surface( ( width, y + shelf ), SRCALPHA, 32 )
+        for name, r in rects.items():
+            surface.blit( images[ name ], r[ : 2 ] )
+
+        atlas_png, atlas_json = self.paths()
+        os.makedirs( self.cache_dir, exist_ok=True )
+        pygame.image.save( surface, atlas_png )
+        with open( atlas_json, "w" ) as f:
+            json.dump( { "sources": sources, "rects": rects }, f, indent=1 )
+        self.rebuilt = True
+        return surface, rects
+    # build()
+
+
+
+    def load( self ):
+        sources = self.sources()
+        atlas_png, atlas_json = self.paths()
+        surface = None
+        try:
+            with open( atlas_json ) as f:
+                index = json.load( f )
+            if index[ "sources" ] == sources:
+                surface = pygame.image.load( atlas_png )
+                rects   = index[ "rects" ]
+        except ( OSError, ValueError, KeyError, pygame.error ):
+            pass
+
+        if surface is None:
+            surface, rects = self.build( sources )
+
+        self.surface = surface.convert_alpha()
+        self.rects   = dict( ( n, pygame.Rect( r ) ) for n, r in rects.items() )
+        self.regions = {}
+        return self
+    # load()
+
+
+
+    def __contains__( self, name ):
+        return name in self.rects
+    # __contains__()
+
+
+
+    def region( self, name ):
+        region = self.regions.get( name )
+        if region is None:
+            region = self.surface.subsurface( self.rects[ name ] )
+            self.regions[ name ] = region
+        return region
+    # region()
+# SpriteAtlas
+
+
+
+class AssetPack:
+    """
+    Pacote com as imagens já decodificadas, para iniciar o jogo rápido.
+
+    build() lê cada imagem do diretório de imagens e grava, em um único
+    arquivo, os pixels já no formato da tela (BGRA, 32 bits), precedidos de
+    um índice com nome, tamanho e data de modificação do arquivo de origem,
+    dimensões e posição dos pixels no pacote. Ao abrir, o arquivo é mapeado
+    em memória com mmap e cada imagem vira uma superfície com
+    pygame.image.frombuffer(), sem copiar nem decodificar nada.
+
+    Imagens cujo arquivo de origem mudou depois que o pacote foi gerado são
+    consideradas velhas: get() retorna None e elas são lidas do PNG.
+
+    O cabeçalho guarda as máscaras de cor dos pixels gravados. Se elas não
+    são as de uma superfície com alpha do display, as imagens seriam
+    convertidas a cada blit: get() entrega então uma cópia convertida com
+    convert_alpha() (contada em converted), que não usa o mapeamento.
+    """
+    magic   = b"NPAK"
+    version = 2
+    header  = struct.Struct( "<4sHI4I" )
+    entry   = struct.Struct( "<qqIIQQ" )
+    align   = 16
+
+    def __init__( self, filename=None, source_dir=images_dir ):
+        self.filename   = filename or os.path.join( "..", "cache",
+                                                    "assets.pack" )
+        self.source_dir = source_dir
+        self.file       = None
+        self.map        = None
+        self.index      = {}
+        self.stale      = set()
+        self.handed     = 0
+        self.converted  = 0
+        self.native     = True
+    # __init__()
+
+
+
+    @staticmethod
+    def masks():
+        # Máscaras dos pixels BGRA gravados, do jeito que frombuffer() os lê
+        return pygame.image.frombuffer( bytes( 4 ), ( 1, 1 ),
+                                        "BGRA" ).get_masks()
+    # masks()
+
+
+
+    def build( self ):
+        tobytes = getattr( pygame.image, "tobytes", None ) or \
+                  pygame.image.tostring
+        entries = []
+        for name in sorted( os.listdir( self.source_dir ) ):
+            if not name.lower().endswith( SpriteAtlas.extensions ):
+                continue
+            path  = os.path.join( self.source_dir, name )
+            st    = os.stat( path )
+            image = pygame.image.load( path )
+            data  = tobytes( image, "BGRA" )
+            entries.append( ( name, st, image.get_size(), data ) )
+
+        names = [ name.encode( "utf-8" ) for name, st, size, data in entries ]
+        index_size = self.header.size + sum(
+            2 + len( n ) + self.entry.size for n in names )
+        offset = -index_size % self.align + index_size
+
+        os.makedirs( os.path.dirname( self.filename ) or ".", exist_ok=True )
+        tmp = self.filename + ".tmp"
+        with open( tmp, "wb" ) as f:
+            f.write( self.header.pack( self.magic, self.version,
+                                       len( entries ), *self.masks() ) )
+            offsets = []
+            for n, ( name, st, size, data ) in zip( names, entries ):
+                offsets.append( offset )
+                f.write( struct.pack( "<H", len( n ) ) + n )
+                f.write( self.entry.pack( st.st_mtime_ns, st.st_size,
+                                          size[ 0 ], size[ 1 ], offset,
+                                          len( data ) ) )
+                offset += len( data )
+                offset += -offset % self.align
+            for o, ( name, st, size, data ) in zip( offsets, entries ):
+                f.write( bytes( o - f.tell() ) )
+                f.write( data )
+        os.replace( tmp, self.filename )
+        return len( entries )
+    # build()
+
+
+
+    def open( self ):
+        """
+        Mapeia o pacote na memória. Retorna None se ele não existir ou não
+        for válido.
+        """
+        try:
+            self.file = open( self.filename, "rb" )
+            self.map  = mmap.mmap( self.file.fileno(), 0,
+                                   access=mmap.ACCESS_READ )
+            magic, version, count, *masks = \
+                self.header.unpack_from( self.map, 0 )
+            if magic != self.magic or version != self.version:
+                raise ValueError( "bad asset pack" )
+            # Gerado em uma máquina com outra ordem de bytes
+            if tuple( masks ) != self.masks():
+                raise ValueError( "asset pack pixel layout differs" )
+        except ( OSError, ValueError, struct.error ):
+            self.close()
+            return None
+
+        display = pygame.display.get_surface()
+        if display is not None:
+            native = pygame.Surface( ( 1, 1 ), SRCALPHA ).convert_alpha()
+            self.native = tuple( masks ) == native.get_masks()
+
+        pos = self.header.size
+        for i in range( count ):
+            n,   = struct.unpack_from( "<H", self.map, pos )
+            name = bytes( self.map[ pos + 2 : pos + 2 + n ] ).decode( "utf-8" )
+            pos += 2 + n
+            self.index[ name ] = self.entry.unpack_from( self.map, pos )
+            pos += self.entry.size
+        return self
+    # open()
+
+
+
+    def __contains__( self, name ):
+        return name in self.index
+    # __contains__()
+
+
+
+    def get( self, name ):
+        entry = self.index.get( name )
+        if entry is None:
+            return None
+        mtime, size, w, h, offset, length = entry
+        try:
+            st = os.stat( os.path.join( self.source_dir, name ) )
+        except OSError:
+            st = None
+        if st is None or st.st_mtime_ns != mtime or st.st_size != size:
+            self.stale.add( name )
+            return None
+        view  = memoryview( self.map )[ offset : offset + length ]
+        image = pygame.image.frombuffer( view, ( w, h ), "BGRA" )
+        if not self.native:
+            self.converted += 1
+            return image.convert_alpha()
+        self.handed += 1
+        return image
+    # get()
+
+
+
+    def close( self ):
+        # As superfícies criadas por get() continuam usando o mapeamento,
+        # então ele só é fechado se nenhuma foi entregue
+        self.index = {}
+        if self.map is not None and not self.handed:
+            self.map.close()
+            self.map = None
+        if self.file:
+            self.file.close()
+            self.file = None
+    # close()
+# AssetPack
+
+
+
+class ImageCache:
+    """
+    Cache de superfícies compartilhado por todo o processo.
+
+    Carregar uma imagem com pygame.image.load() significa abrir o arquivo e
+    decodificar o PNG, o que é caro demais para ser feito a cada tiro ou
+    inimigo criado. Aqui cada imagem é carregada e convertida com
+    convert_alpha() uma única vez e a mesma superfície é entregue para todos
+    os objetos que a utilizam (por isso ninguém deve desenhar sobre ela).
+
+    O cache tem um limite de entradas (max_size); ao ultrapassá-lo, a imagem
+    usada há mais tempo é descartada. Os contadores hits/misses permitem
+    verificar se o cache está sendo efetivo.
+
+    Se um SpriteAtlas for atribuído a atlas, as imagens que estão nele são
+    entregues como regiões do atlas em vez de serem lidas do disco. Com um
+    AssetPack em pack, as imagens vêm dos pixels já decodificados do pacote
+    (as que estiverem desatualizadas continuam vindo dos arquivos).
+    """
+    atlas = None
+    pack  = None
+
+    def __init__( self, max_size=64 ):
+        self.max_size  = max_size
+        self.images    = OrderedDict()
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        # Imagens também são carregadas fora da thread principal
+        self.lock      = threading.RLock()
+    # __init__()
+
+
+
+    def load( self, name, alpha=True ):
+        with self.lock:
+            return self.load_locked( name, alpha )
+    # load()
+
+
+
+    def load_locked( self, name, alpha ):
+        key = ( name, alpha )
+        image = self.images.get( key )
+        if image is not None:
+            self.hits += 1
+            self.images.move_to_end( key )
+            return image
+
+        self.misses += 1
+        image = None
+        if self.pack and name in self.pack:
+            # O pacote e o atlas já estão no formato da tela, com alpha
+            image = self.pack.get( name )
+        if image is None and self.atlas and name in self.atlas:
+            image = self.atlas.region( name )
+
+        if image is not None:
+            if not alpha:
+                image = image.convert()
+        else:
+            image = pygame.image.load( os.path.join( images_dir, name ) )
+            if pygame.display.get_surface():
+                if alpha:
+                    image = image.convert_alpha()
+                else:
+                    image = image.convert()
+
+        self.images[ key ] = image
+        while len( self.images ) > self.max_size:
+            self.images.popitem( last=False )
+            self.evictions += 1
+        return image
+    # load_locked()
+
+
+
+    def preload( self, names, alpha=True ):
+        for name in names:
+            self.load( name, alpha )
+    # preload()
+
+
+
+    def clear( self ):
+        self.images.clear()
+    # clear()
+
+
+
+    def get_stats( self ):
+        return { "size"      : len( self.images ),
+                 "max_size"  : self.max_size,
+                 "hits"      : self.hits,
+                 "misses"    : self.misses,
+                 "evictions" : self.evictions }
+    # get_stats()
+# ImageCache
+
+image_cache = ImageCache()
+
 
 class GameObject( pygame.sprite.Sprite ):
     """
@@ -53,37 +482,81 @@ class GameObject( pygame.sprite.Sprite ):
            rect = ( x, y, width, height )
        e ainda nos fornece algumas facilidades em troca, como o rect.move que
        já desloca a imagem a ser renderizada com apenas um comando.
+
+    Para gastar pouca memória com muitos objetos, os atributos do jogo
+    ficam em __slots__, a área do jogo (area) é um único retângulo
+    compartilhado por todos (veja set_arena()) e a velocidade é uma lista
+    alterada no lugar, em vez de uma tupla nova a cada aceleração. Como
+    pygame.sprite.Sprite não tem __slots__, cada objeto ainda tem um
+    __dict__, onde o Sprite guarda os grupos em que o objeto está; só os
+    atributos abaixo ficam fora dele.
     """
+    __slots__ = ( "image", "rect", "speed", "fx", "fy", "prev_pos", "net_id" )
+
+    area        = None
+    # Só é preciso guardar a posição anterior quando o desenho é interpolado
+    interpolate = False
+    # Identificador de cada objeto criado, usado pelo co-op em rede
+    net_ids     = itertools.count( 1 )
+
     def __init__( self, image, position, speed=None ):
         pygame.sprite.Sprite.__init__( self )
+        self.net_id = next( self.net_ids )
         self.image = image
         if isinstance( self.image, str ):
-            self.image = os.path.join( images_dir, self.image )
-            self.image = pygame.image.load( self.image )
+            self.image = image_cache.load( self.image )
 
         self.rect  = self.image.get_rect()
-        screen     = pygame.display.get_surface()
-        self.area  = screen.get_rect()
+        if GameObject.area is None:
+            GameObject.set_arena( pygame.display.get_surface().get_rect() )
         
+        self.speed = [ 0, 0 ]
         self.set_pos( position )
         self.set_speed( speed or ( 0, 2 ) )
     # __init__()
 
 
+
+    @staticmethod
+    def set_arena( rect ):
+        GameObject.area = pygame.Rect( rect )
+    # set_arena()
+
+
     
     def update( self, dt ):
-        move_speed = ( self.speed[ 0 ] * dt // 16,
-                       self.speed[ 1 ] * dt // 16 )
-        self.rect  = self.rect.move( move_speed )
-        if ( self.rect.left > self.area.right ) or \
-               ( self.rect.top > self.area.bottom ) or \
-               ( self.rect.right < 0 ):
+        self.move( dt )
+        rect = self.rect
+        area = self.area
+        if ( rect.left > area.right ) or \
+               ( rect.top > area.bottom ) or \
+               ( rect.right < 0 ):
             self.kill()
-        if ( self.rect.bottom < - 40 ):
+        if ( rect.bottom < - 40 ):
             self.kill()
     # update()
 
 
+
+    def move( self, dt ):
+        """
+        Desloca o objeto de acordo com a velocidade. A posição é guardada
+        em ponto flutuante (self.fx, self.fy), assim passos de dt
+        fracionários não perdem precisão; prev_pos guarda a posição
+        anterior, usada para interpolar o desenho entre dois passos da
+        simulação.
+        """
+        rect  = self.rect
+        speed = self.speed
+        if self.interpolate:
+            self.prev_pos = rect.topleft
+        self.fx += speed[ 0 ] * dt / 16.0
+        self.fy += speed[ 1 ] * dt / 16.0
+        rect.x   = floor( self.fx )
+        rect.y   = floor( self.fy )
+    # move()
+
+
     
     def get_speed( self ):
         return self.speed
@@ -92,7 +565,8 @@ class GameObject( pygame.sprite.Sprite ):
 
 
     def set_speed( self, speed ):
-        self.speed = speed
+        self.speed[ 0 ] = speed[ 0 ]
+        self.speed[ 1 ] = speed[ 1 ]
     # set_speed()
 
     
@@ -106,6 +580,10 @@ class GameObject( pygame.sprite.Sprite ):
 
     def set_pos( self, pos ):
         self.rect.center = ( pos[ 0 ], pos[ 1 ] )
+        self.fx          = float( self.rect.x )
+        self.fy          = float( self.rect.y )
+        if self.interpolate:
+            self.prev_pos = self.rect.topleft
     # get_pos()
 
 
@@ -119,242 +597,911 @@ class GameObject( pygame.sprite.Sprite ):
 
 
 class Fire( GameObject ):
+    __slots__ = ( "pool", "in_pool" )
+    
     def __init__( self, position, speed=None, image=None, list=None ):
         if not image:
             image = "tiro.png"
+        self.pool    = None
+        self.in_pool = False
         GameObject.__init__( self, image, position, speed )
         if list != None:
             self.add( list )
     # __init__()
-# Fire
 
 
 
-class Ship( GameObject ):
-    def __init__( self, position, lives=0, speed=None, image=None ):
-        self.acceleration = [ 3, 3 ]
+    def reset( self, position, speed=None, image=None ):
+        """
+        Reaproveita o tiro com nova posição, velocidade e imagem.
+        """
         if not image:
-            image = "nave.png"
-        GameObject.__init__( self, image, position, speed )
-        self.set_lives( lives )
-    # __init__()
+            image = "tiro.png"
+        if isinstance( image, str ):
+            image = image_cache.load( image )
+        self.image  = image
+        self.rect   = image.get_rect()
+        self.net_id = next( self.net_ids )
+        self.set_pos( position )
+        self.set_speed( speed or ( 0, 2 ) )
+    # reset()
 
-    
 
-    def get_lives( self ):
-        return self.lives
-    # get_lives()
 
+    def kill( self ):
+        GameObject.kill( self )
+        # Um tiro reaproveitado é outro objeto para a rede (veja reset())
+        self.net_id = 0
+        if self.pool:
+            self.pool.release( self )
+    # kill()
+# Fire
 
 
-    def set_lives( self, lives ):
-        self.lives = lives
-    # set_lives()
 
+class FirePool:
+    """
+    Reserva de tiros para reaproveitamento.
 
+    Cada tiro que sai da tela ou acerta um alvo é removido com kill(); em
+    vez de deixar o objeto para o coletor de lixo, ele volta para esta
+    reserva e é reativado no próximo disparo com reset(). Assim uma partida
+    longa não cria e destrói centenas de milhares de sprites.
 
-    def fire( self, fire_list, image=None ):
-        s = list( self.get_speed() )
-        s[ 1 ] *= 2
-        Fire( self.get_pos(), s, image, fire_list )
-    # fire()
+    high_water é o maior número de tiros ativos ao mesmo tempo e reused é
+    quantas alocações foram evitadas.
+    """
+    def __init__( self ):
+        self.free       = []
+        self.active     = 0
+        self.high_water = 0
+        self.allocated  = 0
+        self.reused     = 0
+    # __init__()
 
-    
 
-    def do_hit( self ):
-        if self.get_lives() == 0:
-            self.kill()
-        else:
-            self.set_lives( self.get_lives() - 1 )
-    # do_hit()
 
+    def preload( self, count ):
+        for i in range( count ):
+            fire = Fire( ( 0, 0 ) )
+            fire.pool    = self
+            fire.in_pool = True
+            self.free.append( fire )
+            self.allocated += 1
+    # preload()
 
 
-    def do_collision( self ):
-        if self.get_lives() == 0:
-            self.kill()
+
+    def acquire( self, position, speed=None, image=None, list=None ):
+        if self.free:
+            fire = self.free.pop()
+            fire.reset( position, speed, image )
+            self.reused += 1
         else:
-            self.set_lives( self.get_lives() - 1 )
-    # do_collision()
+            fire = Fire( position, speed, image )
+            fire.pool = self
+            self.allocated += 1
 
-    
+        fire.in_pool = False
+        self.active += 1
+        if self.active > self.high_water:
+            self.high_water = self.active
 
-    def is_dead( self ):
-        return self.get_lives() == 0
-    # is_dead()
+        if list != None:
+            fire.add( list )
+        return fire
+    # acquire()
 
 
 
-    def accel_top( self ):
-        speed = self.get_speed()
-        self.set_speed( ( speed[ 0 ], speed[ 1 ] - self.acceleration[ 1 ] ) )
-    # accel_top
+    def release( self, fire ):
+        # kill() pode ser chamado mais de uma vez no mesmo quadro
+        if fire.in_pool:
+            return
+        fire.in_pool = True
+        self.active -= 1
+        self.free.append( fire )
+    # release()
 
 
 
-    def accel_bottom( self ):
-        speed = self.get_speed()
-        self.set_speed( ( speed[ 0 ], speed[ 1 ] + self.acceleration[ 1 ] ) )
-    # accel_bottom
+    def get_stats( self ):
+        return { "active"     : self.active,
+                 "free"       : len( self.free ),
+                 "high_water" : self.high_water,
+                 "allocated"  : self.allocated,
+                 "reused"     : self.reused }
+    # get_stats()
+# FirePool
 
+fire_pool = FirePool()
 
 
-    def accel_left( self ):        
-        speed = self.get_speed()
-        self.set_speed( ( speed[ 0 ] - self.acceleration[ 0 ], speed[ 1 ] ) )
-    # accel_left
 
+def spawn_fire( position, speed, image, fire_list ):
+    """
+    Cria um tiro na lista dada, seja ela um grupo de sprites (usando a
+    reserva de tiros) ou um ProjectileGroup.
+    """
+    if isinstance( fire_list, ProjectileGroup ):
+        fire_list.spawn( position, speed, image )
+    else:
+        fire_pool.acquire( position, speed, image, fire_list )
+# spawn_fire()
 
 
-    def accel_right( self ):
-        speed = self.get_speed()
-        self.set_speed( ( speed[ 0 ] + self.acceleration[ 0 ], speed[ 1 ] ) )
-    # accel_right
-# Ship
 
+class ProjectileSystem:
+    """
+    Todos os tiros do jogo guardados em vetores do NumPy.
 
+    Cada linha dos vetores é um tiro: posição (canto superior esquerdo),
+    velocidade, dono (jogador ou inimigos) e índice da imagem. Assim o
+    movimento, a remoção dos tiros que saíram da tela e os testes de colisão
+    são feitos de uma só vez para todos os tiros, em vez de um
+    GameObject.update() por sprite. O desenho usa um único Surface.blits().
 
-class Enemy( Ship ):
-    def __init__( self, position, lives=0, speed=None, image=None ):
-        if not image:
-            image = "inimigo.png"
-        Ship.__init__( self, position, lives, speed, image )
+    O jogo não usa esta classe diretamente, mas sim um ProjectileGroup para
+    cada dono, que se comporta como um grupo de sprites.
+    """
+    PLAYER = 0
+    ENEMY  = 1
+
+    def __init__( self, capacity=1024 ):
+        self.n      = 0
+        self.pos    = numpy.zeros( ( capacity, 2 ), numpy.float32 )
+        self.prev   = numpy.zeros( ( capacity, 2 ), numpy.float32 )
+        self.vel    = numpy.zeros( ( capacity, 2 ), numpy.float32 )
+        self.owner  = numpy.zeros( capacity, numpy.int8 )
+        self.img    = numpy.zeros( capacity, numpy.int16 )
+        self.images = []
+        self.sizes  = numpy.zeros( ( 0, 2 ), numpy.int32 )
+        self.image_ids = {}
     # __init__()
-# Enemy
 
 
 
+    def image_id( self, image ):
+        i = self.image_ids.get( image )
+        if i is None:
+            i = len( self.images )
+            surface = image_cache.load( image ) if isinstance( image, str ) \
+                      else image
+            self.images.append( surface )
+            self.sizes = numpy.vstack( ( self.sizes, surface.get_size() ) )
+            self.image_ids[ image ] = i
+        return i
+    # image_id()
 
-class Player( Ship ):
-    """
-    A classe Player é uma classe derivada da classe GameObject.
-       No entanto, o personagem não morre quando passa da borda, este só
-    interrompe o seu movimento (vide update()).
-       E possui experiência, que o fará mudar de nivel e melhorar seu tiro.
-       A função get_pos() só foi redefinida para que os tiros não saissem da
-    parte da frente da nave do personagem, por esta estar virada ao contrário
-    das outras.
-       A função fire() foi redefinida para levar em conta a experiência do
-    jogador (quanto mais experiência, mais tiros).
-    """
-    def __init__( self, position, lives=10, image=None ):
-        if not image:
-            image = "nave.png"
-        Ship.__init__( self, position, lives, [ 0, 0 ], image )
-        self.set_XP( 0 )
-    # __init__()
 
 
-    
-    def update( self, dt ):
-        move_speed = ( self.speed[ 0 ] * dt // 16,
-                       self.speed[ 1 ] * dt // 16)
-        self.rect  = self.rect.move( move_speed )
-        
-        if ( self.rect.right > self.area.right ):
-            self.rect.right = self.area.right
-            
-        elif ( self.rect.left < 0 ):
-            self.rect.left = 0
-            
-        if ( self.rect.bottom > self.area.bottom ):
-            self.rect.bottom = self.area.bottom
-            
-        elif ( self.rect.top < 0 ):
-            self.rect.top = 0
-    # update()
+    def grow( self ):
+        capacity = 2 * len( self.owner )
+        for name in ( "pos", "prev", "vel", "owner", "img" ):
+            old = getattr( self, name )
+            new = numpy.zeros( ( capacity, ) + old.shape[ 1 : ], old.dtype )
+            new[ : self.n ] = old[ : self.n ]
+            setattr( self, name, new )
+    # grow()
 
 
-    
-    def get_pos( self ):
-        return ( self.rect.center[ 0 ], self.rect.top )
-    # get_pos()
 
+    def spawn( self, owner, position, speed, image ):
+        if self.n == len( self.owner ):
+            self.grow()
+        i   = self.n
+        img = self.image_id( image )
+        # mesma conta feita por rect.center = position
+        w, h = self.sizes[ img ]
+        self.pos[ i ] = ( position[ 0 ] - w // 2, position[ 1 ] - h // 2 )
+        self.prev[ i ] = self.pos[ i ]
+        self.vel[ i ] = speed
+        self.owner[ i ] = owner
+        self.img[ i ] = img
+        self.n += 1
+    # spawn()
 
-    
-    def get_XP( self ):
-        return self.XP
-    # get_XP()
 
-    
 
-    def set_XP( self, XP ):
-        self.XP = XP
-    # get_XP()
+    def select( self, owner ):
+        return self.owner[ : self.n ] == owner
+    # select()
 
 
-    def fire( self, fire_list, image=None ):
-        l = 1
-        if self.XP > 3: l = 3
-        if self.XP > 50: l = 5
-        if self.XP > 100: l = 7
-        
-        p      = self.get_pos()
-        speeds = self.get_fire_speed( l )
-        for s in speeds:
-            Fire( p, s, image, fire_list )
-    # fire()
 
+    def remove( self, dead ):
+        keep = ~dead
+        k    = int( keep.sum() )
+        if k == self.n:
+            return
+        for a in ( self.pos, self.prev, self.vel, self.owner, self.img ):
+            a[ : k ] = a[ : self.n ][ keep ]
+        self.n = k
+    # remove()
 
 
-    def get_fire_speed( self, shots ):
-        speeds = []
 
-        if shots <= 0:
-            return speeds
-        
-        if shots == 1:
-            speeds += [ (  0, -5 ) ]
-            
-        if shots > 1 and shots <= 3:
-            speeds += [ (  0, -5 ) ]
-            speeds += [ ( -2, -3 ) ]
-            speeds += [ (  2, -3 ) ]
-            
-        if shots > 3 and shots <= 5:
-            speeds += [ (  0, -5 ) ]
-            speeds += [ ( -2, -3 ) ]
-            speeds += [ (  2, -3 ) ]
-            speeds += [ ( -4, -2 ) ]
-            speeds += [ (  4, -2 ) ]
+    def rects( self ):
+        """
+        Retorna x, y, largura e altura de todos os tiros, como inteiros.
+        As posições são arredondadas para baixo, como em GameObject.move()
+        e no desenho (astype() arredondaria para zero as negativas).
+        """
+        n    = self.n
+        xy   = numpy.floor( self.pos[ : n ] ).astype( numpy.int32 )
+        size = self.sizes[ self.img[ : n ] ]
+        return xy[ :, 0 ], xy[ :, 1 ], size[ :, 0 ], size[ :, 1 ]
+    # rects()
+
+
+
+    def update( self, dt, owner ):
+        n   = self.n
+        sel = self.select( owner )
+        self.prev[ : n ][ sel ] = self.pos[ : n ][ sel ]
+        self.pos[ : n ][ sel ] += self.vel[ : n ][ sel ] * ( dt / 16.0 )
+
+        # Mesmas condições de GameObject.update()
+        x, y, w, h = self.rects()
+        area = GameObject.area
+        out  = ( x > area.right ) | ( y > area.bottom ) | ( x + w < 0 ) | \
+               ( y + h < - 40 )
+        self.remove( sel & out )
+    # update()
 
-        if shots > 6 and shots <= 9:
-            speeds += [ (  0, -5 ) ]
-            speeds += [ ( -2, -3 ) ]
-            speeds += [ (  2, -3 ) ]
-            speeds += [ ( -4, -2 ) ]
-            speeds += [ (  4, -2 ) ]
-            speeds += [ ( -6, -1 ) ]
-            speeds += [ (  6, -1 ) ]
-        return speeds
-    # get_fire_speed()
-# Player
 
 
+    def overlap( self, rect ):
+        """
+        Vetor indicando quais tiros colidem com rect (mesmo critério de
+        Rect.colliderect()).
+        """
+        return self.overlaps( [ rect ] )[ 0 ]
+    # overlap()
 
 
-class Background:
-    """
-    Esta classe representa o ator "Fundo" do jogo.
 
-    Ela poreria ser herdeira de GameObject, porém como ela não precisa de todos
-    aqueles recursos, implemento somente alguns métodos (update() e draw())
-    """
-    image = None
-    pos   = None
-    
-    def __init__( self, image="tile.png" ):
+    def overlaps( self, rects ):
         """
-        Com essa função criamos uma superfície, formada de uma repetição da
-        imagem passada, de forma a cobrir a tela e um pouco mais.
+        Matriz ( alvo, tiro ) indicando quais tiros colidem com cada um dos
+        rects. Os retângulos dos tiros são calculados uma única vez e todos
+        os alvos são testados de uma vez, por broadcast.
+        """
+        x, y, w, h = self.rects()
+        r      = numpy.array( [ tuple( rect ) for rect in rects ],
+                              numpy.int32 ).reshape( -1, 4 )
+        left   = r[ :, 0 : 1 ]
+        top    = r[ :, 1 : 2 ]
+        right  = left + r[ :, 2 : 3 ]
+        bottom = top + r[ :, 3 : 4 ]
+        return ( x < right ) & ( left < x + w ) & \
+               ( y < bottom ) & ( top < y + h )
+    # overlaps()
 
-        Aqui é o único lugar onde podemos carregar a imagem, utilizando
-            load( image ).convert(),
-        este comando não tem nenhuma relação com o formato de arquivo da
-        imagem. Ele converte a imagem para o formato do pixel[1] da tela,
-        representando um ganho de até 6X na performance final[2].
 
-        [1] Formato de Pixel: Toda imagem é formada por um conjunto de pixels,
+
+    def refine( self, hit, sprite ):
+        """
+        Dos tiros marcados em hit (que já colidem pelo retângulo), mantém
+        só os que colidem com sprite pelas máscaras.
+        """
+        images = self.images
+        pos    = sprite.rect.topleft
+        for i in numpy.flatnonzero( hit ):
+            xy = numpy.floor( self.pos[ i ] ).astype( numpy.int32 ).tolist()
+            if not mask_cache.overlap( sprite.image, pos,
+                                       images[ self.img[ i ] ], xy ):
+                hit[ i ] = False
+        return hit
+    # refine()
+
+
+
+    def blits( self, owner, alpha=None ):
+        """
+        Lista de ( imagem, posição ) dos tiros de owner, no formato usado
+        por Surface.blits().
+        """
+        idx    = numpy.flatnonzero( self.select( owner ) )
+        images = self.images
+        pos    = self.pos[ idx ]
+        if alpha is not None:
+            prev = self.prev[ idx ]
+            pos  = prev + ( pos - prev ) * alpha
+        xy     = numpy.floor( pos ).astype( numpy.int32 ).tolist()
+        img    = self.img[ idx ].tolist()
+        return [ ( images[ i ], tuple( p ) ) for i, p in zip( img, xy ) ]
+    # blits()
+
+
+
+    def draw( self, screen, owner, doreturn=False, alpha=None ):
+        return screen.blits( self.blits( owner, alpha ), doreturn )
+    # draw()
+# ProjectileSystem
+
+
+
+class ProjectileGroup:
+    """
+    Os tiros de um dono dentro de um ProjectileSystem, com a mesma interface
+    usada pelo jogo para os grupos de sprites: update(), draw(), clear() e
+    len(). Os testes de colisão são feitos por collide_group() e
+    collide_sprite(), que seguem a semântica de pygame.sprite.groupcollide()
+    e pygame.sprite.spritecollide().
+    """
+    def __init__( self, system, owner, image="tiro.png" ):
+        self.system     = system
+        self.owner      = owner
+        self.image      = image
+        self.last_rects = None
+    # __init__()
+
+
+
+    def __len__( self ):
+        return int( self.system.select( self.owner ).sum() )
+    # __len__()
+
+
+
+    def spawn( self, position, speed=None, image=None ):
+        self.system.spawn( self.owner, position, speed or ( 0, 2 ),
+                           image or self.image )
+    # spawn()
+
+
+
+    def update( self, dt ):
+        self.system.update( dt, self.owner )
+    # update()
+
+
+
+    def draw( self, screen, alpha=None ):
+        if self.last_rects is None:
+            self.system.draw( screen, self.owner, alpha=alpha )
+            return []
+
+        rects = self.system.draw( screen, self.owner, True, alpha )
+        dirty = self.last_rects + rects
+        self.last_rects = rects
+        return dirty
+    # draw()
+
+
+
+    def clear( self, screen, background ):
+        # Só é usado pelo DirtyRenderer: a partir daqui draw() passa a
+        # guardar os retângulos desenhados
+        for rect in self.last_rects or ():
+            background( screen, rect )
+        if self.last_rects is None:
+            self.last_rects = []
+    # clear()
+
+
+
+    def blits( self ):
+        return self.system.blits( self.owner )
+    # blits()
+
+
+
+    def centers( self ):
+        system = self.system
+        idx    = numpy.flatnonzero( system.select( self.owner ) )
+        size   = system.sizes[ system.img[ idx ] ]
+        xy     = numpy.floor( system.pos[ idx ] ).astype( numpy.int32 )
+        return ( xy + size // 2 ).tolist()
+    # centers()
+
+
+
+    def collide_sprite( self, sprite, dokill, exact=False, stats=None ):
+        """
+        Retorna quantos tiros acertaram sprite. stats (um SpatialHash)
+        recebe os pares testados e as colisões, como no caminho dos sprites.
+        """
+        system = self.system
+        sel    = system.select( self.owner )
+        hit    = system.overlap( sprite.rect ) & sel
+        if exact and hit.any():
+            hit = system.refine( hit, sprite )
+        count  = int( hit.sum() )
+        if stats is not None:
+            stats.candidates += int( sel.sum() )
+            stats.hits       += count
+        if count and dokill:
+            system.remove( hit )
+        return count
+    # collide_sprite()
+
+
+
+    def collide_group( self, group, dokill, exact=False, stats=None ):
+        """
+        Retorna um dicionário { tiro: [ sprites atingidos ] } para os tiros
+        que acertaram algum sprite do grupo.
+        """
+        system  = self.system
+        sprites = group.sprites()
+        if not sprites or not system.n:
+            return {}
+
+        sel  = system.select( self.owner )
+        hits = system.overlaps( [ o.rect for o in sprites ] )
+        hits &= sel
+        if exact:
+            for j, o in enumerate( sprites ):
+                if hits[ j ].any():
+                    system.refine( hits[ j ], o )
+        if stats is not None:
+            stats.candidates += int( sel.sum() ) * len( sprites )
+            stats.hits       += int( hits.sum() )
+        hitted = {}
+        for i in numpy.flatnonzero( hits.any( axis=0 ) ):
+            hitted[ int( i ) ] = [ sprites[ j ]
+                                   for j in numpy.flatnonzero( hits[ :, i ] ) ]
+        if hitted and dokill:
+            system.remove( hits.any( axis=0 ) )
+        return hitted
+    # collide_group()
+# ProjectileGroup
+
+
+
+class ParticleSystem:
+    """
+    Partículas das explosões, guardadas em vetores do NumPy.
+
+    Cada partícula tem posição, velocidade, tempo de vida restante e tipo
+    (fogo, destroços ou faíscas). update() move e envelhece todas de uma
+    vez e remove as que acabaram; draw() escreve pontos de 2x2 pixels
+    direto nos pixels da tela (pygame.surfarray), misturando a cor com o
+    fundo conforme a partícula envelhece. A mistura é feita uma vez por
+    partícula sobre os pixels de 32 bits já empacotados, e o resultado é
+    copiado para os 4 pixels do ponto. Não há um sprite por partícula,
+    então dezenas de milhares delas custam poucos milissegundos.
+
+    Cada chamada de explode() é uma rajada com um número próprio (burst);
+    no DirtyRenderer cada rajada vira um retângulo sujo, em vez de um só
+    retângulo em volta de todas as partículas da tela.
+
+    capacity é um limite rígido: quando ele é atingido, as partículas novas
+    são descartadas (e contadas em dropped). As partículas são só visuais
+    e usam um gerador próprio, sem afetar a partida.
+    """
+    FIRE   = 0
+    DEBRIS = 1
+    SPARK  = 2
+
+    # Cor no início e no fim da vida de cada tipo
+    colors = ( ( ( 255, 240, 160 ), ( 200,  40,   0 ) ),
+               ( ( 200, 200, 210 ), (  70,  60,  60 ) ),
+               ( ( 160, 220, 255 ), (  40,  80, 255 ) ) )
+
+    def __init__( self, capacity=8192, seed=None, drag=0.96, gravity=0.02 ):
+        self.capacity = capacity
+        self.n        = 0
+        self.pos      = numpy.zeros( ( capacity, 2 ), numpy.float32 )
+        self.vel      = numpy.zeros( ( capacity, 2 ), numpy.float32 )
+        self.life     = numpy.zeros( capacity, numpy.float32 )
+        self.ttl      = numpy.ones( capacity, numpy.float32 )
+        self.kind     = numpy.zeros( capacity, numpy.int8 )
+        self.burst    = numpy.zeros( capacity, numpy.int32 )
+        self.bursts   = 0
+        self.start    = numpy.array( [ c[ 0 ] for c in self.colors ],
+                                     numpy.float32 )
+        self.end      = numpy.array( [ c[ 1 ] for c in self.colors ],
+                                     numpy.float32 )
+        self.random   = numpy.random.default_rng( seed )
+        self.drag     = drag
+        self.gravity  = gravity
+        self.last_rects = None
+        self.spawned  = 0
+        self.dropped  = 0
+        self.peak     = 0
+    # __init__()
+
+
+
+    def __len__( self ):
+        return self.n
+    # __len__()
+
+
+
+    def explode( self, center, count, kind=FIRE, speed=3.0, ttl=600.0 ):
+        """
+        Cria count partículas saindo de center em todas as direções, com
+        velocidade até speed (pixels por quadro de 16 ms) e vida até ttl ms.
+        """
+        free = self.capacity - self.n
+        if count > free:
+            self.dropped += count - free
+            count = free
+        if count <= 0:
+            return
+
+        rng   = self.random
+        i, j  = self.n, self.n + count
+        angle = rng.uniform( 0.0, 2 * numpy.pi, count )
+        s     = speed * numpy.sqrt( rng.uniform( 0.05, 1.0, count ) )
+        self.pos[ i : j ]     = center
+        self.pos[ i : j ]    += rng.normal( 0.0, 2.0, ( count, 2 ) )
+        self.vel[ i : j, 0 ]  = numpy.cos( angle ) * s
+        self.vel[ i : j, 1 ]  = numpy.sin( angle ) * s
+        self.ttl[ i : j ]     = rng.uniform( 0.4, 1.0, count ) * ttl
+        self.life[ i : j ]    = self.ttl[ i : j ]
+        self.kind[ i : j ]    = kind
+        self.burst[ i : j ]   = self.bursts
+        self.bursts  += 1
+        self.n        = j
+        self.spawned += count
+        if j > self.peak:
+            self.peak = j
+    # explode()
+
+
+
+    def update( self, dt ):
+        n = self.n
+        if not n:
+            return
+        k = dt / 16.0
+        self.vel[ : n ]    *= self.drag ** k
+        self.vel[ : n, 1 ] += self.gravity * k
+        self.pos[ : n ]    += self.vel[ : n ] * k
+        self.life[ : n ]   -= dt
+
+        alive = self.life[ : n ] > 0
+        if alive.all():
+            return
+        m = int( alive.sum() )
+        # A ordem é mantida: as rajadas continuam em ordem crescente
+        for a in ( self.pos, self.vel, self.life, self.ttl, self.kind,
+                   self.burst ):
+            a[ : m ] = a[ : n ][ alive ]
+        self.n = m
+    # update()
+
+
+
+    def draw( self, screen, alpha=None, scale=None ):
+        rects = []
+        n     = self.n
+        if n:
+            rects = self.draw_points( screen, scale )
+        if self.last_rects is None:
+            return rects
+        dirty = self.last_rects + rects
+        self.last_rects = rects
+        return dirty
+    # draw()
+
+
+
+    def draw_points( self, screen, scale=None ):
+        return self.draw_state( screen, self.state( screen.get_size(),
+                                                    scale ) )
+    # draw_points()
+
+
+
+    def state( self, size, scale=None ):
+        """
+        Retorna ( x, y, fade, kind, burst ) das partículas que cabem numa
+        tela do tamanho size. São cópias, que podem ser desenhadas por
+        draw_state() enquanto o sistema continua sendo atualizado. Com scale
+        (veja WorldView) as posições são multiplicadas por ( sx, sy ).
+        """
+        n    = self.n
+        w, h = size
+        pos  = self.pos[ : n ]
+        if scale is not None:
+            pos = pos * numpy.array( scale, numpy.float32 )
+        # floor(): astype() arredondaria para zero as posições negativas
+        xy   = numpy.floor( pos ).astype( numpy.int32 )
+        x, y = xy[ :, 0 ], xy[ :, 1 ]
+        ok   = ( x >= 0 ) & ( y >= 0 ) & ( x < w - 1 ) & ( y < h - 1 )
+        return ( x[ ok ], y[ ok ], ( self.life[ : n ] / self.ttl[ : n ] )[ ok ],
+                 self.kind[ : n ][ ok ], self.burst[ : n ][ ok ] )
+    # state()
+
+
+
+    def draw_state( self, screen, state ):
+        x, y, fade, kind, burst = state
+        if not len( x ):
+            return []
+        end   = self.end.T
+        delta = ( self.start - self.end ).T
+
+        if screen.get_bytesize() == 4:
+            pixels = pygame.surfarray.pixels2d( screen )
+            px     = pixels[ x, y ].astype( numpy.uint32 )
+            out    = px & numpy.uint32( screen.get_masks()[ 3 ] )
+            for c, shift in enumerate( screen.get_shifts()[ : 3 ] ):
+                color = end[ c ].take( kind ) + delta[ c ].take( kind ) * fade
+                v     = ( ( px >> shift ) & 0xff ).astype( numpy.float32 )
+                v    += ( color - v ) * fade
+                out  |= v.astype( numpy.uint32 ) << shift
+        else:
+            pixels = pygame.surfarray.pixels3d( screen )
+            px     = pixels[ x, y ]
+            color  = ( end[ :, kind ] + delta[ :, kind ] * fade ).T
+            out    = px + ( color - px ) * fade[ :, None ]
+        for dx, dy in ( ( 0, 0 ), ( 1, 0 ), ( 0, 1 ), ( 1, 1 ) ):
+            pixels[ x + dx, y + dy ] = out
+        del pixels
+
+        # Um retângulo por rajada. As rajadas estão em ordem crescente, então
+        # cada uma é um trecho contínuo dos vetores
+        start = numpy.flatnonzero( numpy.diff( burst, prepend=-1 ) )
+        x0    = numpy.minimum.reduceat( x, start ).tolist()
+        y0    = numpy.minimum.reduceat( y, start ).tolist()
+        x1    = numpy.maximum.reduceat( x, start ).tolist()
+        y1    = numpy.maximum.reduceat( y, start ).tolist()
+        return [ pygame.Rect( l, t, r - l + 2, b - t + 2 )
+                 for l, t, r, b in zip( x0, y0, x1, y1 ) ]
+    # draw_state()
+
+
+
+    def clear( self, screen, background ):
+        # Mesmo esquema do ProjectileGroup: só o DirtyRenderer chama clear()
+        for rect in self.last_rects or ():
+            background( screen, rect )
+        if self.last_rects is None:
+            self.last_rects = []
+    # clear()
+
+
+
+    def get_stats( self ):
+        return { "capacity" : self.capacity,
+                 "peak"     : self.peak,
+                 "spawned"  : self.spawned,
+                 "dropped"  : self.dropped }
+    # get_stats()
+# ParticleSystem
+
+
+
+class Ship( GameObject ):
+    __slots__ = ( "lives", )
+
+    acceleration = ( 3, 3 )
+
+    def __init__( self, position, lives=0, speed=None, image=None ):
+        if not image:
+            image = "nave.png"
+        GameObject.__init__( self, image, position, speed )
+        self.set_lives( lives )
+    # __init__()
+
+    
+
+    def get_lives( self ):
+        return self.lives
+    # get_lives()
+
+
+
+    def set_lives( self, lives ):
+        self.lives = lives
+    # set_lives()
+
+
+
+    def fire( self, fire_list, image=None ):
+        s = list( self.get_speed() )
+        s[ 1 ] *= 2
+        spawn_fire( self.get_pos(), s, image, fire_list )
+    # fire()
+
+    
+
+    def do_hit( self ):
+        if self.get_lives() == 0:
+            self.kill()
+        else:
+            self.set_lives( self.get_lives() - 1 )
+    # do_hit()
+
+
+
+    def do_collision( self ):
+        if self.get_lives() == 0:
+            self.kill()
+        else:
+            self.set_lives( self.get_lives() - 1 )
+    # do_collision()
+
+    
+
+    def is_dead( self ):
+        return self.get_lives() == 0
+    # is_dead()
+
+
+
+    def accel_top( self ):
+        self.speed[ 1 ] -= self.acceleration[ 1 ]
+    # accel_top
+
+
+
+    def accel_bottom( self ):
+        self.speed[ 1 ] += self.acceleration[ 1 ]
+    # accel_bottom
+
+
+
+    def accel_left( self ):        
+        self.speed[ 0 ] -= self.acceleration[ 0 ]
+    # accel_left
+
+
+
+    def accel_right( self ):
+        self.speed[ 0 ] += self.acceleration[ 0 ]
+    # accel_right
+# Ship
+
+
+
+class Enemy( Ship ):
+    __slots__ = ()
+
+    def __init__( self, position, lives=0, speed=None, image=None ):
+        if not image:
+            image = "inimigo.png"
+        Ship.__init__( self, position, lives, speed, image )
+    # __init__()
+# Enemy
+
+
+
+
+class Player( Ship ):
+    """
+    A classe Player é uma classe derivada da classe GameObject.
+       No entanto, o personagem não morre quando passa da borda, este só
+    interrompe o seu movimento (vide update()).
+       E possui experiência, que o fará mudar de nivel e melhorar seu tiro.
+       A função get_pos() só foi redefinida para que os tiros não saissem da
+    parte da frente da nave do personagem, por esta estar virada ao contrário
+    das outras.
+       A função fire() foi redefinida para levar em conta a experiência do
+    jogador (quanto mais experiência, mais tiros).
+    """
+    __slots__ = ( "XP", )
+
+    def __init__( self, position, lives=10, image=None ):
+        if not image:
+            image = "nave.png"
+        Ship.__init__( self, position, lives, [ 0, 0 ], image )
+        self.set_XP( 0 )
+    # __init__()
+
+
+    
+    def update( self, dt ):
+        self.move( dt )
+        pos = self.rect.topleft
+        
+        if ( self.rect.right > self.area.right ):
+            self.rect.right = self.area.right
+            
+        elif ( self.rect.left < 0 ):
+            self.rect.left = 0
+            
+        if ( self.rect.bottom > self.area.bottom ):
+            self.rect.bottom = self.area.bottom
+            
+        elif ( self.rect.top < 0 ):
+            self.rect.top = 0
+
+        if self.rect.topleft != pos:
+            self.fx = float( self.rect.x )
+            self.fy = float( self.rect.y )
+    # update()
+
+
+    
+    def get_pos( self ):
+        return ( self.rect.center[ 0 ], self.rect.top )
+    # get_pos()
+
+
+    
+    def get_XP( self ):
+        return self.XP
+    # get_XP()
+
+    
+
+    def set_XP( self, XP ):
+        self.XP = XP
+    # get_XP()
+
+
+    def fire( self, fire_list, image=None ):
+        l = 1
+        if self.XP > 3: l = 3
+        if self.XP > 50: l = 5
+        if self.XP > 100: l = 7
+        
+        p      = self.get_pos()
+        speeds = self.get_fire_speed( l )
+        for s in speeds:
+            spawn_fire( p, s, image, fire_list )
+    # fire()
+
+
+
+    def get_fire_speed( self, shots ):
+        speeds = []
+
+        if shots <= 0:
+            return speeds
+        
+        if shots == 1:
+            speeds += [ (  0, -5 ) ]
+            
+        if shots > 1 and shots <= 3:
+            speeds += [ (  0, -5 ) ]
+            speeds += [ ( -2, -3 ) ]
+            speeds += [ (  2, -3 ) ]
+            
+        if shots > 3 and shots <= 5:
+            speeds += [ (  0, -5 ) ]
+            speeds += [ ( -2, -3 ) ]
+            speeds += [ (  2, -3 ) ]
+            speeds += [ ( -4, -2 ) ]
+            speeds += [ (  4, -2 ) ]
+
+        if shots > 6 and shots <= 9:
+            speeds += [ (  0, -5 ) ]
+            speeds += [ ( -2, -3 ) ]
+            speeds += [ (  2, -3 ) ]
+            speeds += [ ( -4, -2 ) ]
+            speeds += [ (  4, -2 ) ]
+            speeds += [ ( -6, -1 ) ]
+            speeds += [ (  6, -1 ) ]
+        return speeds
+    # get_fire_speed()
+# Player
+
+
+
+
+class Background:
+    """
+    Esta classe representa o ator "Fundo" do jogo.
+
+    Ela poreria ser herdeira de GameObject, porém como ela não precisa de todos
+    aqueles recursos, implemento somente alguns métodos (update() e draw())
+    """
+    image           = None
+    pos             = None
+    scroll_interval = 1
+    moved           = True
+    
+    def __init__( self, image="tile.png", scroll_interval=1 ):
+        """
+        Com essa função criamos uma superfície, formada de uma repetição da
+        imagem passada, de forma a cobrir a tela e um pouco mais.
+
+        Aqui é o único lugar onde podemos carregar a imagem, utilizando
+            load( image ).convert(),
+        este comando não tem nenhuma relação com o formato de arquivo da
+        imagem. Ele converte a imagem para o formato do pixel[1] da tela,
+        representando um ganho de até 6X na performance final[2].
+
+        [1] Formato de Pixel: Toda imagem é formada por um conjunto de pixels,
             estes são descritos por uma quantidade de bits que representam as
             cores. Em geral utiliza-se RGB (Red, Green, Blue) ou RGBA (RGB +
             Aplha/Transparência).    Em geral a tela tem um formato de 16 BPP
@@ -369,312 +1516,4337 @@ class Background:
             necessidade de converter a cada "blit".
         """
 
-        if isinstance( image, str ):
-            image = os.path.join( images_dir, image )
-            image = pygame.image.load( image ).convert()
+        if isinstance( image, str ):
+            image = image_cache.load( image, alpha=False )
+
+        self.isize = image.get_size()
+        self.pos = [ 0, -1 * self.isize[ 1 ] ]
+        screen      = pygame.display.get_surface()
+        screen_size = screen.get_size()
+
+        from math import ceil
+        w = ( ceil( float( screen_size[ 0 ] ) // self.isize[ 0 ] ) + 1 ) * \
+            self.isize[ 0 ]
+        h = ( ceil( float( screen_size[ 1 ] ) // self.isize[ 1 ] ) + 1 ) * \
+            self.isize[ 1 ]
+        w = 800
+        h = 800
+        back = pygame.Surface( ( w, h ) )
+	
+        for i in range( ( back.get_size()[ 0 ] // self.isize[ 0 ] ) ):
+            for j in range( ( back.get_size()[ 1 ] // self.isize[ 1 ] ) ):
+                back.blit( image, ( i * self.isize[ 0 ], j * self.isize[ 1 ] ) )
+
+        self.image = back
+
+        # O fundo rola scroll_interval pixels a cada scroll_interval quadros,
+        # mantendo a mesma velocidade média. Com 0 o fundo fica parado.
+        # Enquanto ele não se move, a tela pode ser atualizada somente nas
+        # regiões que mudaram (veja DirtyRenderer).
+        self.scroll_interval = scroll_interval
+        self.frames          = 0
+        self.moved           = True
+    # __init__()
+
+
+
+    def update( self, dt ):
+        self.frames += 1
+        self.moved   = False
+        if ( not self.scroll_interval ) or \
+               ( self.frames % self.scroll_interval ):
+            return
+
+        self.pos[ 1 ] += self.scroll_interval
+        if ( self.pos[ 1 ] > 0 ):
+            self.pos[ 1 ] -= self.isize[ 1 ]
+        self.moved = True
+    # update()
+
+
+
+    def draw( self, screen ):
+        screen.blit( self.image, self.pos )
+    # draw()
+
+
+
+    def restore( self, screen, rect ):
+        """
+        Redesenha somente a parte do fundo que fica sob rect. Tem a mesma
+        assinatura esperada por pygame.sprite.Group.clear().
+        """
+        if isinstance( screen, WorldView ):
+            screen.restore( self.image, self.pos, rect )
+            return
+        screen.blit( self.image, rect,
+                     rect.move( - self.pos[ 0 ], - self.pos[ 1 ] ) )
+    # restore()
+# Background
+
+
+
+
+class BackgroundPrefetcher:
+    """
+    Prepara os fundos dos próximos níveis antes que eles sejam necessários.
+
+    Criar um Background significa carregar a imagem e preencher uma
+    superfície de 800x800 com ela, o que provoca uma parada visível se for
+    feito no meio do quadro em que o jogador sobe de nível. prefetch() monta
+    o fundo em uma thread separada e get() entrega o fundo pronto (ou
+    espera a thread terminar, ou, no pior caso, monta na hora).
+    """
+    def __init__( self, scroll_interval=1 ):
+        self.scroll_interval = scroll_interval
+        self.ready           = {}
+        self.threads         = {}
+    # __init__()
+
+
+
+    def build( self, image ):
+        self.ready[ image ] = Background( image, self.scroll_interval )
+    # build()
+
+
+
+    def prefetch( self, image ):
+        if image in self.ready or image in self.threads:
+            return
+        thread = threading.Thread( target=self.build, args=( image, ),
+                                   daemon=True )
+        self.threads[ image ] = thread
+        thread.start()
+    # prefetch()
+
+
+
+    def get( self, image ):
+        thread = self.threads.pop( image, None )
+        if thread:
+            thread.join()
+        background = self.ready.pop( image, None )
+        if background is None:
+            background = Background( image, self.scroll_interval )
+        return background
+    # get()
+# BackgroundPrefetcher
+
+
+
+class DirtyRenderer:
+    """
+    Desenha somente as regiões da tela que mudaram desde o quadro anterior.
+
+    Os grupos precisam ser pygame.sprite.RenderUpdates, que lembram onde cada
+    sprite foi desenhado. A cada quadro apagamos (com o próprio fundo) as
+    posições antigas dos sprites e do HUD, desenhamos tudo de novo e
+    enviamos para o display apenas esses retângulos com
+    pygame.display.update( rects ), em vez de copiar a tela inteira.
+
+    Quando o fundo rola, a tela inteira muda e não há o que economizar:
+    nesse caso fazemos o desenho completo e o pygame.display.flip(). O
+    primeiro quadro também é completo, para apagar a tela de carregamento.
+    """
+    def __init__( self, screen ):
+        self.screen       = screen
+        self.full         = True
+        self.hud_rects    = []
+        self.full_frames  = 0
+        self.dirty_frames = 0
+        self.dirty_area   = 0
+    # __init__()
+
+
+
+    def draw( self, game ):
+        background = game.background
+        if background.moved or self.full:
+            self.draw_full( game )
+            return
+
+        # Os sprites vão para o mundo (game.world); todos os retângulos,
+        # inclusive os do HUD, estão nas coordenadas da tela
+        world = game.world
+        rects = []
+        for rect in self.hud_rects:
+            background.restore( world, rect )
+        rects.extend( self.hud_rects )
+        for group in game.list.values():
+            group.clear( world, background.restore )
+        if game.particles is not None:
+            game.particles.clear( world, background.restore )
+
+        for group in game.list.values():
+            rects.extend( group.draw( world ) )
+        if game.particles is not None:
+            rects.extend( game.draw_particles() )
+        self.hud_rects = game.draw_hud()
+        rects.extend( self.hud_rects )
+
+        game.present( rects )
+        self.dirty_frames += 1
+        self.dirty_area   += sum( r.w * r.h for r in rects )
+    # draw()
+
+
+
+    def draw_full( self, game ):
+        game.actors_draw()
+        self.hud_rects = game.draw_hud()
+        game.present()
+        self.full         = False
+        self.full_frames += 1
+    # draw_full()
+
+
+
+    def get_stats( self ):
+        area = self.screen.get_width() * self.screen.get_height()
+        avg  = 0.0
+        if self.dirty_frames:
+            avg = 100.0 * self.dirty_area / ( self.dirty_frames * area )
+        return { "full"  : self.full_frames,
+                 "dirty" : self.dirty_frames,
+                 "area"  : avg }
+    # get_stats()
+# DirtyRenderer
+
+
+
+class ScaledDisplay:
+    """
+    Tela interna de tamanho fixo, ampliada para o display na apresentação.
+
+    O jogo (fundo, sprites e HUD) é desenhado em canvas, uma superfície fora
+    da tela com a resolução interna (os sprites e o fundo passam por uma
+    WorldView, que reduz as posições e as imagens do mundo, que continua
+    na resolução do display), e present() amplia o resultado para o
+    display com pygame.transform.scale() (ou smoothscale(), que suaviza mas
+    custa mais). Assim o custo do desenho depende só da resolução interna e
+    não do tamanho da janela ou do monitor.
+
+    Com integer=True o fator de ampliação é arredondado para baixo para um
+    inteiro e a imagem fica centralizada, com bordas pretas: cada pixel vira
+    um bloco de k x k pixels, sem distorção.
+    """
+    def __init__( self, display, size, smooth=False, integer=False ):
+        self.display = display
+        self.canvas  = pygame.Surface( size ).convert()
+        self.smooth  = smooth
+        self.presented = 0
+
+        dw, dh = display.get_size()
+        w, h   = size
+        k      = min( float( dw ) / w, float( dh ) / h )
+        if integer:
+            k = max( 1, int( k ) )
+        self.factor = k
+        self.dest   = pygame.Rect( 0, 0, int( w * k ), int( h * k ) )
+        self.dest.center = display.get_rect().center
+        self.target = display.subsurface( self.dest.clip( display.get_rect() ) )
+        display.fill( ( 0, 0, 0 ) )
+    # __init__()
+
+
+
+    def scale( self, source, target ):
+        if self.smooth and source.get_bitsize() >= 24:
+            pygame.transform.smoothscale( source, target.get_size(), target )
+        else:
+            pygame.transform.scale( source, target.get_size(), target )
+    # scale()
+
+
+
+    def present( self, rects=None ):
+        """
+        Amplia o canvas para o display e atualiza a tela. Com rects, só
+        essas regiões do canvas são ampliadas e enviadas ao display.
+        """
+        self.presented += 1
+        if rects is None:
+            self.scale( self.canvas, self.target )
+            pygame.display.flip()
+            return
+
+        k      = self.factor
+        ox, oy = self.dest.topleft
+        canvas = self.canvas.get_rect()
+        bounds = self.target.get_rect()
+        update = []
+        for rect in rects:
+            rect = rect.clip( canvas )
+            if not rect.w or not rect.h:
+                continue
+            x0 = int( rect.left * k )
+            y0 = int( rect.top * k )
+            x1 = int( floor( rect.right * k + 0.999 ) )
+            y1 = int( floor( rect.bottom * k + 0.999 ) )
+            dest = pygame.Rect( x0, y0, x1 - x0, y1 - y0 ).clip( bounds )
+            self.scale( self.canvas.subsurface( rect ),
+                        self.target.subsurface( dest ) )
+            update.append( dest.move( ox, oy ) )
+        pygame.display.update( update )
+    # present()
+
+
+
+    @staticmethod
+    def calibrate( display, target_ms, factors=( 1, 1.5, 2, 3, 4 ),
+                   smooth=False, integer=False, samples=10 ):
+        """
+        Escolhe o menor fator de redução (maior resolução interna) cujo
+        quadro de teste, fundo completo mais a ampliação, cabe em
+        target_ms. Retorna o tamanho interno escolhido.
+        """
+        dw, dh     = display.get_size()
+        background = image_cache.load( "tile.png", alpha=False )
+        size       = None
+        for factor in factors:
+            size   = ( int( dw / factor ), int( dh / factor ) )
+            scaled = ScaledDisplay( display, size, smooth, integer )
+            canvas = scaled.canvas
+            tw, th = background.get_size()
+            tiles  = [ ( background, ( x, y ) )
+                       for x in range( 0, size[ 0 ], tw )
+                       for y in range( 0, size[ 1 ], th ) ]
+            start  = time.perf_counter()
+            for i in range( samples ):
+                canvas.blits( tiles, False )
+                scaled.scale( canvas, scaled.target )
+            cost = ( time.perf_counter() - start ) * 1000.0 / samples
+            if cost <= target_ms:
+                break
+        display.fill( ( 0, 0, 0 ) )
+        return size
+    # calibrate()
+
+
+
+    def get_stats( self ):
+        return { "size"      : self.canvas.get_size(),
+                 "display"   : self.display.get_size(),
+                 "factor"    : self.factor,
+                 "presented" : self.presented }
+    # get_stats()
+# ScaledDisplay
+
+
+
+class WorldView:
+    """
+    Desenha o mundo do jogo, que está sempre na resolução lógica (a do
+    display), na tela interna menor de um ScaledDisplay.
+
+    Tem a parte da interface de Surface usada pelos grupos de sprites, pelo
+    fundo e pelos tiros (blit() e blits()), então pode ser passada no lugar
+    da tela: as posições são multiplicadas por scale e as imagens trocadas
+    por cópias reduzidas, feitas uma única vez por imagem. Os retângulos
+    devolvidos já estão nas coordenadas da tela interna, as mesmas usadas
+    por ScaledDisplay.present() e por restore().
+
+    A simulação (posições, colisões, área do jogo) não sabe da redução.
+    """
+    def __init__( self, canvas, size, smooth=False ):
+        self.canvas = canvas
+        self.size   = tuple( size )
+        self.smooth = smooth
+        cw, ch      = canvas.get_size()
+        self.scale  = ( float( cw ) / size[ 0 ], float( ch ) / size[ 1 ] )
+        # Fracas: os fundos de cada nível são superfícies novas a cada
+        # partida, e a cópia reduzida vai embora junto com o original
+        self.images = weakref.WeakKeyDictionary()
+        self.scaled = 0
+    # __init__()
+
+
+
+    def get_size( self ):
+        return self.size
+    # get_size()
+
+
+
+    def get_rect( self ):
+        return pygame.Rect( ( 0, 0 ), self.size )
+    # get_rect()
+
+
+
+    def image( self, surface ):
+        image = self.images.get( surface )
+        if image is None:
+            sx, sy = self.scale
+            w, h   = surface.get_size()
+            size   = ( max( 1, int( round( w * sx ) ) ),
+                       max( 1, int( round( h * sy ) ) ) )
+            if self.smooth and surface.get_bitsize() >= 24:
+                image = pygame.transform.smoothscale( surface, size )
+            else:
+                image = pygame.transform.scale( surface, size )
+            self.images[ surface ] = image
+            self.scaled += 1
+        return image
+    # image()
+
+
+
+    def point( self, pos ):
+        sx, sy = self.scale
+        return ( floor( pos[ 0 ] * sx ), floor( pos[ 1 ] * sy ) )
+    # point()
+
+
+
+    def area( self, rect ):
+        # Retângulo reduzido que cobre todo o rect original
+        if rect is None:
+            return None
+        sx, sy = self.scale
+        x, y   = floor( rect[ 0 ] * sx ), floor( rect[ 1 ] * sy )
+        return pygame.Rect( x, y, ceil( ( rect[ 0 ] + rect[ 2 ] ) * sx ) - x,
+                            ceil( ( rect[ 1 ] + rect[ 3 ] ) * sy ) - y )
+    # area()
+
+
+
+    def blit( self, source, dest, area=None, special_flags=0 ):
+        return self.canvas.blit( self.image( source ), self.point( dest ),
+                                 self.area( area ), special_flags )
+    # blit()
+
+
+
+    def blits( self, blit_sequence, doreturn=True ):
+        image = self.image
+        point = self.point
+        area  = self.area
+        return self.canvas.blits(
+            [ ( image( b[ 0 ] ), point( b[ 1 ] ) ) +
+              ( ( area( b[ 2 ] ), ) + tuple( b[ 3 : ] ) if len( b ) > 2
+                else () )
+              for b in blit_sequence ], doreturn )
+    # blits()
+
+
+
+    def restore( self, image, pos, rect ):
+        """
+        Redesenha em rect, já nas coordenadas da tela interna, a parte de
+        image (desenhada em pos, coordenadas do mundo) que fica sob ele.
+        """
+        x, y = self.point( pos )
+        self.canvas.blit( self.image( image ), rect, rect.move( - x, - y ) )
+    # restore()
+# WorldView
+
+
+
+class MaskCache:
+    """
+    Máscaras de colisão (pygame.mask) das imagens, para testes de colisão
+    exatos.
+
+    A máscara depende só da imagem, então é criada uma única vez por
+    superfície e compartilhada por todos os sprites que a usam (as imagens
+    já vêm compartilhadas do ImageCache). O teste com máscaras só é feito
+    depois que o teste de retângulos, bem mais barato, já deu positivo.
+    """
+    def __init__( self ):
+        self.masks   = {}
+        self.created = 0
+        self.tests   = 0
+        self.hits    = 0
+    # __init__()
+
+
+
+    def get( self, image ):
+        mask = self.masks.get( image )
+        if mask is None:
+            mask = self.masks[ image ] = pygame.mask.from_surface( image )
+            self.created += 1
+        return mask
+    # get()
+
+
+
+    def overlap( self, image_a, pos_a, image_b, pos_b ):
+        """
+        Testa se as partes opacas das duas imagens, desenhadas nas posições
+        dadas, se sobrepõem. Os retângulos já devem colidir.
+        """
+        self.tests += 1
+        offset = ( pos_b[ 0 ] - pos_a[ 0 ], pos_b[ 1 ] - pos_a[ 1 ] )
+        if self.get( image_a ).overlap( self.get( image_b ), offset ):
+            self.hits += 1
+            return True
+        return False
+    # overlap()
+
+
+
+    def collide( self, a, b ):
+        return self.overlap( a.image, a.rect.topleft, b.image, b.rect.topleft )
+    # collide()
+
+
+
+    def clear( self ):
+        self.masks.clear()
+    # clear()
+
+
+
+    def get_stats( self ):
+        return { "masks" : len( self.masks ),
+                 "tests" : self.tests,
+                 "hits"  : self.hits }
+    # get_stats()
+# MaskCache
+
+mask_cache = MaskCache()
+
+
+
+class SpatialHash:
+    """
+    Grade uniforme usada para reduzir os testes de colisão.
+
+    Em vez de testar cada tiro contra cada inimigo (n * m testes), os
+    sprites de um grupo são distribuídos nas células de uma grade de acordo
+    com o seu rect e cada tiro é testado somente contra os sprites das
+    células que ele toca. A grade é refeita a cada chamada de
+    groupcollide(), a partir dos rects atuais.
+
+    Os métodos groupcollide() e spritecollide() têm a mesma semântica dos
+    equivalentes em pygame.sprite. Com exact=True os pares cujos
+    retângulos colidem ainda passam pelo teste de máscaras (MaskCache). Os
+    contadores candidates e hits mostram quantos pares foram de fato
+    testados e quantos colidiram.
+    """
+    def __init__( self, cell_size=64 ):
+        self.cell_size  = cell_size
+        self.cells      = {}
+        self.candidates = 0
+        self.hits       = 0
+    # __init__()
+
+
+
+    def cells_for( self, rect ):
+        c  = self.cell_size
+        x0 = rect.left // c
+        x1 = ( rect.right - 1 ) // c
+        y0 = rect.top // c
+        y1 = ( rect.bottom - 1 ) // c
+        for x in range( x0, x1 + 1 ):
+            for y in range( y0, y1 + 1 ):
+                yield ( x, y )
+    # cells_for()
+
+
+
+    def build( self, sprites ):
+        self.cells = cells = {}
+        for sprite in sprites:
+            for cell in self.cells_for( sprite.rect ):
+                if cell in cells:
+                    cells[ cell ].append( sprite )
+                else:
+                    cells[ cell ] = [ sprite ]
+    # build()
+
+
+
+    def query( self, rect ):
+        """
+        Retorna os sprites que compartilham alguma célula com rect, sem
+        repetições e na ordem em que foram inseridos.
+        """
+        cells = self.cells
+        found = {}
+        for cell in self.cells_for( rect ):
+            for sprite in cells.get( cell, () ):
+                found[ sprite ] = None
+        return found
+    # query()
+
+
+
+    def collide( self, sprite, exact=False ):
+        rect       = sprite.rect
+        candidates = self.query( rect )
+        self.candidates += len( candidates )
+        hits = [ o for o in candidates if rect.colliderect( o.rect ) ]
+        if exact and hits:
+            hits = [ o for o in hits if mask_cache.collide( sprite, o ) ]
+        self.hits += len( hits )
+        return hits
+    # collide()
+
+
+
+    def groupcollide( self, groupa, groupb, dokilla, dokillb, exact=False ):
+        crashed = {}
+        if not groupa or not groupb:
+            return crashed
+
+        self.build( groupb )
+        for a in groupa.sprites():
+            c = self.collide( a, exact )
+            if c:
+                crashed[ a ] = c
+                if dokilla:
+                    a.kill()
+                if dokillb:
+                    for b in c:
+                        b.kill()
+        return crashed
+    # groupcollide()
+
+
+
+    def spritecollide( self, sprite, group, dokill, exact=False ):
+        # Com um único sprite não compensa montar a grade: o teste contra a
+        # lista de rects já é feito em C pelo pygame
+        sprites = group.sprites()
+        self.candidates += len( sprites )
+        idx = sprite.rect.collidelistall( [ o.rect for o in sprites ] )
+        c = [ sprites[ i ] for i in idx ]
+        if exact and c:
+            c = [ o for o in c if mask_cache.collide( sprite, o ) ]
+        self.hits += len( c )
+        if dokill:
+            for o in c:
+                o.kill()
+        return c
+    # spritecollide()
+
+
+
+    def get_stats( self ):
+        return { "candidates" : self.candidates,
+                 "hits"       : self.hits }
+    # get_stats()
+# SpatialHash
+
+
+
+class Hud:
+    """
+    Textos do HUD (vidas, XP, nível) com cache das superfícies renderizadas.
+
+    Renderizar texto com font.render() é caro, e os valores do HUD mudam
+    raramente. Os rótulos ("Vidas: ", "XP: ", ...) são renderizados uma
+    única vez e os números são montados a partir de um cache de glifos, um
+    para cada caractere, de modo que um valor novo não precisa passar pela
+    fonte de novo.
+
+    Com composite=True o HUD inteiro é montado em uma única superfície, que
+    só é refeita quando algum valor muda; nos outros quadros basta um blit.
+    """
+    line_height = 25
+
+    def __init__( self, font, pos=( 10, 10 ), color=( 255, 255, 255 ),
+                  composite=True, max_size=64 ):
+        self.font      = font
+        self.pos       = pos
+        self.color     = color
+        self.composite = composite
+        self.max_size  = max_size
+        self.texts     = OrderedDict()
+        self.glyphs    = {}
+        self.fields    = None
+        self.surface   = None
+        self.renders   = 0
+        self.rebuilds  = 0
+    # __init__()
+
+
+
+    def text( self, text ):
+        surface = self.texts.get( text )
+        if surface is None:
+            surface = self.font.render( text, True, self.color )
+            self.renders += 1
+            self.texts[ text ] = surface
+            if len( self.texts ) > self.max_size:
+                self.texts.popitem( last=False )
+        else:
+            self.texts.move_to_end( text )
+        return surface
+    # text()
+
+
+
+    def glyph( self, char ):
+        surface = self.glyphs.get( char )
+        if surface is None:
+            surface = self.font.render( char, True, self.color )
+            self.renders += 1
+            self.glyphs[ char ] = surface
+        return surface
+    # glyph()
+
+
+
+    def line_size( self, label, value ):
+        w, h = self.text( label ).get_size()
+        for char in str( value ):
+            g  = self.glyph( char )
+            w += g.get_width()
+            h  = max( h, g.get_height() )
+        return w, h
+    # line_size()
+
+
+
+    def draw_line( self, screen, pos, label, value ):
+        rect = screen.blit( self.text( label ), pos )
+        x    = rect.right
+        for char in str( value ):
+            rect.union_ip( screen.blit( self.glyph( char ), ( x, pos[ 1 ] ) ) )
+            x = rect.right
+        return rect
+    # draw_line()
+
+
+
+    def build( self, fields ):
+        sizes = [ self.line_size( label, value ) for label, value in fields ]
+        w = max( s[ 0 ] for s in sizes )
+        h = self.line_height * ( len( fields ) - 1 ) + sizes[ -1 ][ 1 ]
+        self.surface = pygame.Surface( ( w, h ), SRCALPHA )
+        for i, ( label, value ) in enumerate( fields ):
+            self.draw_line( self.surface, ( 0, i * self.line_height ),
+                            label, value )
+        self.fields    = fields
+        self.rebuilds += 1
+    # build()
+
+
+
+    def draw( self, screen, fields ):
+        """
+        Desenha os campos ( rótulo, valor ) e retorna os retângulos da tela
+        que foram alterados.
+        """
+        if not fields:
+            return []
+
+        if self.composite:
+            if fields != self.fields:
+                self.build( fields )
+            return [ screen.blit( self.surface, self.pos ) ]
+
+        x, y = self.pos
+        return [ self.draw_line( screen, ( x, y + i * self.line_height ),
+                                 label, value )
+                 for i, ( label, value ) in enumerate( fields ) ]
+    # draw()
+# Hud
+
+
+
+class FrameProfiler:
+    """
+    Mede quanto tempo cada fase do quadro leva.
+
+    Os tempos de cada quadro (em milissegundos) e o número de objetos em
+    cada grupo são guardados em um buffer circular com os últimos
+    `size` quadros, de onde saem os percentis mostrados no overlay
+    (tecla F3). Se for dado um arquivo, cada quadro também é enviado para
+    uma thread que grava o arquivo, para que a escrita em disco não pese no
+    laço principal: .csv grava uma linha por quadro e .json grava, ao
+    final, todos os quadros e um resumo com os percentis.
+    """
+    phases = ( "handle_events", "actors_update", "actors_act", "manage",
+               "actors_draw", "draw_hud", "flip" )
+
+    def __init__( self, size=600, filename=None, overlay=False ):
+        self.samples  = deque( maxlen=size )
+        self.peaks    = {}
+        self.current  = None
+        self.overlay  = overlay
+        self.surface  = None
+        self.font     = None
+        self.frames   = 0
+        self.filename = filename
+        self.queue    = None
+        self.writer   = None
+        if filename:
+            self.queue  = queue.Queue()
+            self.writer = threading.Thread( target=self.write,
+                                            daemon=True )
+            self.writer.start()
+    # __init__()
+
+
+
+    def begin_frame( self ):
+        self.current = dict.fromkeys( self.phases, 0.0 )
+        self.start   = time.perf_counter()
+        return self.start
+    # begin_frame()
+
+
+
+    def mark( self, phase, start ):
+        """
+        Soma à fase o tempo decorrido desde start e retorna o tempo atual,
+        que serve de início para a próxima fase.
+        """
+        now = time.perf_counter()
+        self.current[ phase ] += ( now - start ) * 1000.0
+        return now
+    # mark()
+
+
+
+    def end_frame( self, counts ):
+        sample = self.current
+        sample[ "total" ] = ( time.perf_counter() - self.start ) * 1000.0
+        sample.update( counts )
+        self.samples.append( sample )
+        peaks = self.peaks
+        for key, value in counts.items():
+            if value > peaks.get( key, 0 ):
+                peaks[ key ] = value
+        self.frames += 1
+        if self.queue:
+            self.queue.put( sample )
+    # end_frame()
+
+
+
+    def percentiles( self, key, ps=( 50, 95, 99 ) ):
+        values = sorted( s[ key ] for s in self.samples )
+        return [ percentile( values, p ) for p in ps ]
+    # percentiles()
+
+
+
+    def summary( self ):
+        return { key: dict( zip( ( "p50", "p95", "p99" ),
+                                 self.percentiles( key ) ) )
+                 for key in self.phases + ( "total", ) }
+    # summary()
+
+
+
+    def toggle_overlay( self ):
+        self.overlay = not self.overlay
+    # toggle_overlay()
+
+
+
+    def draw( self, screen ):
+        """
+        Desenha o overlay no canto superior direito. O texto só é refeito a
+        cada 15 quadros, nos outros é só um blit.
+        """
+        if not self.overlay or not self.samples:
+            return []
+
+        if self.surface is None or self.frames % 15 == 0:
+            if self.font is None:
+                self.font = pygame.font.Font( None, 18 )
+            lines = [ "%-14s %6s %6s %6s" % ( "ms", "p50", "p95", "p99" ) ]
+            for key in self.phases + ( "total", ):
+                lines.append( "%-14s %6.2f %6.2f %6.2f" %
+                              ( ( key, ) + tuple( self.percentiles( key ) ) ) )
+            last = self.samples[ -1 ]
+            lines.append( " ".join( "%s:%d" % ( k, v ) for k, v in last.items()
+                                    if isinstance( v, int ) ) )
+            surfaces = [ self.font.render( l, True, ( 255, 255, 0 ) )
+                         for l in lines ]
+            w = max( s.get_width() for s in surfaces )
+            h = sum( s.get_height() for s in surfaces )
+            self.surface = pygame.Surface( ( w + 8, h + 8 ), SRCALPHA )
+            self.surface.fill( ( 0, 0, 0, 160 ) )
+            y = 4
+            for s in surfaces:
+                self.surface.blit( s, ( 4, y ) )
+                y += s.get_height()
+
+        x = screen.get_width() - self.surface.get_width() - 10
+        return [ screen.blit( self.surface, ( x, 10 ) ) ]
+    # draw()
+
+
+
+    def write( self ):
+        if self.filename.endswith( ".json" ):
+            frames = []
+            while True:
+                sample = self.queue.get()
+                if sample is None:
+                    break
+                frames.append( sample )
+            with open( self.filename, "w" ) as f:
+                json.dump( { "frames": frames, "summary": self.summary() },
+                           f, indent=1 )
+            return
+
+        with open( self.filename, "w", newline="" ) as f:
+            out = None
+            while True:
+                sample = self.queue.get()
+                if sample is None:
+                    break
+                if out is None:
+                    out = csv.DictWriter( f, fieldnames=list( sample ) )
+                    out.writeheader()
+                out.writerow( sample )
+    # write()
+
+
+
+    def close( self ):
+        if self.writer:
+            self.queue.put( None )
+            self.writer.join()
+            self.writer = None
+    # close()
+# FrameProfiler
+
+
+
+class WaveScheduler:
+    """
+    Linha do tempo dos eventos de criação e de tiro dos inimigos.
+
+    Em vez de sortear a cada quadro se algum inimigo aparece ou atira
+    (e de percorrer todos os inimigos para isso), os eventos são planejados
+    com antecedência e guardados em um heap ordenado pelo quadro em que
+    devem acontecer. due() só retira os eventos daquele quadro, então o
+    custo por quadro depende do número de eventos, não do número de
+    inimigos vivos.
+
+    A criação de inimigos segue a onda (wave) do nível atual, um dicionário
+    com os parâmetros (veja Game.waves) e é planejada `horizon` quadros à
+    frente. Cada inimigo criado recebe o seu próprio evento de tiro, que se
+    reagenda sozinho enquanto ele estiver vivo. Os números aleatórios vêm
+    do gerador do jogo, sorteados em lotes.
+    """
+    SPAWN = 0
+    FIRE  = 1
+
+    def __init__( self, random, horizon=300, batch=256 ):
+        self.random     = random
+        self.horizon    = horizon
+        self.batch      = batch
+        self.numbers    = []
+        self.events     = []
+        self.seq        = 0
+        self.wave       = None
+        self.generation = 0
+        self.planned    = 0
+        self.processed  = 0
+    # __init__()
+
+
+
+    def rand( self ):
+        if not self.numbers:
+            r = self.random.random
+            self.numbers = [ r() for i in range( self.batch ) ]
+        return self.numbers.pop()
+    # rand()
+
+
+
+    def randint( self, a, b ):
+        return a + int( self.rand() * ( b - a + 1 ) )
+    # randint()
+
+
+
+    def push( self, frame, kind, payload ):
+        self.seq += 1
+        heapq.heappush( self.events, ( frame, self.seq, kind, payload ) )
+    # push()
+
+
+
+    def set_wave( self, wave, frame ):
+        """
+        Troca a onda atual. As criações já planejadas da onda anterior são
+        descartadas (os tiros dos inimigos vivos continuam).
+        """
+        self.wave        = wave
+        self.generation += 1
+        self.planned     = frame
+        self.plan( frame + self.horizon )
+    # set_wave()
+
+
+
+    def plan( self, until ):
+        wave = self.wave
+        while self.planned < until:
+            self.planned += self.randint( *wave[ "spawn_every" ] )
+            self.push( self.planned, self.SPAWN,
+                       ( self.generation, self.rand() ) )
+    # plan()
+
+
+
+    def watch( self, enemy, frame ):
+        self.push( frame + self.randint( *self.wave[ "fire_every" ] ),
+                   self.FIRE, enemy )
+    # watch()
+
+
+
+    def due( self, frame ):
+        """
+        Retorna os eventos que devem acontecer neste quadro, como uma lista
+        de ( SPAWN, posição sorteada entre 0 e 1 ) e ( FIRE, inimigo ).
+        """
+        if self.planned < frame + self.horizon // 2:
+            self.plan( frame + self.horizon )
+
+        events = []
+        heap   = self.events
+        while heap and heap[ 0 ][ 0 ] <= frame:
+            when, seq, kind, payload = heapq.heappop( heap )
+            self.processed += 1
+            if kind == self.SPAWN:
+                generation, r = payload
+                if generation == self.generation:
+                    events.append( ( kind, r ) )
+            elif payload.alive():
+                if self.rand() < self.wave[ "fire_chance" ]:
+                    events.append( ( kind, payload ) )
+                self.watch( payload, frame )
+        return events
+    # due()
+# WaveScheduler
+
+
+
+class InputMap:
+    """
+    Tabela que associa as teclas às ações do jogo.
+
+    As ações são nomes ("up", "fire", ...) que o Game traduz em chamadas de
+    método. A tabela pode ser alterada com bind() e unbind(), por exemplo
+    pela opção --bind da linha de comando. As teclas ligadas a "autofire"
+    também disparam continuamente enquanto estiverem pressionadas.
+    """
+    default_bindings = { K_ESCAPE : "quit",
+                         K_F3     : "overlay",
+                         K_SPACE  : "fire",
+                         K_RETURN : "fire",
+                         K_LCTRL  : "autofire",
+                         K_RCTRL  : "autofire",
+                         K_UP     : "up",
+                         K_w      : "up",
+                         K_DOWN   : "down",
+                         K_s      : "down",
+                         K_LEFT   : "left",
+                         K_a      : "left",
+                         K_RIGHT  : "right",
+                         K_d      : "right" }
+
+    actions = ( "quit", "overlay", "fire", "autofire",
+                "up", "down", "left", "right" )
+
+    def __init__( self, bindings=None ):
+        self.bindings = dict( self.default_bindings )
+        self.held     = ()
+        for key, action in bindings or ():
+            self.bind( key, action )
+        self.update_held()
+    # __init__()
+
+
+
+    def bind( self, key, action ):
+        if isinstance( key, str ):
+            key = pygame.key.key_code( key )
+        if action not in self.actions:
+            raise ValueError( "unknown action: %s" % action )
+        self.bindings[ key ] = action
+        self.update_held()
+    # bind()
+
+
+
+    def unbind( self, key ):
+        if isinstance( key, str ):
+            key = pygame.key.key_code( key )
+        self.bindings.pop( key, None )
+        self.update_held()
+    # unbind()
+
+
+
+    def update_held( self ):
+        self.held = tuple( k for k, a in self.bindings.items()
+                           if a == "autofire" )
+    # update_held()
+
+
+
+    def get( self, key ):
+        return self.bindings.get( key )
+    # get()
+# InputMap
+
+
+
+class HeldKeys( dict ):
+    """
+    Estado das teclas pressionadas para fontes de entrada sintéticas.
+
+    Funciona como o retorno de pygame.key.get_pressed(): indexado pelo
+    código da tecla e devolvendo False para as teclas que não estão
+    pressionadas.
+    """
+    def __missing__( self, key ):
+        return False
+    # __missing__()
+# HeldKeys
+
+
+
+class LiveInput:
+    """
+    Fonte de entrada padrão: lê os eventos do teclado de verdade.
+
+    Com use_queue() os eventos passam por uma fila: a thread principal lê o
+    SDL com pump() e a simulação, em outra thread, recebe os eventos em
+    poll(). O estado das teclas vem então dos próprios eventos.
+    """
+    queue = None
+    keys  = None
+
+    def use_queue( self ):
+        self.queue = queue.Queue()
+        self.keys  = HeldKeys()
+    # use_queue()
+
+
+
+    def pump( self ):
+        for event in pygame.event.get():
+            self.queue.put( event )
+    # pump()
+
+
+
+    def poll( self, frame ):
+        if self.queue is None:
+            return pygame.event.get()
+
+        events = []
+        while True:
+            try:
+                event = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if event.type == KEYDOWN:
+                self.keys[ event.key ] = True
+            elif event.type == KEYUP:
+                self.keys[ event.key ] = False
+            events.append( event )
+        return events
+    # poll()
+
+
+
+    def get_pressed( self ):
+        if self.keys is not None:
+            return self.keys
+        return pygame.key.get_pressed()
+    # get_pressed()
+
+
+
+    def close( self ):
+        pass
+    # close()
+# LiveInput
+
+
+
+class PumpedInput:
+    """
+    Envolve uma fonte de entrada que não lê o SDL (roteiro, aleatória,
+    reprodução) quando há uma janela.
+
+    A thread principal chama pump() a cada quadro: os eventos do SDL são
+    esvaziados, para a janela continuar respondendo, e só QUIT e ESC são
+    passados adiante, como QUIT, por uma fila. poll(), chamado pela
+    simulação (na mesma thread ou na do --threaded), junta esses eventos
+    aos da fonte.
+    """
+    def __init__( self, source ):
+        self.source = source
+        self.queue  = queue.Queue()
+    # __init__()
+
+
+
+    def pump( self ):
+        for event in pygame.event.get():
+            if event.type == QUIT or \
+                   ( event.type == KEYDOWN and event.key == K_ESCAPE ):
+                self.queue.put( pygame.event.Event( QUIT ) )
+    # pump()
+
+
+
+    def poll( self, frame ):
+        events = self.source.poll( frame )
+        while True:
+            try:
+                events.append( self.queue.get_nowait() )
+            except queue.Empty:
+                break
+        return events
+    # poll()
+
+
+
+    def get_pressed( self ):
+        return self.source.get_pressed()
+    # get_pressed()
+
+
+
+    def close( self ):
+        self.source.close()
+    # close()
+# PumpedInput
+
+
+
+class ScriptedInput:
+    """
+    Fonte de entrada que reproduz um roteiro de teclas.
+
+    O roteiro é uma lista de ( quadro, tipo, tecla ), onde tipo é KEYDOWN ou
+    KEYUP. Também pode ser lido de um arquivo texto com uma linha por
+    evento, no formato:
+
+        <quadro> down|up <nome da tecla>
+
+    por exemplo "10 down space" ou "42 up left".
+    """
+    def __init__( self, script ):
+        self.events = {}
+        self.keys   = HeldKeys()
+        for frame, t, k in script:
+            self.events.setdefault( frame, [] ).append( ( t, k ) )
+    # __init__()
+
+
+
+    @classmethod
+    def from_file( cls, filename ):
+        script = []
+        types  = { "down": KEYDOWN, "up": KEYUP }
+        with open( filename ) as f:
+            for line in f:
+                line = line.split( "#" )[ 0 ].split()
+                if not line:
+                    continue
+                frame, t, name = line[ 0 ], line[ 1 ], " ".join( line[ 2 : ] )
+                script.append( ( int( frame ), types[ t.lower() ],
+                                 pygame.key.key_code( name ) ) )
+        return cls( script )
+    # from_file()
+
+
+
+    def poll( self, frame ):
+        events = []
+        for t, k in self.events.pop( frame, () ):
+            self.keys[ k ] = ( t == KEYDOWN )
+            events.append( pygame.event.Event( t, key=k ) )
+        return events
+    # poll()
+
+
+
+    def get_pressed( self ):
+        return self.keys
+    # get_pressed()
+
+
+
+    def close( self ):
+        pass
+    # close()
+# ScriptedInput
+
+
+
+class RandomInput:
+    """
+    Fonte de entrada que aperta e solta teclas aleatoriamente.
+
+    Usa o seu próprio gerador, de forma que a mesma semente sempre produz a
+    mesma sequência de teclas.
+    """
+    move_keys = ( K_UP, K_DOWN, K_LEFT, K_RIGHT )
+    fire_keys = ( K_SPACE, K_LCTRL )
+
+    def __init__( self, seed=None ):
+        self.random = Random.Random( seed )
+        self.keys   = HeldKeys()
+    # __init__()
+
+
+
+    def poll( self, frame ):
+        events = []
+        for k in self.move_keys + self.fire_keys:
+            if self.random.random() < 0.03:
+                t = KEYUP if self.keys[ k ] else KEYDOWN
+                self.keys[ k ] = ( t == KEYDOWN )
+                events.append( pygame.event.Event( t, key=k ) )
+        return events
+    # poll()
+
+
+
+    def get_pressed( self ):
+        return self.keys
+    # get_pressed()
+
+
+
+    def close( self ):
+        pass
+    # close()
+# RandomInput
+
+
+
+def write_varint( f, n ):
+    """
+    Grava um inteiro não negativo usando 7 bits por byte (LEB128).
+    """
+    out = bytearray()
+    while True:
+        b  = n & 0x7f
+        n >>= 7
+        if n:
+            out.append( b | 0x80 )
+        else:
+            out.append( b )
+            break
+    f.write( out )
+# write_varint()
+
+
+
+def read_varint( f ):
+    n     = 0
+    shift = 0
+    while True:
+        b = f.read( 1 )
+        if not b:
+            raise EOFError
+        b = b[ 0 ]
+        n |= ( b & 0x7f ) << shift
+        if not ( b & 0x80 ):
+            return n
+        shift += 7
+# read_varint()
+
+
+
+class InputRecorder:
+    """
+    Grava a entrada de outra fonte (normalmente o teclado) em um arquivo,
+    para que a partida possa ser reproduzida depois com ReplayInput.
+
+    O arquivo começa com um cabeçalho com a semente, a resolução e a taxa
+    de simulação, seguido das outras opções que mudam a simulação
+    (settings, um objeto JSON precedido do seu tamanho em varint): tudo o
+    que é preciso para repetir a partida. Depois vem um registro por
+    quadro que teve eventos: a distância em quadros
+    para o registro anterior, o número de eventos e, para cada evento, o
+    tipo (um byte) e a tecla. Os números são gravados como varint, de modo
+    que um quadro com uma tecla ocupa só alguns bytes. Um registro com
+    zero eventos marca o último quadro da partida.
+
+    As teclas pressionadas (get_pressed) vêm dos próprios eventos gravados,
+    e não do teclado, para que a reprodução veja exatamente o mesmo estado.
+    """
+    magic   = b"NAVE"
+    version = 2
+    header  = struct.Struct( "<4sBqHHf" )
+    types   = { KEYDOWN: 0, KEYUP: 1, QUIT: 2 }
+
+    # Opções (nomes de parse_opts()) que também mudam a simulação. As de
+    # desenho (--scale, --dirty, --threaded, ...) podem mudar à vontade
+    # entre a gravação e a reprodução
+    settings = ( "autofire_interval", "exact", "bindings", "batched_fire" )
+
+    def __init__( self, source, filename, seed, size, sim_rate,
+                  settings=None ):
+        self.source = source
+        self.keys   = HeldKeys()
+        self.last   = 0
+        self.frame  = 0
+        self.file   = open( filename, "wb" )
+        self.file.write( self.header.pack( self.magic, self.version, seed,
+                                           size[ 0 ], size[ 1 ], sim_rate ) )
+        data = json.dumps( settings or {}, sort_keys=True ).encode( "utf-8" )
+        write_varint( self.file, len( data ) )
+        self.file.write( data )
+    # __init__()
+
+
+
+    def poll( self, frame ):
+        events = self.source.poll( frame )
+        self.frame = frame
+        record = []
+        for event in events:
+            t = self.types.get( event.type )
+            if t is None:
+                continue
+            key = getattr( event, "key", 0 )
+            if event.type == KEYDOWN:
+                self.keys[ key ] = True
+            elif event.type == KEYUP:
+                self.keys[ key ] = False
+            record.append( ( t, key ) )
+
+        if record:
+            f = self.file
+            write_varint( f, frame - self.last )
+            write_varint( f, len( record ) )
+            for t, key in record:
+                f.write( bytes( ( t, ) ) )
+                write_varint( f, key )
+            self.last = frame
+        return events
+    # poll()
+
+
+
+    def get_pressed( self ):
+        return self.keys
+    # get_pressed()
+
+
+
+    def close( self ):
+        if self.file:
+            write_varint( self.file, self.frame + 1 - self.last )
+            write_varint( self.file, 0 )
+            self.file.close()
+            self.file = None
+        self.source.close()
+    # close()
+# InputRecorder
+
+
+
+class ReplayInput:
+    """
+    Reproduz uma partida gravada por InputRecorder, entregando ao jogo os
+    mesmos eventos nos mesmos quadros. As opções gravadas ficam em seed,
+    size, sim_rate e settings, e substituem as da linha de comando.
+    """
+    def __init__( self, filename ):
+        types = dict( ( v, k ) for k, v in InputRecorder.types.items() )
+        with open( filename, "rb" ) as f:
+            head = f.read( InputRecorder.header.size )
+            magic, version, self.seed, w, h, self.sim_rate = \
+                InputRecorder.header.unpack( head )
+            if magic != InputRecorder.magic or \
+                   version != InputRecorder.version:
+                raise ValueError( "%s is not an input recording" % filename )
+            self.size     = ( w, h )
+            self.settings = json.loads(
+                f.read( read_varint( f ) ).decode( "utf-8" ) )
+            # O JSON não tem tuplas
+            for name in ( "exact", "bindings" ):
+                if name in self.settings:
+                    self.settings[ name ] = [ tuple( v ) for v in
+                                              self.settings[ name ] ]
+            self.events = {}
+            frame = 0
+            while True:
+                try:
+                    frame += read_varint( f )
+                    count  = read_varint( f )
+                except EOFError:
+                    break
+                if not count:
+                    break
+                events = self.events[ frame ] = []
+                for i in range( count ):
+                    t   = types[ f.read( 1 )[ 0 ] ]
+                    key = read_varint( f )
+                    events.append( ( t, key ) )
+        self.frames = frame
+        self.keys   = HeldKeys()
+    # __init__()
+
+
+
+    def poll( self, frame ):
+        events = []
+        for t, key in self.events.pop( frame, () ):
+            if t == KEYDOWN:
+                self.keys[ key ] = True
+            elif t == KEYUP:
+                self.keys[ key ] = False
+            if t == QUIT:
+                events.append( pygame.event.Event( t ) )
+            else:
+                events.append( pygame.event.Event( t, key=key ) )
+        return events
+    # poll()
+
+
+
+    def get_pressed( self ):
+        return self.keys
+    # get_pressed()
+
+
+
+    def close( self ):
+        pass
+    # close()
+# ReplayInput
+
+
+
+def percentile( values, p ):
+    """
+    Retorna o percentil p (0 a 100) de uma lista de valores já ordenada.
+    """
+    if not values:
+        return 0.0
+    i = int( round( ( len( values ) - 1 ) * p / 100.0 ) )
+    return values[ i ]
+# percentile()
+
+
+
+
+class Snapshot:
+    """
+    Tudo o que é preciso para desenhar um quadro, copiado do estado do jogo
+    pela thread da simulação (veja Game.run_pipeline()).
+
+    Depois de publicado, um Snapshot nunca é alterado: as listas e tuplas
+    são novas a cada passo e as superfícies (imagens dos sprites e do
+    fundo) são só lidas pelas duas threads.
+    """
+    __slots__ = ( "frame", "background", "background_pos", "blits",
+                  "particles", "hud" )
+
+    def __init__( self, frame, background, background_pos, blits,
+                  particles, hud ):
+        self.frame          = frame
+        self.background     = background
+        self.background_pos = background_pos
+        self.blits          = blits
+        self.particles      = particles
+        self.hud            = hud
+    # __init__()
+# Snapshot
+
+
+
+class SnapshotBuffer:
+    """
+    Passa os Snapshots da thread da simulação para a thread de desenho.
+
+    É uma caixa de correio com um único lugar (pending), e não um anel de
+    buffers: cada Snapshot é um objeto novo e imutável, então não há
+    memória a reaproveitar. slots diz quantos quadros podem existir ao
+    mesmo tempo, como na nomenclatura de buffer duplo e triplo:
+
+        3: a simulação nunca espera. Enquanto um quadro é desenhado e outro
+           é montado, o último publicado fica em pending; se um mais novo
+           chegar antes do desenho pegá-lo, ele é substituído (e contado
+           em skipped). O desenho sempre pega o quadro mais recente.
+        2: publish() espera o desenho pegar o quadro em pending antes de
+           deixar o novo, e as duas threads andam juntas, sem perder
+           quadros.
+
+    take() espera um quadro novo. close() libera as duas pontas: depois
+    dele publish() não espera mais e take() devolve o que restou ou None.
+    Os contadores de espera mostram qual das duas threads é o gargalo.
+    """
+    def __init__( self, slots=3 ):
+        self.slots        = slots
+        self.pending      = None
+        self.closed       = False
+        self.cond         = threading.Condition()
+        self.published    = 0
+        self.taken        = 0
+        self.skipped      = 0
+        self.sim_waits    = 0
+        self.sim_wait     = 0.0
+        self.render_waits = 0
+        self.render_wait  = 0.0
+    # __init__()
+
+
+
+    def publish( self, snapshot ):
+        with self.cond:
+            if self.pending is not None:
+                if self.slots == 2:
+                    t = time.perf_counter()
+                    self.sim_waits += 1
+                    while self.pending is not None and not self.closed:
+                        self.cond.wait()
+                    self.sim_wait += time.perf_counter() - t
+                else:
+                    self.skipped += 1
+            self.pending    = snapshot
+            self.published += 1
+            self.cond.notify_all()
+    # publish()
+
+
+
+    def take( self, timeout=None ):
+        """
+        Retorna o último Snapshot publicado, esperando até timeout segundos
+        por ele. Retorna None se nada chegou ou se o buffer foi fechado.
+        """
+        with self.cond:
+            if self.pending is None and not self.closed:
+                t = time.perf_counter()
+                self.render_waits += 1
+                self.cond.wait( timeout )
+                self.render_wait += time.perf_counter() - t
+            snapshot     = self.pending
+            self.pending = None
+            if snapshot is not None:
+                self.taken += 1
+            self.cond.notify_all()
+            return snapshot
+    # take()
+
+
+
+    def close( self ):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+    # close()
+
+
+
+    def get_stats( self ):
+        return { "slots"        : self.slots,
+                 "published"    : self.published,
+                 "taken"        : self.taken,
+                 "skipped"      : self.skipped,
+                 "sim_waits"    : self.sim_waits,
+                 "sim_wait"     : self.sim_wait * 1000.0,
+                 "render_waits" : self.render_waits,
+                 "render_wait"  : self.render_wait * 1000.0 }
+    # get_stats()
+# SnapshotBuffer
+
+
+
+class QualityGovernor:
+    """
+    Ajusta a qualidade do jogo para manter o tempo de quadro dentro do
+    orçamento (budget, em ms).
+
+    A cada `window` quadros é calculada a média do tempo de quadro. Acima do
+    orçamento, o governador desce um degrau, na ordem de steps:
+
+        cap:    limita os inimigos vivos, os tiros inimigos e os tiros do
+                jogador
+        scroll: o fundo rola em passos maiores, com menos redesenhos
+        scale:  amplia a tela interna sem suavização (veja ScaledDisplay)
+        hud:    o HUD só é atualizado a cada hud_interval quadros
+
+    Degraus que não têm efeito na configuração do jogo ficam de fora:
+    scroll só economiza com o DirtyRenderer (sem ele o fundo é redesenhado
+    inteiro a cada quadro), scale só com a tela interna ampliada com
+    suavização. cap muda a simulação a partir de tempos medidos, que não
+    são gravados, por isso fica de fora ao gravar ou reproduzir uma partida
+    (--record, --replay).
+
+    Quando a média fica abaixo de headroom * budget por `patience` janelas
+    seguidas, ele sobe um degrau. Se logo depois for preciso descer de novo
+    o mesmo degrau, a paciência para esse degrau dobra, para o governador
+    não ficar oscilando. Cada decisão é guardada em log.
+    """
+    steps = ( "cap", "scroll", "scale", "hud" )
+
+    def __init__( self, game, budget=16.6, window=30, headroom=0.7,
+                  patience=3, enemy_cap=4, fire_cap=8, player_fire_cap=24,
+                  scroll_interval=8, hud_interval=10 ):
+        self.game            = game
+        self.budget          = budget
+        self.times           = deque( maxlen=window )
+        self.headroom        = headroom
+        self.patience        = patience
+        self.enemy_cap       = enemy_cap
+        self.fire_cap        = fire_cap
+        self.player_fire_cap = player_fire_cap
+        self.scroll_interval = scroll_interval
+        self.hud_interval    = hud_interval
+        self.level           = 0
+        self.calm            = 0
+        self.log             = []
+        self.saved           = {}
+        self.skipped         = [ step for step in self.steps
+                                 if not self.usable( step ) ]
+        self.steps           = tuple( step for step in self.steps
+                                      if step not in self.skipped )
+        self.waits           = dict.fromkeys( self.steps, patience )
+    # __init__()
+
+
+
+    def usable( self, step ):
+        """
+        Diz se o degrau step tem algum efeito na configuração do jogo.
+        """
+        game = self.game
+        if step == "cap":
+            return not isinstance( game.input, ( InputRecorder, ReplayInput ) )
+        elif step == "scroll":
+            return game.renderer is not None and \
+                   0 < game.scroll_interval < self.scroll_interval
+        elif step == "scale":
+            return game.scaled is not None and game.scaled.smooth
+        return True
+    # usable()
+
+
+
+    def sample( self, frame_ms ):
+        times = self.times
+        times.append( frame_ms )
+        if len( times ) < times.maxlen:
+            return
+
+        avg = sum( times ) / len( times )
+        times.clear()
+        if avg > self.budget:
+            self.calm = 0
+            if self.level < len( self.steps ):
+                step = self.steps[ self.level ]
+                if self.log and self.log[ -1 ][ 1 : 3 ] == ( "up", step ):
+                    self.waits[ step ] *= 2
+                self.apply( step, True )
+                self.level += 1
+                self.decide( "down", avg )
+        elif avg < self.budget * self.headroom and self.level:
+            self.calm += 1
+            if self.calm >= self.waits[ self.steps[ self.level - 1 ] ]:
+                self.calm   = 0
+                self.level -= 1
+                self.apply( self.steps[ self.level ], False )
+                self.decide( "up", avg )
+        else:
+            self.calm = 0
+    # sample()
+
+
+
+    def apply( self, step, reduce ):
+        game = self.game
+        if step == "cap":
+            game.enemy_cap       = self.enemy_cap if reduce else None
+            game.fire_cap        = self.fire_cap if reduce else None
+            game.player_fire_cap = self.player_fire_cap if reduce else None
+
+        elif step == "scroll":
+            if reduce:
+                self.saved[ step ] = game.scroll_interval
+                game.set_scroll_interval( self.scroll_interval )
+            else:
+                game.set_scroll_interval( self.saved.pop( step ) )
+
+        elif step == "scale":
+            game.scaled.smooth = not reduce
+
+        elif step == "hud":
+            game.hud_interval = self.hud_interval if reduce else 1
+    # apply()
+
+
+
+    def decide( self, direction, avg ):
+        step = self.steps[ self.level - ( direction == "down" ) ]
+        self.log.append( ( self.game.frame, direction, step, avg ) )
+    # decide()
+
+
+
+    def report( self ):
+        print( "Governor: budget %g ms, final level %d/%d, %d decisions" %
+               ( self.budget, self.level, len( self.steps ), len( self.log ) ) )
+        if self.skipped:
+            print( "  steps without effect here: %s" %
+                   ", ".join( self.skipped ) )
+        for frame, direction, step, avg in self.log:
+            print( "  frame %6d: %-4s %-6s (avg %0.2f ms)" %
+                   ( frame, direction, step, avg ) )
+    # report()
+# QualityGovernor
+
+
+
+class StartupProfile:
+    """
+    Tempos das fases da inicialização, do início do programa até o primeiro
+    quadro desenhado (veja --startup-profile).
+
+    Cada fase é registrada com a thread em que rodou, assim dá para ver o
+    que foi feito pela thread de carregamento em paralelo com a tela de
+    carregamento.
+    """
+    def __init__( self, start=None ):
+        self.start  = start or time.perf_counter()
+        self.phases = []
+        self.lock   = threading.Lock()
+        self.first_frame = None
+    # __init__()
+
+
+
+    def mark( self, phase, start ):
+        """
+        Registra a fase que começou em start e retorna o tempo atual, que
+        pode ser usado como início da próxima fase.
+        """
+        now = time.perf_counter()
+        with self.lock:
+            self.phases.append( ( phase, threading.current_thread().name,
+                                  start - self.start, now - start ) )
+        return now
+    # mark()
+
+
+
+    def frame_done( self ):
+        if self.first_frame is None:
+            self.first_frame = time.perf_counter() - self.start
+    # frame_done()
+
+
+
+    def report( self ):
+        print( "Startup phases (ms):" )
+        for phase, thread, start, took in self.phases:
+            print( "  %-12s %-12s at %8.2f  took %8.2f" %
+                   ( phase, thread, start * 1000.0, took * 1000.0 ) )
+        if self.first_frame is not None:
+            print( "Startup: first frame after %0.2f ms" %
+                   ( self.first_frame * 1000.0 ) )
+    # report()
+# StartupProfile
+
+
+
+class AssetLoader:
+    """
+    Executa as tarefas de carregamento (decodificar imagens, procurar
+    fontes, montar o fundo) em uma thread separada, enquanto a thread
+    principal mostra a tela de carregamento.
+
+    As tarefas são pares ( nome, função ), executadas em ordem; o tempo de
+    cada uma vai para o StartupProfile. Uma exceção em uma tarefa é guardada
+    e levantada de novo por wait(), na thread principal.
+    """
+    def __init__( self, tasks, profile=None ):
+        self.tasks    = list( tasks )
+        self.profile  = profile
+        self.finished = 0
+        self.error    = None
+        self.thread   = threading.Thread( target=self.run, name="loader",
+                                          daemon=True )
+    # __init__()
+
+
+
+    def start( self ):
+        self.thread.start()
+        return self
+    # start()
+
+
+
+    def run( self ):
+        for name, task in self.tasks:
+            t = time.perf_counter()
+            try:
+                task()
+            except Exception as e:
+                self.error = e
+                return
+            if self.profile:
+                self.profile.mark( name, t )
+            self.finished += 1
+    # run()
+
+
+
+    def progress( self ):
+        return float( self.finished ) / max( 1, len( self.tasks ) )
+    # progress()
+
+
+
+    def done( self ):
+        return not self.thread.is_alive()
+    # done()
+
+
+
+    def wait( self, timeout=None ):
+        """
+        Espera até timeout segundos pelo fim das tarefas. Retorna True se
+        todas terminaram.
+        """
+        self.thread.join( timeout )
+        if self.thread.is_alive():
+            return False
+        if self.error:
+            raise self.error
+        return True
+    # wait()
+# AssetLoader
+
+
+
+class Game:
+    screen      = None
+    screen_size = None
+    run         = True
+    fire_timer  = 0
+    level       = 0
+    list        = None
+    player      = None
+    players     = ()
+    background  = None    
+    headless    = False
+    input       = None
+    renderer    = None
+    projectiles = None
+    particles   = None
+    pipeline    = None
+    sim_error   = None
+    scaled      = None
+    view        = None
+    world       = None
+    hud         = None
+    loading_font = None
+    governor    = None
+    enemy_cap   = None
+    fire_cap    = None
+    player_fire_cap = None
+    hud_interval = 1
+    last_hud_fields = None
+
+    # Níveis: ( XP necessário, fundo, vidas extras )
+    levels = [ ( 15,  "tile2.png",  3 ),
+               ( 50,  "tile3.png",  6 ),
+               ( 100, "espaco.png", 10 ) ]
+
+    # Pares ( ator, alvo ) que podem usar colisão exata (--exact)
+    exact_pairs = ( ( "player", "enemies_fire" ),
+                    ( "player", "enemies" ),
+                    ( "fire",   "enemies" ) )
+
+    # Ondas de inimigos, uma por nível:
+    #   spawn_every: intervalo, em quadros, entre duas criações
+    #   pattern:     colunas, relativas a uma coluna sorteada, onde os
+    #                inimigos de uma criação aparecem
+    #   max_enemies: máximo de inimigos vivos ao mesmo tempo
+    #   fire_every:  intervalo, em quadros, entre os tiros de um inimigo
+    #   fire_chance: chance de o inimigo atirar quando chega a sua vez
+    waves = [ { "spawn_every" : ( 1, 12 ), "pattern" : ( 0, ),
+                "max_enemies" : 3, "fire_every" : ( 20, 30 ),
+                "fire_chance" : 0.45 },
+              { "spawn_every" : ( 1, 10 ), "pattern" : ( 0, ),
+                "max_enemies" : 4, "fire_every" : ( 20, 30 ),
+                "fire_chance" : 0.5 },
+              { "spawn_every" : ( 10, 30 ), "pattern" : ( 0, 2, 4 ),
+                "max_enemies" : 6, "fire_every" : ( 18, 28 ),
+                "fire_chance" : 0.5 },
+              { "spawn_every" : ( 10, 25 ), "pattern" : ( -3, 0, 3 ),
+                "max_enemies" : 8, "fire_every" : ( 15, 25 ),
+                "fire_chance" : 0.55 } ]
+    
+    def __init__( self, size, fullscreen, headless=False, seed=None,
+                  input=None, dirty=False, scroll_interval=1,
+                  batched_fire=False, prefetch="near", sim_rate=62.5,
+                  fps=None, max_steps=5, interpolate=False,
+                  profile=False, profile_out=None, atlas=False,
+                  pack=False, bindings=None, autofire_interval=176,
+                  exact=None, scale=1, integer_scale=False, smooth=False,
+                  render_size=None, target_ms=8.0, startup_profile=False,
+                  budget=None, particles=8192, threaded=False, buffers=3,
+                  players=1, window=True ):
+        """
+        Esta é a função que inicializa o pygame, define a resolução da tela,
+        caption, e disabilitamos o mouse dentro desta.
+
+        A fonte do HUD (SysFont procura entre as fontes do sistema, o que é
+        lento) e as imagens são carregadas depois, em uma thread, enquanto a
+        tela de carregamento é mostrada (veja loop()).
+
+        Com window=False (as partidas do CoopServer) o display não é
+        tocado: o jogo só simula, em uma superfície fora da tela.
+        """
+        self.startup         = StartupProfile( process_start )
+        self.startup_profile = startup_profile
+        t = time.perf_counter()
+
+        actors = {}
+        pygame.init()
+        t = self.startup.mark( "init", t )
+
+        if window:
+            flags = DOUBLEBUF
+            if fullscreen:
+                flags |= FULLSCREEN
+            self.display  = pygame.display.set_mode( size, flags )
+        else:
+            self.display  = pygame.Surface( size )
+        self.screen       = self.display
+        t = self.startup.mark( "display", t )
+
+        # Resolução interna: o jogo é desenhado em uma superfície fora da
+        # tela, ampliada para o display a cada quadro. "auto" mede o custo
+        # de alguns tamanhos e escolhe o maior que cabe em target_ms.
+        # O mundo continua com o tamanho do display: só o desenho passa
+        # pela redução (WorldView)
+        if scale == "auto" and not render_size:
+            render_size = ScaledDisplay.calibrate( self.display, target_ms,
+                                                   smooth=smooth,
+                                                   integer=integer_scale )
+        elif scale != 1 and not render_size:
+            render_size = ( int( size[ 0 ] / scale ),
+                            int( size[ 1 ] / scale ) )
+        if render_size or integer_scale:
+            self.scaled = ScaledDisplay( self.display,
+                                         render_size or size,
+                                         smooth, integer_scale )
+            self.screen = self.scaled.canvas
+        self.screen_size = self.display.get_size()
+        if self.screen.get_size() != self.screen_size:
+            self.view = WorldView( self.screen, self.screen_size, smooth )
+        self.world = self.view or self.screen
+        t = self.startup.mark( "canvas", t )
+        # Cada jogo tem a sua área; ela é instalada em GameObject por
+        # activate() antes de cada passo
+        self.area = pygame.Rect( ( 0, 0 ), self.screen_size )
+
+        if window:
+            pygame.mouse.set_visible( 0 )
+            pygame.display.set_caption( 'Título da Janela' )
+
+        # Atlas com todas as imagens (opcional), remontado automaticamente
+        # quando alguma imagem muda
+        if atlas and image_cache.atlas is None:
+            image_cache.atlas = SpriteAtlas().load()
+
+        # Pacote de imagens já decodificadas (opcional, veja --build-pack)
+        if pack and image_cache.pack is None:
+            image_cache.pack = AssetPack().open()
+            if image_cache.pack is None:
+                print( "Asset pack not found, loading the image files" )
+
+        # Usamos um gerador próprio, assim uma mesma semente reproduz
+        # exatamente a mesma partida
+        self.headless = headless
+        self.seed     = seed
+        self.random   = Random.Random( seed )
+        self.input    = input or LiveInput()
+
+        # Teclas -> ações. Os eventos de mouse, toque, joystick e texto não
+        # são usados e nem entram na fila. (set_blocked( None ) percorre
+        # todos os tipos de evento do SDL e custa uns 20 ms na partida)
+        self.input_map         = InputMap( bindings )
+        self.autofire_interval = autofire_interval
+        pygame.event.set_blocked( [ MOUSEMOTION, MOUSEBUTTONDOWN,
+                                    MOUSEBUTTONUP, MOUSEWHEEL, FINGERMOTION,
+                                    FINGERDOWN, FINGERUP, JOYAXISMOTION,
+                                    JOYBALLMOTION, JOYHATMOTION,
+                                    JOYBUTTONDOWN, JOYBUTTONUP, TEXTINPUT,
+                                    TEXTEDITING ] )
+
+        # Grade usada para acelerar os testes de colisão, e os pares de
+        # grupos ( ator, alvo ) testados também pelas máscaras
+        self.broadphase = SpatialHash()
+        self.exact      = set( exact or () )
+
+        # Renderização por retângulos sujos (opcional)
+        self.scroll_interval = scroll_interval
+        if dirty:
+            self.renderer = DirtyRenderer( self.screen )
+
+        # Tiros em vetores do NumPy (opcional)
+        self.batched_fire = batched_fire
+        if batched_fire and numpy is None:
+            print( "NumPy not available, using sprites for the projectiles" )
+            self.batched_fire = False
+
+        # Explosões com partículas em vetores do NumPy (0 desliga). É só
+        # efeito visual: sem o NumPy o jogo segue sem elas
+        if particles and numpy is not None:
+            self.particles = ParticleSystem( particles, seed )
+
+        # Os fundos dos próximos níveis são preparados com antecedência:
+        # "eager" prepara todos no início, "near" quando o jogador se
+        # aproxima do XP necessário e "off" monta na hora da troca
+        self.prefetch        = prefetch
+        self.prefetcher      = BackgroundPrefetcher( scroll_interval )
+        self.level_stall_max = 0.0
+        self.level_frames    = []
+
+        # Jogadores na mesma partida (co-op, veja CoopServer). O XP é do
+        # time, e o jogo só acaba quando todos morrem
+        self.player_count = players
+
+        # A simulação anda em passos fixos de sim_dt milissegundos,
+        # independente da taxa de desenho (fps). Quando o desenho atrasa,
+        # executamos vários passos seguidos, até max_steps por quadro.
+        self.sim_rate    = sim_rate
+        self.sim_dt      = 1000.0 / sim_rate
+        self.fps         = fps or sim_rate
+        self.max_steps   = max_steps
+        self.interpolate = interpolate and not dirty
+        self.steps       = 0
+        self.dropped     = 0.0
+
+        # Medição do tempo de cada fase do quadro (opcional)
+        self.profiler = None
+        if profile or profile_out:
+            self.profiler = FrameProfiler( filename=profile_out,
+                                           overlay=profile and not headless )
+
+        # Simulação e desenho em threads separadas (opcional). O desenho
+        # vem só dos Snapshots, então os retângulos sujos, a interpolação e
+        # o profiler por fase (que mede as duas etapas juntas) ficam de fora
+        self.threaded = threaded
+        self.buffers  = buffers
+        if threaded:
+            if self.renderer or self.interpolate or self.profiler:
+                print( "Threaded mode: dirty rendering, interpolation and "
+                       "the frame profiler are disabled" )
+            self.renderer    = None
+            self.interpolate = False
+            self.profiler    = None
+
+        # Reduz a qualidade quando o quadro passa do orçamento (opcional)
+        if budget:
+            self.governor = QualityGovernor( self, budget )
+        self.activate()
+        self.startup.mark( "setup", t )
+    # init()
+
+    def draw_hud(self):
+        # Retorna os retângulos desenhados, usados pelo DirtyRenderer
+        if not self.player:
+            return []
+
+        fields = self.hud_fields( self.rendered )
+        rects  = self.hud.draw( self.screen, fields )  # canto superior esquerdo
+        if self.profiler:
+            rects += self.profiler.draw( self.screen )
+        return rects
+    
+    def hud_fields( self, count ):
+        # Com o governador apertado o HUD mostra os valores antigos na
+        # maior parte dos quadros. Os valores são guardados aqui, e não
+        # lidos do Hud, que no modo --threaded pertence à thread de desenho;
+        # a tupla é imutável e pode ir direto para o Snapshot
+        if self.hud_interval > 1 and self.last_hud_fields and \
+               count % self.hud_interval:
+            return self.last_hud_fields
+        self.last_hud_fields = ( ( 'Vidas: ', self.player.get_lives() ),
+                                 ( 'XP: ', self.player.get_XP() ),
+                                 ( 'Level: ', self.level ) )
+        return self.last_hud_fields
+    # hud_fields()
+
+
+
+    def finish_game(self):
+        if self.player:
+       
+            lives_text = f'Vidas: {self.player.get_lives()}'
+          
+
+    def make_actions( self ):
+        """
+        Monta as tabelas de ação -> método chamadas ao apertar e ao soltar
+        uma tecla.
+        """
+        player = self.player
+        self.press_actions = { "quit"     : self.quit,
+                               "overlay"  : self.toggle_overlay,
+                               "fire"     : self.fire,
+                               "autofire" : self.fire,
+                               "up"       : player.accel_top,
+                               "down"     : player.accel_bottom,
+                               "left"     : player.accel_left,
+                               "right"    : player.accel_right }
+        self.release_actions = { "up"     : player.accel_bottom,
+                                 "down"   : player.accel_top,
+                                 "left"   : player.accel_right,
+                                 "right"  : player.accel_left }
+    # make_actions()
+
+
+
+    def quit( self ):
+        self.run = False
+    # quit()
+
+
+
+    def toggle_overlay( self ):
+        if self.profiler:
+            self.profiler.toggle_overlay()
+    # toggle_overlay()
+
+
+
+    def fire( self, player=None ):
+        if player is None:
+            self.fire_timer = 0
+            player          = self.player
+        fire = self.list[ "fire" ]
+        if self.player_fire_cap is None or len( fire ) < self.player_fire_cap:
+            player.fire( fire )
+    # fire()
+
+
+
+    def handle_events( self, dt=0 ):
+        """
+        Trata o evento e toma a ação necessária.
+
+        Cada tecla é traduzida pela tabela do InputMap; o estado das teclas
+        seguradas é lido uma única vez por passo, e o tiro automático
+        depende do tempo passado (autofire_interval, em ms), não do número
+        de eventos na fila.
+        """
+        bindings = self.input_map.bindings
+        for event in self.input.poll( self.frame ):
+            t = event.type
+            if t == KEYDOWN:
+                action = self.press_actions.get( bindings.get( event.key ) )
+                if action:
+                    action()
+            elif t == KEYUP:
+                action = self.release_actions.get( bindings.get( event.key ) )
+                if action:
+                    action()
+            elif t == QUIT:
+                self.run = False
+
+        self.fire_timer += dt
+        if self.fire_timer >= self.autofire_interval:
+            keys = self.input.get_pressed()
+            for k in self.input_map.held:
+                if keys[ k ]:
+                    self.fire()
+                    break
+    # handle_events()
+
+
+
+
+    def actors_update( self, dt ):        
+        self.background.update( dt )
+        
+        for actor in self.list.values():
+            actor.update( dt )
+        if self.particles is not None:
+            self.particles.update( dt )
+    # actors_update()
+
+
+
+    def new_group( self, *sprites ):
+        """
+        Cria um grupo de renderização. O DirtyRenderer precisa de grupos
+        RenderUpdates, que guardam a região onde cada sprite foi desenhado.
+        """
+        if self.renderer:
+            return pygame.sprite.RenderUpdates( *sprites )
+        return pygame.sprite.RenderPlain( *sprites )
+    # new_group()
+
+
+
+    def set_screen( self, screen ):
+        """
+        Troca a superfície onde o jogo é desenhado (veja GameEnv).
+        """
+        self.screen = screen
+        if self.view:
+            self.view.canvas = screen
+        else:
+            self.world = screen
+    # set_screen()
+
+
+
+    def draw_particles( self ):
+        return self.particles.draw( self.screen,
+                                    scale=self.view and self.view.scale )
+    # draw_particles()
+
+
+
+    def actors_draw( self, alpha=None ):
+        # O fundo e os sprites vão para o mundo, que pode estar reduzido
+        # (WorldView); as partículas e o HUD, direto para a tela
+        world = self.world
+        self.background.draw( world )
+        
+        if alpha is None:
+            for actor in self.list.values():
+                actor.draw( world )
+            if self.particles is not None:
+                self.draw_particles()
+            return
+
+        # Desenha cada sprite entre a posição anterior e a atual
+        for actor in self.list.values():
+            if isinstance( actor, ProjectileGroup ):
+                actor.draw( world, alpha )
+                continue
+            blits = []
+            for s in actor.sprites():
+                p = s.prev_pos
+                r = s.rect
+                blits.append( ( s.image,
+                                ( floor( p[ 0 ] + ( r.x - p[ 0 ] ) * alpha ),
+                                  floor( p[ 1 ] + ( r.y - p[ 1 ] ) * alpha ) ) ) )
+            world.blits( blits, False )
+        if self.particles is not None:
+            self.draw_particles()
+    # actors_draw()
+    
+
+
+    def actor_check_hit( self, actor, list, action, exact=False ):
+        if   isinstance( actor, ProjectileGroup ):
+            hitted = actor.collide_group( list, 1, exact, self.broadphase )
+            for v in hitted.values():
+                for o in v:
+                    action( o )
+            return hitted
+
+        elif isinstance( list, ProjectileGroup ):
+            if list.collide_sprite( actor, 1, exact, self.broadphase ):
+                action()
+            return actor.is_dead()
+
+        elif isinstance( actor, pygame.sprite.RenderPlain ):
+            hitted = self.broadphase.groupcollide( actor, list, 1, 0, exact )
+            for v in hitted.values():
+                for o in v:
+                    action( o )
+            return hitted
+        
+        elif isinstance( actor, pygame.sprite.Sprite ):
+            if self.broadphase.spritecollide( actor, list, 1, exact ):
+                action()
+            return actor.is_dead()
+    # actor_check_hit()
+
+
+    
+    def player_hit( self, player=None ):
+        player = player or self.player
+        player.do_hit()
+        if self.particles is not None:
+            self.particles.explode( player.rect.center, 80,
+                                    ParticleSystem.SPARK, 2.5, 300.0 )
+    # player_hit()
+
+
+
+    def player_collision( self, player=None ):
+        player = player or self.player
+        player.do_collision()
+        if self.particles is not None:
+            center = player.rect.center
+            self.particles.explode( center, 300, ParticleSystem.FIRE )
+            self.particles.explode( center, 100, ParticleSystem.DEBRIS,
+                                    4.0, 900.0 )
+    # player_collision()
+
+
+
+    def enemy_hit( self, enemy ):
+        Enemy.do_hit( enemy )
+        if self.particles is not None and not enemy.alive():
+            center = enemy.rect.center
+            self.particles.explode( center, 400, ParticleSystem.FIRE )
+            self.particles.explode( center, 120, ParticleSystem.DEBRIS,
+                                    4.0, 900.0 )
+    # enemy_hit()
+
+
+
+    def actors_act( self ):
+        for player in self.players:
+            if player.is_dead():
+                continue
+
+            # Verifica se personagem foi atingido por um tiro
+            self.actor_check_hit( player, self.list[ "enemies_fire" ],
+                                  lambda p=player: self.player_hit( p ),
+                                  ( "player", "enemies_fire" ) in self.exact )
+            if player.is_dead():
+                continue
+
+            # Verifica se o personagem trombou em algum inimigo
+            self.actor_check_hit( player, self.list[ "enemies" ],
+                                  lambda p=player: self.player_collision( p ),
+                                  ( "player", "enemies" ) in self.exact )
+
+        # O jogo acaba quando não sobra nenhum jogador vivo; no co-op quem
+        # morre sai da tela e os outros continuam
+        if all( player.is_dead() for player in self.players ):
+            self.run = False
+            return
+        for player in self.players:
+            if player.is_dead() and player.alive():
+                player.kill()
+
+        # Verifica se o personagem atingiu algum alvo.
+        hitted = self.actor_check_hit( self.list[ "fire" ],
+                                       self.list[ "enemies" ],
+                                       self.enemy_hit,
+                                       ( "fire", "enemies" ) in self.exact )
+        
+        # Aumenta a eXPeriência baseado no número de acertos (o XP é do
+        # time, todos os jogadores ganham):
+        for player in self.players:
+            player.set_XP( player.get_XP() + len( hitted ) )
+    # actors_check_hit()
+
+
+
+    def change_level( self ):
+        if self.level >= len( self.levels ):
+            return
+
+        xp = self.player.get_XP()
+        needed, image, lives = self.levels[ self.level ]
+
+        # Começa a preparar o próximo fundo quando faltar pouco XP
+        if self.prefetch == "near" and xp > needed * 0.6:
+            self.prefetcher.prefetch( image )
+
+        if xp > needed:
+            start = time.perf_counter()
+            if self.prefetch == "off":
+                self.background = Background( image, self.scroll_interval )
+            else:
+                self.background = self.prefetcher.get( image )
+            self.level += 1
+            self.level_frames.append( self.frame )
+            self.scheduler.set_wave( self.waves[ self.level ], self.ticks )
+            for player in self.players:
+                if not player.is_dead():
+                    player.set_lives( player.get_lives() + lives )
+            stall = time.perf_counter() - start
+            self.level_stall_max = max( self.level_stall_max, stall )
+    # change_level()
+
+
+
+    def manage( self ):
+        self.ticks += 1
+        # Os tiros e a criação de inimigos vêm da linha do tempo da onda
+        # atual, sorteada com antecedência
+        for kind, payload in self.scheduler.due( self.ticks ):
+            if kind == WaveScheduler.FIRE:
+                fire = self.list[ "enemies_fire" ]
+                if self.fire_cap is None or len( fire ) < self.fire_cap:
+                    payload.fire( fire, image="tiro_inimigo.png" )
+            else:
+                # criamos mais inimigos para o jogo não ficar chato
+                self.spawn_enemies( payload )
+
+        # Verifica se ascendeu de nível
+        self.change_level()
+    # manage()
+
+
+
+    def set_scroll_interval( self, scroll_interval ):
+        self.scroll_interval            = scroll_interval
+        self.prefetcher.scroll_interval = scroll_interval
+        for background in self.prefetcher.ready.values():
+            background.scroll_interval = scroll_interval
+        if self.background:
+            self.background.scroll_interval = scroll_interval
+    # set_scroll_interval()
+
+
+
+    def spawn_enemies( self, r ):
+        """
+        Cria os inimigos de uma onda, a partir da coluna r (entre 0 e 1).
+        """
+        wave    = self.scheduler.wave
+        enemies = self.list[ "enemies" ]
+        size    = image_cache.load( "inimigo.png" ).get_size()
+        columns = max( 1, self.screen_size[ 0 ] // size[ 0 ] )
+        base    = int( r * columns )
+        limit   = wave[ "max_enemies" ]
+        if self.enemy_cap is not None:
+            limit = min( limit, self.enemy_cap )
+        for offset in wave[ "pattern" ]:
+            if len( enemies ) >= limit:
+                break
+            x     = ( base + offset ) % columns
+            enemy = Enemy( [ x * size[ 0 ] + size[ 0 ] // 2, - size[ 1 ] ] )
+            enemies.add( enemy )
+            self.scheduler.watch( enemy, self.ticks )
+    # spawn_enemies()
+
+
+    
+    def load_fonts( self ):
+        pygame.font.init()
+        self.font = pygame.font.SysFont( 'Arial', 24 )
+        self.hud  = Hud( self.font )
+    # load_fonts()
+
+
+
+    def load_images( self ):
+        # Carregamos de uma vez as imagens usadas durante o jogo, assim
+        # nenhum tiro ou inimigo precisa ler o disco no meio de um quadro
+        image_cache.preload( [ "nave.png", "inimigo.png",
+                               "tiro.png", "tiro_inimigo.png" ] )
+        fire_pool.preload( 64 )
+    # load_images()
+
+
+
+    def load_background( self ):
+        self.background = Background( "tile.png", self.scroll_interval )
+        if self.prefetch == "eager":
+            for needed, image, lives in self.levels:
+                self.prefetcher.prefetch( image )
+    # load_background()
+
+
+
+    def draw_loading( self, progress ):
+        """
+        Tela de carregamento: só usa a fonte embutida do pygame, que não
+        depende da busca nas fontes do sistema.
+        """
+        if self.loading_font is None:
+            self.loading_font = pygame.font.Font( None, 32 )
+        screen = self.screen
+        w, h   = screen.get_size()
+        screen.fill( ( 0, 0, 0 ) )
+        text = self.loading_font.render( "Carregando...", True,
+                                         ( 255, 255, 255 ) )
+        screen.blit( text, text.get_rect( center=( w // 2, h // 2 - 30 ) ) )
+        bar = pygame.Rect( 0, 0, w // 2, 12 )
+        bar.center = ( w // 2, h // 2 + 10 )
+        pygame.draw.rect( screen, ( 255, 255, 255 ), bar, 1 )
+        bar.width = int( bar.width * progress )
+        screen.fill( ( 255, 255, 255 ), bar )
+        self.present()
+    # draw_loading()
+
+
+
+    def load_assets( self ):
+        """
+        Carrega fontes, imagens e o fundo na thread do AssetLoader e,
+        enquanto isso, mantém a tela de carregamento atualizada. A tela é
+        desenhada uma vez antes de a thread começar, para não disputar com
+        ela o primeiro desenho.
+        """
+        t = time.perf_counter()
+        loader = AssetLoader( [ ( "fonts",      self.load_fonts ),
+                                ( "images",     self.load_images ),
+                                ( "background", self.load_background ) ],
+                              self.startup )
+        self.draw_loading( 0.0 )
+        t = self.startup.mark( "first_paint", t )
+        loader.start()
+        while not loader.wait( 1.0 / 30 ):
+            pygame.event.pump()
+            self.draw_loading( loader.progress() )
+        self.startup.mark( "loading", t )
+    # load_assets()
+
+
+
+    def reset( self, seed=None ):
+        """
+        Prepara uma partida nova: jogador, inimigos, grupos de tiros e a
+        linha do tempo das ondas. Com seed, o gerador de números aleatórios
+        é reiniciado com essa semente. É usado por loop() e por GameEnv.
+        """
+        self.activate()
+        if seed is not None:
+            self.seed   = seed
+            self.random = Random.Random( seed )
+        if self.level:
+            self.load_background()
+        self.run        = True
+        self.level      = 0
+        self.ticks      = 0
+        self.fire_timer = 0
+        self.frame      = 0
+        self.rendered   = 0
+        self.last_hud_fields = None
+        if self.particles is not None:
+            self.particles.n = 0
+
+        # Os sprites da partida anterior saem dos grupos; assim os tiros
+        # voltam para a reserva (fire_pool) em vez de ficarem presos nela
+        for group in ( self.list or {} ).values():
+            if not isinstance( group, ProjectileGroup ):
+                for sprite in group.sprites():
+                    sprite.kill()
+
+        # Os jogadores começam lado a lado, igualmente espaçados
+        w, h         = self.screen_size
+        n            = self.player_count
+        self.players = [ Player( [ w * ( i + 1 ) // ( n + 1 ), h ], lives=10 )
+                         for i in range( n ) ]
+        self.player  = self.players[ 0 ]
+
+        self.list = {
+            "player"       : self.new_group( *self.players ),
+            "enemies"      : self.new_group( Enemy( [ 120, 0 ] ) ),
+            "fire"         : self.new_group(),
+            "enemies_fire" : self.new_group()
+            }
+        self.scheduler = WaveScheduler( self.random )
+        self.scheduler.set_wave( self.waves[ self.level ], self.ticks )
+        for enemy in self.list[ "enemies" ]:
+            self.scheduler.watch( enemy, self.ticks )
+
+        self.make_actions()
+
+        if self.batched_fire:
+            self.projectiles = ProjectileSystem()
+            self.list[ "fire" ] = ProjectileGroup( self.projectiles,
+                                                   ProjectileSystem.PLAYER,
+                                                   "tiro.png" )
+            self.list[ "enemies_fire" ] = \
+                ProjectileGroup( self.projectiles, ProjectileSystem.ENEMY,
+                                 "tiro_inimigo.png" )
+    # reset()
+
+
+
+    def loop( self, frames=None, quiet=False ):
+        
+        """
+        Laço principal
+
+        Se frames for dado, o jogo termina depois desse número de quadros.
+        No modo headless o dt é fixo, o relógio não limita a velocidade e
+        ao final é impresso um resumo do desempenho da simulação.
+        Com quiet=True nada é impresso.
+        """
+        # Fontes, imagens e fundo são carregados em outra thread enquanto
+        # mostramos a tela de carregamento
+        self.load_assets()
+        t = time.perf_counter()
+
+        # Inicializamos o relogio. O dt da simulação é fixo (sim_dt) e o
+        # relógio só limita a taxa de desenho
+        clock         = pygame.time.Clock()
+        dt            = self.sim_dt
+        frame_dt      = 1000.0 / self.fps
+        accumulator   = 0.0
+        self.frame_times = frame_times = []
+        self.reset()
+        self.startup.mark( "world", t )
+
+        # assim iniciamos o loop principal do programa
+        start = time.perf_counter()
+        last  = start
+        pump  = self.event_pump()
+        if self.threaded:
+            self.run_pipeline( frames, clock, pump )
+        while self.run:
+            if frames is not None and self.frame >= frames:
+                break
+            if pump:
+                pump.pump()
+            if not self.headless:
+                clock.tick( self.fps )
+            frame_start = time.perf_counter()
+            if self.profiler:
+                self.profiler.begin_frame()
+
+            # No modo headless o tempo avança exatamente um quadro por volta
+            if self.headless:
+                accumulator += frame_dt
+            else:
+                accumulator += ( frame_start - last ) * 1000.0
+            last = frame_start
+
+            # Se estivermos muito atrasados, descartamos o excesso em vez de
+            # tentar recuperar tudo (o jogo fica mais lento, mas não trava)
+            if accumulator > self.max_steps * dt and not self.headless:
+                self.dropped += accumulator - self.max_steps * dt
+                accumulator   = self.max_steps * dt
+
+            while accumulator >= dt and self.run:
+                if frames is not None and self.frame >= frames:
+                    break
+                self.step( dt )
+                accumulator -= dt
+
+            alpha = None
+            if self.interpolate:
+                alpha = min( accumulator / dt, 1.0 )
+
+            self.render( alpha )
+            if not self.rendered:
+                self.startup.frame_done()
+
+            self.rendered += 1
+            frame_times.append( time.perf_counter() - frame_start )
+            if self.governor:
+                self.governor.sample( frame_times[ -1 ] * 1000.0 )
+
+            if self.profiler:
+                self.profiler.end_frame( { name: len( group ) for name, group
+                                           in self.list.items() } )
+        # while self.run
+
+        self.elapsed = time.perf_counter() - start
+        self.input.close()
+        if self.profiler:
+            self.profiler.close()
+
+        if not quiet:
+            self.print_stats()
+    # loop()
+
+
+
+    def snapshot( self ):
+        """
+        Copia do estado atual o que o desenho precisa (veja Snapshot).
+        """
+        blits = []
+        for group in self.list.values():
+            if isinstance( group, ProjectileGroup ):
+                blits.extend( group.blits() )
+            else:
+                blits.extend( [ ( s.image, s.rect.topleft ) for s in group ] )
+        particles = None
+        if self.particles is not None and self.particles.n:
+            particles = self.particles.state( self.screen.get_size(),
+                                              self.view and self.view.scale )
+        background = self.background
+        return Snapshot( self.frame, background.image,
+                         tuple( background.pos ), blits, particles,
+                         self.hud_fields( self.frame ) )
+    # snapshot()
+
+
+
+    def render_snapshot( self, snapshot ):
+        screen = self.screen
+        self.world.blit( snapshot.background, snapshot.background_pos )
+        self.world.blits( snapshot.blits, False )
+        if snapshot.particles is not None:
+            self.particles.draw_state( screen, snapshot.particles )
+        self.hud.draw( screen, snapshot.hud )
+        self.present()
+    # render_snapshot()
+
+
+
+    def live_source( self ):
+        # O teclado de verdade, mesmo quando está sendo gravado
+        source = self.input
+        while hasattr( source, "source" ):
+            source = source.source
+        if isinstance( source, LiveInput ):
+            return source
+        return None
+    # live_source()
+
+
+
+    def event_pump( self ):
+        """
+        Retorna quem a thread principal deve chamar (pump()) a cada quadro
+        para ler o SDL, ou None. No --threaded o LiveInput passa a usar a
+        sua fila; as fontes que não leem o SDL são envolvidas por um
+        PumpedInput, se houver uma janela. Sem threads o LiveInput lê o SDL
+        sozinho, em poll().
+        """
+        live = self.live_source()
+        if live:
+            if not self.threaded:
+                return None
+            live.use_queue()
+            return live
+        if self.headless:
+            return None
+        self.input = PumpedInput( self.input )
+        return self.input
+    # event_pump()
+
+
+
+    def simulate_steps( self, frames, buffer ):
+        """
+        Laço da thread da simulação: um passo, um Snapshot publicado. Fora
+        do modo headless os passos são espaçados de sim_dt, com no máximo
+        max_steps passos atrasados recuperados de uma vez.
+        """
+        dt   = self.sim_dt
+        late = self.max_steps * dt / 1000.0
+        due  = time.perf_counter()
+        try:
+            while self.run and not buffer.closed:
+                if frames is not None and self.frame >= frames:
+                    break
+                if not self.headless:
+                    now = time.perf_counter()
+                    if now < due:
+                        time.sleep( due - now )
+                    elif now - due > late:
+                        self.dropped += ( now - due - late ) * 1000.0
+                        due = now - late
+                    due += dt / 1000.0
+                self.step( dt )
+                buffer.publish( self.snapshot() )
+        except Exception as e:
+            self.sim_error = e
+        finally:
+            buffer.close()
+    # simulate_steps()
+
+
+
+    def run_pipeline( self, frames, clock, pump=None ):
+        """
+        Modo em duas threads (--threaded): a simulação roda em
+        simulate_steps() e esta thread, a principal, só desenha o último
+        Snapshot publicado.
+
+        Regras:
+          - os eventos do SDL só são lidos aqui, por pump (veja
+            event_pump()), e passados para a simulação por uma fila: todos,
+            pelo LiveInput, ou só QUIT e ESC, pelo PumpedInput em volta das
+            outras fontes, que a simulação lê pelo número do passo.
+          - a simulação termina quando self.run fica falso (ESC, QUIT,
+            jogador morto) ou depois de frames passos, e fecha o buffer;
+            o desenho termina quando o buffer fechado fica vazio.
+          - se o desenho sai antes (erro, Ctrl+C), ele fecha o buffer e
+            espera a simulação terminar o passo atual.
+        """
+        buffer = SnapshotBuffer( self.buffers )
+        self.pipeline = buffer
+        sim = threading.Thread( target=self.simulate_steps,
+                                args=( frames, buffer ), name="simulation",
+                                daemon=True )
+        sim.start()
+        try:
+            while True:
+                if pump:
+                    pump.pump()
+                if not self.headless:
+                    clock.tick( self.fps )
+                snapshot = buffer.take( 0.1 )
+                if snapshot is None:
+                    if buffer.closed:
+                        break
+                    continue
+
+                frame_start = time.perf_counter()
+                self.render_snapshot( snapshot )
+                if not self.rendered:
+                    self.startup.frame_done()
+                self.rendered += 1
+                self.frame_times.append( time.perf_counter() - frame_start )
+                if self.governor:
+                    self.governor.sample( self.frame_times[ -1 ] * 1000.0 )
+        finally:
+            self.run = False
+            buffer.close()
+            sim.join()
+        if self.sim_error:
+            raise self.sim_error
+    # run_pipeline()
+
+
+
+    def print_stats( self ):
+        if self.profiler:
+            if self.headless:
+                for key, p in self.profiler.summary().items():
+                    print( "  %-14s p50 %0.3f  p95 %0.3f  p99 %0.3f ms" %
+                           ( key, p[ "p50" ], p[ "p95" ], p[ "p99" ] ) )
+
+        if self.headless:
+            self.print_report( self.frame_times, self.elapsed )
+
+        if self.dropped:
+            print( "Simulation: %0.1f ms dropped to cap catch-up steps" %
+                   self.dropped )
+
+        if self.renderer:
+            stats = self.renderer.get_stats()
+            print( "Renderer: %(full)d full frames, %(dirty)d dirty frames "
+                   "(%(area)0.1f%% of the screen per dirty frame)" % stats )
+
+        print( "Scheduler: %d events processed" % self.scheduler.processed )
+
+        stats = self.broadphase.get_stats()
+        print( "Collisions: %(candidates)d candidate pairs, %(hits)d hits" %
+               stats )
+
+        if self.exact:
+            stats = mask_cache.get_stats()
+            print( "Masks: %(masks)d cached, %(tests)d mask tests, "
+                   "%(hits)d hits" % stats )
+
+        if self.startup_profile:
+            self.startup.report()
+
+        if self.governor:
+            self.governor.report()
+
+        if self.pipeline:
+            stats = self.pipeline.get_stats()
+            print( "Pipeline (%(slots)d buffers): %(published)d snapshots "
+                   "published, %(taken)d rendered, %(skipped)d skipped" %
+                   stats )
+            print( "Pipeline waits: simulation %(sim_waits)d times "
+                   "(%(sim_wait)0.1f ms), render %(render_waits)d times "
+                   "(%(render_wait)0.1f ms)" % stats )
+
+        if self.scaled:
+            stats = self.scaled.get_stats()
+            print( "Display: %dx%d rendered at %dx%d (x%0.2f), %d frames "
+                   "presented" % ( stats[ "display" ] + stats[ "size" ] +
+                                   ( stats[ "factor" ], stats[ "presented" ] ) ) )
+
+        if self.particles is not None:
+            stats = self.particles.get_stats()
+            print( "Particles: peak %(peak)d/%(capacity)d, %(spawned)d "
+                   "spawned, %(dropped)d dropped" % stats )
+
+        stats = fire_pool.get_stats()
+        print( "Fire pool: high water %(high_water)d, %(allocated)d "
+               "allocated, %(reused)d allocations avoided" % stats )
+
+        print( "Level change: longest stall %0.3f ms" %
+               ( self.level_stall_max * 1000.0 ) )
+
+        print( "HUD: %d text renders, %d rebuilds" %
+               ( self.hud.renders, self.hud.rebuilds ) )
+
+        stats = image_cache.get_stats()
+        print( "Image cache: %(hits)d hits, %(misses)d misses, "
+               "%(evictions)d evictions (%(size)d/%(max_size)d)" % stats )
+
+        if image_cache.pack and image_cache.pack.stale:
+            print( "Asset pack: stale entries loaded from files: %s" %
+                   ", ".join( sorted( image_cache.pack.stale ) ) )
+
+        if image_cache.pack and image_cache.pack.converted:
+            print( "Asset pack: %d images converted to the display format "
+                   "(rebuild with --build-pack)" %
+                   image_cache.pack.converted )
+    # print_stats()
+
+
+
+    def activate( self ):
+        """
+        Instala a área e o modo de interpolação deste jogo em GameObject.
+        Vários jogos no mesmo processo (veja CoopSession) simulam um de cada
+        vez, e cada um instala os seus antes de criar ou mover objetos.
+        """
+        GameObject.area        = self.area
+        GameObject.interpolate = self.interpolate
+    # activate()
+
+
+
+    def step( self, dt ):
+        """
+        Um passo da simulação, sempre com o mesmo dt.
+        """
+        prof = self.profiler
+        self.activate()
+
+        # Handle Input Events
+        t = time.perf_counter()
+        self.handle_events( dt )
+        if prof: t = prof.mark( "handle_events", t )
+
+        # Atualiza Elementos
+        self.actors_update( dt )
+        if prof: t = prof.mark( "actors_update", t )
+
+        # Faça os atores atuarem
+        self.actors_act()
+        if prof: t = prof.mark( "actors_act", t )
+
+        # Faça a manutenção do jogo, como criar inimigos, etc.
+        self.manage()
+        if prof: t = prof.mark( "manage", t )
+
+        self.frame += 1
+    # step()
+
+
+
+    def render( self, alpha=None ):
+        prof = self.profiler
+        t    = time.perf_counter()
+        if self.renderer:
+            # Desenha e atualiza somente as regiões que mudaram (o tempo
+            # todo é contado em actors_draw)
+            self.renderer.draw( self )
+            if prof: prof.mark( "actors_draw", t )
+            return
+
+        # Desenhe para o back buffer
+        self.actors_draw( alpha )
+        if prof: t = prof.mark( "actors_draw", t )
+
+        self.draw_hud()
+        if prof: t = prof.mark( "draw_hud", t )
+
+        # ao fim do desenho temos que trocar o front buffer e o back buffer
+        self.present()
+        if prof: t = prof.mark( "flip", t )
+    # render()
+
+
+
+    def present( self, rects=None ):
+        """
+        Envia o quadro desenhado para o display, ampliando a tela interna
+        quando ela é usada (veja ScaledDisplay).
+        """
+        if self.scaled:
+            self.scaled.present( rects )
+        elif rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update( rects )
+    # present()
+
+
+
+    def print_report( self, frame_times, elapsed ):
+        """
+        Imprime a vazão da simulação e os percentis do tempo de quadro.
+        """
+        n = self.frame
+        times = sorted( t * 1000.0 for t in frame_times )
+        print( "Frames: %d simulated, %d rendered (seed %s)" %
+               ( n, self.rendered, self.seed ) )
+        print( "Throughput: %0.1f frames/s" % ( n / elapsed if elapsed else 0 ) )
+        print( "Frame time (ms): p50 %0.3f  p90 %0.3f  p99 %0.3f  max %0.3f" %
+               ( percentile( times, 50 ), percentile( times, 90 ),
+                 percentile( times, 99 ), times[ -1 ] if times else 0.0 ) )
+        print( "Player: XP %d, level %d, lives %d" %
+               ( self.player.get_XP(), self.level, self.player.get_lives() ) )
+    # print_report()
+# Game
+
+
+class BotInput:
+    """
+    Jogador automático usado nas simulações em lote.
+
+    Mantém o tiro apertado, aperta espaço de tempos em tempos e se move
+    para ficar embaixo do inimigo mais próximo. Como as outras fontes de
+    entrada, só produz eventos de teclado, então o jogo é exercitado pelo
+    mesmo caminho de um jogador de verdade.
+    """
+    def __init__( self, game, seed=None ):
+        self.game   = game
+        self.random = Random.Random( seed )
+        self.keys   = HeldKeys()
+    # __init__()
+
 
-        self.isize = image.get_size()
-        self.pos = [ 0, -1 * self.isize[ 1 ] ]
-        screen      = pygame.display.get_surface()
-        screen_size = screen.get_size()
 
-        from math import ceil
-        w = ( ceil( float( screen_size[ 0 ] ) // self.isize[ 0 ] ) + 1 ) * \
-            self.isize[ 0 ]
-        h = ( ceil( float( screen_size[ 1 ] ) // self.isize[ 1 ] ) + 1 ) * \
-            self.isize[ 1 ]
-        w = 800
-        h = 800
-        back = pygame.Surface( ( w, h ) )
-	
-        for i in range( ( back.get_size()[ 0 ] // self.isize[ 0 ] ) ):
-            for j in range( ( back.get_size()[ 1 ] // self.isize[ 1 ] ) ):
-                back.blit( image, ( i * self.isize[ 0 ], j * self.isize[ 1 ] ) )
+    def press( self, events, key, down ):
+        if self.keys[ key ] != down:
+            self.keys[ key ] = down
+            events.append( pygame.event.Event( KEYDOWN if down else KEYUP,
+                                               key=key ) )
+    # press()
 
-        self.image = back
-    # __init__()
 
 
+    def poll( self, frame ):
+        events = []
+        self.press( events, K_LCTRL, True )
+        if frame % 12 == 0:
+            self.press( events, K_SPACE, True )
+        else:
+            self.press( events, K_SPACE, False )
 
-    def update( self, dt ):
-        self.pos[ 1 ] += 1
-        if ( self.pos[ 1 ] > 0 ):
-            self.pos[ 1 ] -= self.isize[ 1 ]
-    # update()
+        player  = self.game.player
+        enemies = self.game.list[ "enemies" ].sprites()
+        x       = player.rect.centerx
+        target  = x
+        if enemies:
+            target = min( enemies,
+                          key=lambda e: abs( e.rect.centerx - x ) ).rect.centerx
+        target += self.random.randint( -20, 20 )
+        self.press( events, K_LEFT, target < x - 10 )
+        self.press( events, K_RIGHT, target > x + 10 )
+        return events
+    # poll()
 
 
 
-    def draw( self, screen ):
-        screen.blit( self.image, self.pos )
-    # draw()
-# Background
+    def get_pressed( self ):
+        return self.keys
+    # get_pressed()
 
 
 
+    def close( self ):
+        pass
+    # close()
+# BotInput
 
-class Game:
-    screen      = None
-    screen_size = None
-    run         = True
-    interval    = 0
-    level       = 0
-    list        = None
-    player      = None
-    background  = None    
-    
-    def __init__( self, size, fullscreen ):
-        pygame.font.init()
-        self.font = pygame.font.SysFont('Arial', 24)
+
+
+class PlayerControl:
+    """
+    Controla um jogador com ações ( dx, dy, tiro ), dx e dy em -1, 0 ou 1,
+    em vez de eventos de teclado. Usado pela GameEnv e pelo co-op em rede.
+
+    A direção funciona como uma tecla segurada: ao mudar, a direção
+    anterior é solta e a nova é apertada, com os mesmos Player.accel_*()
+    do teclado. O tiro segue a regra do tiro automático: dispara ao
+    apertar e depois a cada interval ms. fire é chamada para atirar; sem
+    ela só o movimento é aplicado (a predição do cliente, veja CoopClient).
+    """
+    def __init__( self, player, fire=None, interval=176 ):
+        self.player   = player
+        self.fire     = fire
+        self.interval = interval
+        self.dx       = 0
+        self.dy       = 0
+        self.firing   = False
+        self.timer    = 0
+    # __init__()
+
+
+
+    def apply( self, dx, dy, fire, elapsed=0 ):
         """
-        Esta é a função que inicializa o pygame, define a resolução da tela,
-        caption, e disabilitamos o mouse dentro desta.
+        Aplica uma ação; elapsed é o tempo, em ms, desde a ação anterior.
         """
-        actors = {}
+        player = self.player
+
+        # Solta a direção anterior e aperta a nova, como no teclado
+        if dx != self.dx:
+            if   self.dx < 0: player.accel_right()
+            elif self.dx > 0: player.accel_left()
+            if   dx < 0: player.accel_left()
+            elif dx > 0: player.accel_right()
+            self.dx = dx
+        if dy != self.dy:
+            if   self.dy < 0: player.accel_bottom()
+            elif self.dy > 0: player.accel_top()
+            if   dy < 0: player.accel_top()
+            elif dy > 0: player.accel_bottom()
+            self.dy = dy
+
+        self.timer += elapsed
+        if fire and ( not self.firing or self.timer >= self.interval ):
+            self.timer = 0
+            if self.fire:
+                self.fire()
+        self.firing = bool( fire )
+    # apply()
+# PlayerControl
+
+
+
+class GameEnv:
+    """
+    Interface no estilo do Gym para agentes automáticos: reset( seed )
+    começa uma partida e step( action ) avança o jogo e devolve
+    ( observação, recompensa, fim, info ).
+
+    O jogo roda sempre headless (driver de vídeo dummy do SDL) e sem o
+    laço de Game.loop(): cada step() executa frame_skip passos de
+    simulação com Game.step(). A ação é aplicada no primeiro deles.
+
+    Ações: um índice em actions ou uma tupla ( dx, dy, tiro ), com dx e dy
+    em -1, 0 ou 1, aplicada por um PlayerControl (direção como tecla
+    segurada, tiro automático a cada autofire_interval ms).
+
+    Observações:
+        "vector": vetor float32 com o jogador ( x, y, vx, vy, vidas, XP ),
+                  e ( x, y, vivo ) de até max_enemies inimigos e de até
+                  max_fire tiros inimigos, com as posições divididas pelo
+                  tamanho da tela.
+        "pixels": o quadro desenhado, como uma vista RGB ( altura, largura,
+                  3 ) dos pixels da tela, sem cópia.
+
+    Para "pixels" a tela do jogo é trocada por uma superfície criada com
+    pygame.image.frombuffer() sobre um vetor do NumPy da própria GameEnv:
+    o jogo desenha direto na memória do vetor e a observação é só uma vista
+    dele. (Uma vista de pygame.surfarray.pixels3d() travaria a superfície
+    enquanto o agente a guardasse, e o desenho seguinte falharia.)
+
+    As duas observações são reaproveitadas e reescritas a cada step(); para
+    guardar uma delas é preciso copiá-la com numpy.array().
+    """
+    actions = [ ( dx, dy, fire ) for fire in ( 0, 1 )
+                                 for dy in ( -1, 0, 1 )
+                                 for dx in ( -1, 0, 1 ) ]
+
+    def __init__( self, size=( 640, 480 ), observation="vector",
+                  frame_skip=1, max_enemies=16, max_fire=32,
+                  max_frames=None, **options ):
+        if numpy is None:
+            raise RuntimeError( "GameEnv needs NumPy" )
+        if observation not in ( "vector", "pixels" ):
+            raise ValueError( "unknown observation: %s" % observation )
+
+        os.environ.setdefault( "SDL_VIDEODRIVER", "dummy" )
+        os.environ.setdefault( "SDL_AUDIODRIVER", "dummy" )
         pygame.init()
-        flags = DOUBLEBUF
-        if fullscreen:
-            flags |= FULLSCREEN
-        self.screen       = pygame.display.set_mode( size, flags )
-        self.screen_size = self.screen.get_size()
+        options.setdefault( "particles", 0 )
+        self.game        = Game( size, False, headless=True, input=self,
+                                 **options )
+        self.observation = observation
+        self.frame_skip  = frame_skip
+        self.max_enemies = max_enemies
+        self.max_fire    = max_fire
+        self.max_frames  = max_frames
+        self.keys        = HeldKeys()
+        self.vector      = numpy.zeros( 6 + 3 * ( max_enemies + max_fire ),
+                                        numpy.float32 )
+        self.pixels      = None
+        self.loaded      = False
+
+        if observation == "pixels":
+            # Mesmo formato da tela (BGRA), assim os blits não convertem
+            w, h        = self.game.screen.get_size()
+            self.buffer = numpy.zeros( ( h, w, 4 ), numpy.uint8 )
+            self.game.set_screen( pygame.image.frombuffer( self.buffer,
+                                                           ( w, h ), "BGRA" ) )
+            self.pixels = self.buffer[ :, :, 2 : : -1 ]
+    # __init__()
 
-        pygame.mouse.set_visible( 0 )
-        pygame.display.set_caption( 'Título da Janela' )
-    # init()
 
-    def draw_hud(self):
-        if self.player:
-       
-            lives_text = f'Vidas: {self.player.get_lives()}'
-            text_surface = self.font.render(lives_text, True, (255, 255, 255))  # branco
-            self.screen.blit(text_surface, (10, 10))  # posição no canto superior esquerdo
 
-            xp_text = f'XP: {self.player.get_XP()}'
-            text_surface = self.font.render(xp_text, True, (255, 255, 255))  # branco
-            self.screen.blit(text_surface, (10, 35)) 
+    # A própria GameEnv é a fonte de entrada do jogo: não há eventos, as
+    # ações vêm de step()
+    def poll( self, frame ):
+        return ()
+    # poll()
+
+
+
+    def get_pressed( self ):
+        return self.keys
+    # get_pressed()
+
+
+
+    def close( self ):
+        pass
+    # close()
 
-            level_text = f'Level: {self.level}'
-            text_surface = self.font.render(level_text, True, (255, 255, 255))  # branco
-            self.screen.blit(text_surface, (10, 60))
-    
-    def finish_game(self):
-        if self.player:
-       
-            lives_text = f'Vidas: {self.player.get_lives()}'
-          
 
-    def handle_events( self ):
+
+    def reset( self, seed=None ):
+        game = self.game
+        if not self.loaded:
+            game.load_fonts()
+            game.load_images()
+            game.load_background()
+            self.loaded = True
+        game.reset( seed )
+        self.control = PlayerControl( game.player, game.fire,
+                                      game.autofire_interval )
+        return self.observe()
+    # reset()
+
+
+
+    def apply( self, action ):
+        if not isinstance( action, tuple ):
+            action = self.actions[ action ]
+        dx, dy, fire = action
+        # O tempo desde a ação anterior é o do tiro automático do jogo, que
+        # Game.fire() zera
+        self.control.timer = self.game.fire_timer
+        self.control.apply( dx, dy, fire )
+    # apply()
+
+
+
+    def step( self, action ):
         """
-        Trata o evento e toma a ação necessária.
+        Retorna ( observação, recompensa, fim, info ). A recompensa é o XP
+        ganho menos as vidas perdidas durante o step().
         """
-        player = self.player
+        game   = self.game
+        player = game.player
+        xp     = player.get_XP()
+        lives  = player.get_lives()
+        self.apply( action )
+        for i in range( self.frame_skip ):
+            game.step( game.sim_dt )
+            if not game.run:
+                break
+        done = not game.run or \
+               ( self.max_frames is not None and game.frame >= self.max_frames )
+        reward = ( player.get_XP() - xp ) - ( lives - player.get_lives() )
+        info   = { "frame" : game.frame,
+                   "level" : game.level,
+                   "lives" : player.get_lives(),
+                   "xp"    : player.get_XP() }
+        return self.observe(), reward, done, info
+    # step()
+
+
+
+    def observe( self ):
+        if self.observation == "pixels":
+            return self.render()
+
+        game   = self.game
+        w, h   = game.screen_size
+        v      = self.vector
+        player = game.player
+        v[ : ] = 0.0
+        v[ 0 ] = player.rect.centerx / float( w )
+        v[ 1 ] = player.rect.centery / float( h )
+        v[ 2 ] = player.speed[ 0 ] / 10.0
+        v[ 3 ] = player.speed[ 1 ] / 10.0
+        v[ 4 ] = player.get_lives() / 10.0
+        v[ 5 ] = player.get_XP() / 100.0
+        i = 6
+        for name, count in ( ( "enemies", self.max_enemies ),
+                             ( "enemies_fire", self.max_fire ) ):
+            group = game.list[ name ]
+            if isinstance( group, ProjectileGroup ):
+                centers = group.centers()[ : count ]
+            else:
+                centers = [ s.rect.center for s in group.sprites()[ : count ] ]
+            for j, ( x, y ) in enumerate( centers ):
+                k = i + 3 * j
+                v[ k ]     = x / float( w )
+                v[ k + 1 ] = y / float( h )
+                v[ k + 2 ] = 1.0
+            i += 3 * count
+        return v
+    # observe()
+
+
+
+    def render( self ):
+        """
+        Desenha o quadro atual e retorna a vista ( altura, largura, 3 ) dos
+        pixels da tela, sem cópia.
+        """
+        self.game.actors_draw()
+        self.game.draw_hud()
+        return self.pixels
+    # render()
+# GameEnv
 
-        for event in pygame.event.get():
-            t = event.type
-            if t in ( KEYDOWN, KEYUP ):
-                k = event.key
-        
-            if t == QUIT:
-                self.run = False
 
-            elif t == KEYDOWN:
-                if   k == K_ESCAPE:
-                    self.run = False
-                elif k == K_LCTRL or k == K_RCTRL or k == K_SPACE or k == K_RETURN:
-                    self.interval = 0
-                    player.fire( self.list[ "fire" ] )
-                elif k == K_UP or k == K_w:
-                    player.accel_top()
-                elif k == K_DOWN or k == K_s:
-                    player.accel_bottom()
-                elif k == K_RIGHT or k == K_d:
-                    player.accel_right()
-                elif k == K_LEFT or k == K_a:
-                    player.accel_left()
-        
-            elif t == KEYUP:
-                if   k == K_DOWN or k == K_s:
-                    player.accel_top()
-                elif k == K_UP or k == K_w:
-                    player.accel_bottom()
-                elif k == K_LEFT or k == K_a:
-                    player.accel_right()
-                elif k == K_RIGHT or k == K_d:
-                    player.accel_left()
-        
-            keys = pygame.key.get_pressed()
-            if self.interval > 10:
-                self.interval = 0
-                if keys[ K_RCTRL ] or keys[ K_LCTRL ]:
-                    player.fire( self.list[ "fire" ] )        
-    # handle_events()
 
+def write_zigzag( f, n ):
+    """
+    Grava um inteiro com sinal como varint: 0, -1, 1, -2, ... viram
+    0, 1, 2, 3, ..., assim deslocamentos pequenos ocupam um byte.
+    """
+    write_varint( f, n * 2 if n >= 0 else -n * 2 - 1 )
+# write_zigzag()
 
 
 
-    def actors_update( self, dt ):        
-        self.background.update( dt )
-        
-        for actor in self.list.values():
-            actor.update( dt )
-    # actors_update()
+def read_zigzag( f ):
+    n = read_varint( f )
+    return -( ( n + 1 ) >> 1 ) if n & 1 else n >> 1
+# read_zigzag()
 
 
 
-    def actors_draw( self ):
-        self.background.draw( self.screen )
-        
-        for actor in self.list.values():
-            actor.draw( self.screen )
-    # actors_draw()
-    
+class CoopPeer:
+    """
+    Um cliente conectado ao CoopServer: o jogador que ele controla, as
+    entradas ainda não aplicadas e as vistas do mundo já enviadas, à espera
+    da confirmação (ack) do cliente.
+    """
+    def __init__( self, addr, session, index ):
+        self.addr     = addr
+        self.session  = session
+        self.index    = index
+        self.control  = None
+        self.inputs   = deque()
+        self.received = 0      # último seq recebido
+        self.seq      = 0      # último seq aplicado à simulação
+        self.applied  = 0      # tick em que seq foi aplicado
+        self.echo     = 0.0    # hora do cliente na última entrada
+        self.acked    = 0      # último tick confirmado pelo cliente
+        self.views    = {}     # tick -> vista enviada nesse tick
+        self.dropped  = 0
+        self.repeated = 0
+    # __init__()
 
 
-    def actor_check_hit( self, actor, list, action ):
-        if   isinstance( actor, pygame.sprite.RenderPlain ):
-            hitted = pygame.sprite.groupcollide( actor, list, 1, 0 )
-            for v in hitted.values():
-                for o in v:
-                    action( o )
-            return hitted
-        
-        elif isinstance( actor, pygame.sprite.Sprite ):
-            if pygame.sprite.spritecollide( actor, list, 1 ):
-                action()
-            return actor.is_dead()
-    # actor_check_hit()
 
+    def receive( self, data ):
+        kind, seq, ack, dx, dy, fire, sent = CoopServer.input.unpack( data )
+        if seq <= self.received:
+            return
+        self.received = seq
+        self.echo     = sent
+        self.inputs.append( ( seq, dx, dy, fire ) )
+        # Se o cliente se adianta, descartamos as entradas mais antigas em
+        # vez de deixar o atraso crescer
+        while len( self.inputs ) > CoopServer.max_inputs:
+            self.inputs.popleft()
+            self.dropped += 1
 
-    
-    def actors_act( self ):
-        # Verifica se personagem foi atingido por um tiro
-        self.actor_check_hit( self.player, self.list[ "enemies_fire" ],
-                              self.player.do_hit )
-        if self.player.is_dead():
-            self.run = False
+        if ack > self.acked and ack in self.views:
+            self.acked = ack
+            for tick in [ t for t in self.views if t < ack ]:
+                del self.views[ tick ]
+    # receive()
+# CoopPeer
+
+
+
+class CoopSession:
+    """
+    Uma partida co-op hospedada pelo CoopServer: um Game headless, sem
+    janela nem desenho, com um jogador por cliente. A cada tick aplica uma
+    entrada de cada cliente, avança a simulação e envia a cada um o seu
+    snapshot (veja CoopServer.snapshot()).
+    """
+    def __init__( self, server, index, seed ):
+        self.server  = server
+        self.index   = index
+        self.peers   = []
+        self.tick    = 0
+        self.rounds  = 1
+        # Os tiros precisam ser sprites para terem um id cada
+        self.game    = Game( server.size, False, headless=True, seed=seed,
+                             input=self, particles=0,
+                             sim_rate=server.sim_rate,
+                             players=server.players, window=False )
+        self.game.load_images()
+        self.game.load_background()
+        self.game.reset()
+        self.keys    = HeldKeys()
+    # __init__()
+
+
+
+    # A sessão é a fonte de entrada do seu Game: as ações chegam pela rede
+    def poll( self, frame ):
+        return ()
+    # poll()
+
+
+
+    def get_pressed( self ):
+        return self.keys
+    # get_pressed()
+
+
+
+    def close( self ):
+        pass
+    # close()
+
+
+
+    def add( self, peer ):
+        self.peers.append( peer )
+        self.control( peer )
+    # add()
+
+
+
+    def control( self, peer ):
+        game   = self.game
+        player = game.players[ peer.index ]
+        peer.control = PlayerControl( player,
+                                      lambda: game.fire( player ),
+                                      game.autofire_interval )
+    # control()
+
+
+
+    def entities( self ):
+        """
+        Estado de todos os inimigos e tiros: { id : ( imagem, x, y ) }. O
+        id é o GameObject.net_id, dado quando o sprite é criado (ou quando
+        um tiro sai da reserva), então um tiro que morre e é disparado de
+        novo entre dois ticks aparece como remoção mais criação.
+        """
+        images = self.server.image_ids
+        state  = {}
+        for name in ( "enemies", "fire", "enemies_fire" ):
+            for s in self.game.list[ name ]:
+                state[ s.net_id ] = ( images.get( id( s.image ), 0 ),
+                                      s.rect.x, s.rect.y )
+        return state
+    # entities()
+
+
+
+    def step( self ):
+        game = self.game
+        dt   = game.sim_dt
+        for peer in self.peers:
+            control = peer.control
+            if peer.inputs:
+                peer.seq, dx, dy, fire = peer.inputs.popleft()
+                peer.applied = self.tick + 1
+            else:
+                # Nenhuma entrada nova a tempo: repete a anterior
+                dx, dy, fire = control.dx, control.dy, control.firing
+                peer.repeated += 1
+            control.apply( dx, dy, fire, dt )
+
+        game.step( dt )
+        if not game.run:
+            # Todos morreram: começa outra partida para os mesmos clientes
+            game.reset()
+            self.rounds += 1
+            for peer in self.peers:
+                self.control( peer )
+        self.tick += 1
+
+        state = self.entities()
+        for peer in self.peers:
+            self.server.send( peer, self.server.snapshot( self, peer, state ) )
+    # step()
+# CoopSession
+
+
+
+class CoopServer( asyncio.DatagramProtocol ):
+    """
+    Servidor do co-op em rede (UDP). Hospeda até max_sessions partidas de
+    players jogadores no mesmo processo; cada cliente que chega entra na
+    primeira partida com vaga. A simulação de todas é autoritativa e anda
+    no ritmo de sim_rate; os clientes só mandam entradas.
+
+    Mensagens (little-endian, a primeira letra é o tipo):
+        "J" JOIN:     pedido para entrar (repetido até chegar o WELCOME)
+        "W" WELCOME:  sessão, jogador, jogadores, largura, altura, sim_rate
+        "I" INPUT:    seq, último tick recebido (ack), dx, dy, tiro e a
+                      hora do cliente, devolvida no snapshot para medir o
+                      tempo de ida e volta
+        "S" SNAPSHOT: tick, tick base, último seq aplicado e o tick em que
+                      ele foi aplicado, hora ecoada, nível e número de
+                      jogadores; depois ( x, y, vx, vy ) de cada jogador,
+                      com as vidas (zigzag) e o XP (varint), os ids
+                      removidos desde a base e as entidades alteradas
+        "L" LEAVE:    o cliente saiu
+
+    Snapshots são deltas contra a última vista que o cliente confirmou:
+    uma entidade alterada vai como id e deslocamento (varint zigzag), ou
+    com a imagem e a posição absoluta se é nova. Se o cliente não confirma
+    nada há mais de max_lag ticks o snapshot vai completo (base 0). Cada
+    snapshot tem no máximo budget bytes: os jogadores vão sempre, depois as
+    remoções e por fim as entidades mais próximas do jogador do cliente;
+    o que não cabe fica para o próximo tick, que ainda vê a diferença.
+    """
+    images     = ( "nave.png", "inimigo.png", "tiro.png", "tiro_inimigo.png" )
+    join       = struct.Struct( "<c" )
+    welcome    = struct.Struct( "<cHBBHHf" )
+    input      = struct.Struct( "<cIIbbBd" )
+    header     = struct.Struct( "<cIIIIdBB" )
+    player     = struct.Struct( "<ddhh" )
+    max_lag    = 30
+    max_inputs = 3
+
+    def __init__( self, max_sessions=1, players=2, size=( 640, 480 ),
+                  sim_rate=62.5, budget=1200, seed=0 ):
+        self.max_sessions = max_sessions
+        self.players      = players
+        self.size         = tuple( size )
+        self.sim_rate     = sim_rate
+        self.sim_dt       = 1000.0 / sim_rate
+        self.budget       = budget
+        self.seed         = seed
+        self.sessions     = []
+        self.peers        = {}
+        self.joined       = 0
+        self.transport    = None
+        self.running      = True
+        self.ticks        = 0
+        self.tick_times   = []
+        self.sizes        = []
+        self.full         = 0
+        self.deferred     = 0
+        self.image_ids    = {}
+
+        # As sessões não têm janela, mas as imagens são convertidas para o
+        # formato da tela, e isso precisa de algum modo de vídeo
+        pygame.init()
+        if pygame.display.get_surface() is None:
+            pygame.display.set_mode( ( 1, 1 ) )
+    # __init__()
+
+
+
+    def connection_made( self, transport ):
+        self.transport = transport
+    # connection_made()
+
+
+
+    def datagram_received( self, data, addr ):
+        kind = data[ : 1 ]
+        try:
+            if kind == b"I":
+                peer = self.peers.get( addr )
+                if peer:
+                    peer.receive( data )
+            elif kind == b"J":
+                self.add_peer( addr )
+            elif kind == b"L":
+                self.remove_peer( addr )
+        except struct.error:
+            pass
+    # datagram_received()
+
+
+
+    def add_peer( self, addr ):
+        peer = self.peers.get( addr )
+        if peer is None:
+            session = None
+            for s in self.sessions:
+                if len( s.peers ) < self.players:
+                    session = s
+                    break
+            if session is None:
+                if len( self.sessions ) >= self.max_sessions:
+                    return
+                session = CoopSession( self, len( self.sessions ),
+                                       self.seed + len( self.sessions ) )
+                self.sessions.append( session )
+                if not self.image_ids:
+                    self.image_ids = dict( ( id( image_cache.load( name ) ), i )
+                                           for i, name
+                                           in enumerate( self.images ) )
+            used  = set( p.index for p in session.peers )
+            index = min( set( range( self.players ) ) - used )
+            peer  = CoopPeer( addr, session, index )
+            session.add( peer )
+            self.peers[ addr ] = peer
+            self.joined += 1
+
+        # O WELCOME é reenviado a cada JOIN repetido, caso tenha se perdido
+        self.transport.sendto( self.welcome.pack( b"W", peer.session.index,
+                                                  peer.index, self.players,
+                                                  self.size[ 0 ],
+                                                  self.size[ 1 ],
+                                                  self.sim_rate ), addr )
+    # add_peer()
+
+
+
+    def remove_peer( self, addr ):
+        peer = self.peers.pop( addr, None )
+        if peer:
+            peer.session.peers.remove( peer )
+    # remove_peer()
+
+
+
+    def snapshot( self, session, peer, state ):
+        game      = session.game
+        tick      = session.tick
+        base_tick = peer.acked
+        base      = peer.views.get( base_tick )
+        if base is None or tick - base_tick > self.max_lag:
+            base_tick  = 0
+            base       = {}
+            peer.views = {}
+            peer.acked = 0
+            self.full += 1
+
+        out = io.BytesIO()
+        out.write( self.header.pack( b"S", tick, base_tick, peer.seq,
+                                     peer.applied, peer.echo, game.level,
+                                     len( game.players ) ) )
+        for p in game.players:
+            out.write( self.player.pack( p.fx, p.fy, p.speed[ 0 ],
+                                         p.speed[ 1 ] ) )
+            write_zigzag( out, p.get_lives() )
+            write_varint( out, p.get_XP() )
+        view = dict( base )
+
+        # O que sobra do orçamento, já descontados os dois contadores
+        # (varints de até 3 bytes)
+        room    = self.budget - out.tell() - 6
+        removed = io.BytesIO()
+        gone    = 0
+        for nid in base:
+            if nid in state:
+                continue
+            pos = removed.tell()
+            write_varint( removed, nid )
+            if removed.tell() > room:
+                removed.seek( pos )
+                removed.truncate()
+                self.deferred += 1
+                continue
+            del view[ nid ]
+            gone += 1
+        write_varint( out, gone )
+        out.write( removed.getvalue() )
+        room -= removed.tell()
+
+        # As entidades alteradas mais próximas do jogador vão primeiro
+        x, y    = game.players[ peer.index ].rect.center
+        changed = [ nid for nid, e in state.items() if base.get( nid ) != e ]
+        changed.sort( key=lambda nid: abs( state[ nid ][ 1 ] - x ) +
+                                      abs( state[ nid ][ 2 ] - y ) )
+
+        entries = io.BytesIO()
+        count   = 0
+        for nid in changed:
+            pos = entries.tell()
+            e   = state[ nid ]
+            b   = base.get( nid )
+            write_varint( entries, nid )
+            if b is None or b[ 0 ] != e[ 0 ]:
+                write_varint( entries, e[ 0 ] + 1 )
+                write_zigzag( entries, e[ 1 ] )
+                write_zigzag( entries, e[ 2 ] )
+            else:
+                write_varint( entries, 0 )
+                write_zigzag( entries, e[ 1 ] - b[ 1 ] )
+                write_zigzag( entries, e[ 2 ] - b[ 2 ] )
+            if entries.tell() > room:
+                entries.seek( pos )
+                entries.truncate()
+                self.deferred += 1
+                continue
+            view[ nid ] = e
+            count += 1
+        write_varint( out, count )
+        out.write( entries.getvalue() )
+
+        peer.views[ tick ] = view
+        return out.getvalue()
+    # snapshot()
+
+
+
+    def send( self, peer, data ):
+        self.sizes.append( len( data ) )
+        self.transport.sendto( data, peer.addr )
+    # send()
+
+
+
+    async def run( self, ticks=None ):
+        """
+        Avança todas as sessões com clientes a cada sim_dt, até ticks
+        ticks (ou até stop()).
+        """
+        loop = asyncio.get_running_loop()
+        next = loop.time()
+        while self.running and ( ticks is None or self.ticks < ticks ):
+            t = time.perf_counter()
+            for session in self.sessions:
+                if session.peers:
+                    session.step()
+            self.tick_times.append( time.perf_counter() - t )
+            self.ticks += 1
+            next += self.sim_dt / 1000.0
+            await asyncio.sleep( max( 0.0, next - loop.time() ) )
+    # run()
+
+
+
+    def stop( self ):
+        self.running = False
+    # stop()
+
+
+
+    def print_stats( self ):
+        times = sorted( t * 1000.0 for t in self.tick_times )
+        sizes = self.sizes
+        print( "Server: %d sessions, %d clients, %d ticks, %d rounds" %
+               ( len( self.sessions ), self.joined, self.ticks,
+                 sum( s.rounds for s in self.sessions ) ) )
+        print( "Server tick (ms): p50 %0.3f  p99 %0.3f  max %0.3f" %
+               ( percentile( times, 50 ), percentile( times, 99 ),
+                 times[ -1 ] if times else 0.0 ) )
+        if sizes:
+            print( "Snapshots: %d sent, %0.1f bytes avg, %d max (budget %d), "
+                   "%0.1f KB/s per client, %d full" %
+                   ( len( sizes ), sum( sizes ) / len( sizes ), max( sizes ),
+                     self.budget,
+                     sum( sizes ) / len( sizes ) * self.sim_rate / 1024.0,
+                     self.full ) )
+        peers = list( self.peers.values() )
+        print( "Entity updates deferred by the budget: %d; inputs dropped "
+               "%d, repeated %d" %
+               ( self.deferred, sum( p.dropped for p in peers ),
+                 sum( p.repeated for p in peers ) ) )
+    # print_stats()
+# CoopServer
+
+
+
+class CoopClient( asyncio.DatagramProtocol ):
+    """
+    Cliente do co-op em rede. Manda uma entrada ( dx, dy, tiro ) por tick,
+    vinda do teclado ou, com bot, de um jogador automático como o
+    BotInput, e remonta o mundo a partir dos snapshots do CoopServer.
+
+    O jogador local é previsto: a entrada é aplicada na hora a uma cópia
+    do Player, com o mesmo PlayerControl do servidor, sem esperar a
+    resposta. A cada snapshot a cópia volta ao estado que o servidor
+    calculou para a última entrada aplicada e as entradas ainda não
+    aplicadas são refeitas por cima. Quando a previsão diverge do servidor
+    a diferença é contada como correção.
+    """
+    def __init__( self, bot=None, bindings=None ):
+        self.random      = Random.Random( bot )
+        self.bot         = bot is not None
+        self.input_map   = InputMap( bindings )
+        self.transport   = None
+        self.session     = None
+        self.index       = None
+        self.player      = None
+        self.control     = None
+        self.players     = []
+        self.level       = 0
+        self.seq         = 0
+        self.tick        = 0
+        self.view        = {}
+        self.views       = {}
+        self.pending     = deque()   # ( seq, dx, dy ) ainda não aplicados
+        self.predicted   = {}        # seq -> ( fx, fy, vx, vy ) previsto
+        self.base_input  = ( 0, 0 )
+        self.dy          = 0
+        self.rtts        = []
+        self.sizes       = []
+        self.full        = 0
+        self.missing     = 0
+        self.stale       = 0
+        self.corrections = 0
+        self.max_error   = 0.0
+        self.background  = None
+        self.font        = None
+    # __init__()
+
+
+
+    def connection_made( self, transport ):
+        self.transport = transport
+    # connection_made()
+
+
+
+    def datagram_received( self, data, addr ):
+        kind = data[ : 1 ]
+        try:
+            if kind == b"S":
+                self.receive_snapshot( data )
+            elif kind == b"W":
+                self.receive_welcome( data )
+        except ( struct.error, EOFError, KeyError ):
+            self.missing += 1
+    # datagram_received()
+
+
+
+    def receive_welcome( self, data ):
+        if self.index is not None:
             return
-            
-        # Verifica se o personagem trombou em algum inimigo
-        self.actor_check_hit( self.player, self.list[ "enemies" ],
-                              self.player.do_collision )
-        if self.player.is_dead():
-            self.run = False
+        kind, self.session, index, players, w, h, sim_rate = \
+            CoopServer.welcome.unpack( data )
+        self.area    = pygame.Rect( 0, 0, w, h )
+        self.size    = ( w, h )
+        self.sim_dt  = 1000.0 / sim_rate
+        self.images  = [ image_cache.load( name )
+                         for name in CoopServer.images ]
+        self.activate()
+        self.player  = Player( [ w * ( index + 1 ) // ( players + 1 ), h ] )
+        self.control = PlayerControl( self.player )
+        self.index   = index
+    # receive_welcome()
+
+
+
+    def receive_snapshot( self, data ):
+        if self.index is None:
+            return
+        f = io.BytesIO( data )
+        kind, tick, base_tick, seq, applied, echo, level, n = \
+            CoopServer.header.unpack( f.read( CoopServer.header.size ) )
+        if tick <= self.tick:
+            self.stale += 1
             return
+        if base_tick:
+            base = self.views.get( base_tick )
+            if base is None:
+                self.missing += 1
+                return
+        else:
+            base = {}
+            self.full += 1
+
+        players = []
+        for i in range( n ):
+            p = CoopServer.player.unpack( f.read( CoopServer.player.size ) )
+            players.append( p + ( read_zigzag( f ), read_varint( f ) ) )
+        view = dict( base )
+        for i in range( read_varint( f ) ):
+            view.pop( read_varint( f ), None )
+        for i in range( read_varint( f ) ):
+            nid   = read_varint( f )
+            image = read_varint( f )
+            x     = read_zigzag( f )
+            y     = read_zigzag( f )
+            if image:
+                view[ nid ] = ( image - 1, x, y )
+            else:
+                image, bx, by = view[ nid ]
+                view[ nid ] = ( image, bx + x, by + y )
+
+        self.views[ tick ] = view
+        if len( self.views ) > 4 * CoopServer.max_lag:
+            for t in [ t for t in self.views
+                       if t < tick - 2 * CoopServer.max_lag ]:
+                del self.views[ t ]
+        self.tick    = tick
+        self.view    = view
+        self.players = players
+        self.level   = level
+        self.sizes.append( len( data ) )
+        if echo:
+            self.rtts.append( ( time.perf_counter() - echo ) * 1000.0 )
+        self.reconcile( seq, tick - applied, players[ self.index ] )
+    # receive_snapshot()
+
+
+
+    def activate( self ):
+        # A predição usa a área do jogo do servidor, como Game.activate()
+        GameObject.area        = self.area
+        GameObject.interpolate = False
+    # activate()
+
+
+
+    def place( self, fx, fy, vx, vy ):
+        player = self.player
+        player.fx = fx
+        player.fy = fy
+        player.rect.x = floor( fx )
+        player.rect.y = floor( fy )
+        player.set_speed( ( vx, vy ) )
+    # place()
 
-        # Verifica se o personagem atingiu algum alvo.
-        hitted = self.actor_check_hit( self.list[ "fire" ],
-                                       self.list[ "enemies" ],
-                                       Enemy.do_hit )
-        
-        # Aumenta a eXPeriência baseado no número de acertos:
-        self.player.set_XP( self.player.get_XP() + len( hitted ) )
-    # actors_check_hit()
 
 
+    def reconcile( self, seq, repeated, state ):
+        """
+        Volta o jogador local ao estado do servidor e refaz por cima as
+        entradas que o servidor ainda não aplicou.
 
-    def change_level( self ):
-        xp = self.player.get_XP()
-        if   xp > 15  and self.level == 0:
-            self.background = Background( "tile2.png" )
-            self.level = 1
-            self.player.set_lives( self.player.get_lives() + 3 )
-        elif xp > 50  and self.level == 1:
-            self.background = Background( "tile3.png" )
-            self.level = 2        
-            self.player.set_lives( self.player.get_lives() + 6 )
-        elif xp > 100  and self.level == 2:
-            self.background = Background( "espaco.png" )
-            self.level = 3        
-            self.player.set_lives( self.player.get_lives() + 10 )
-    # change_level()
+        O estado é o do tick do snapshot: a entrada seq foi aplicada
+        repeated ticks antes e, sem entradas novas a tempo, repetida em
+        cada um deles (veja CoopSession.step()). A previsão feita para seq
+        anda esses mesmos passos antes de ser comparada com o servidor.
+        """
+        self.activate()
+        fx, fy, vx, vy, lives, xp = state
+        player  = self.player
+        control = self.control
+        pending = self.pending
+        while pending and pending[ 0 ][ 0 ] <= seq:
+            s, dx, dy = pending.popleft()
+            self.base_input = ( dx, dy )
+        guess = self.predicted.pop( seq, None )
+        for s in [ s for s in self.predicted if s < seq ]:
+            del self.predicted[ s ]
+        if guess is not None:
+            self.place( *guess )
+            for i in range( repeated ):
+                player.update( self.sim_dt )
+            error = max( abs( player.fx - fx ), abs( player.fy - fy ) )
+            if error > 0.01:
+                self.corrections += 1
+                self.max_error = max( self.max_error, error )
+
+        self.place( fx, fy, vx, vy )
+        player.set_lives( lives )
+        player.set_XP( xp )
+        control.dx, control.dy = self.base_input
+        # As previsões das entradas refeitas também são refeitas, a partir
+        # do estado novo
+        for s, dx, dy in pending:
+            control.apply( dx, dy, 0 )
+            player.update( self.sim_dt )
+            self.predicted[ s ] = ( player.fx, player.fy,
+                                    player.speed[ 0 ], player.speed[ 1 ] )
+    # reconcile()
+
+
+
+    def send_input( self, dx, dy, fire ):
+        self.seq += 1
+        self.transport.sendto( CoopServer.input.pack( b"I", self.seq,
+                                                      self.tick, dx, dy,
+                                                      fire,
+                                                      time.perf_counter() ) )
+        # Predição: aplica a entrada na hora, como o servidor fará
+        self.activate()
+        self.control.apply( dx, dy, 0 )
+        self.player.update( self.sim_dt )
+        self.pending.append( ( self.seq, dx, dy ) )
+        player = self.player
+        self.predicted[ self.seq ] = ( player.fx, player.fy,
+                                       player.speed[ 0 ], player.speed[ 1 ] )
+    # send_input()
 
 
 
-    def manage( self ):
-        self.ticks += 1
-        # Faz os inimigos atirarem aleatóriamente
-        if self.ticks > Random.randint( 20, 30 ):
-            for enemy in self.list[ "enemies" ].sprites():
-                if Random.randint( 0, 10 ) > 5:
-                    enemy.fire( self.list[ "enemies_fire" ],
-                                image="tiro_inimigo.png" )
-                    self.ticks = 0
-        
-        # criamos mais inimigos randomicamente para o jogo não ficar chato
-        r = Random.randint( 0, 100 )
-        x = Random.randint( 1, self.screen_size[ 0 ] // 20 )
-        if ( r > ( 40 * len( self.list[ "enemies" ] ) ) ):
-            enemy = Enemy( [ 0, 0 ] )
-            size  = enemy.get_size()
-            enemy.set_pos( [ x * size[ 0 ], - size[ 1 ] ] )
-            self.list[ "enemies" ].add( enemy )
+    def decide( self ):
+        """
+        Retorna a próxima ação ( dx, dy, tiro ), ou None para sair.
+        """
+        if self.bot:
+            # Fica embaixo do inimigo mais próximo, atirando sempre, e de
+            # vez em quando muda a direção vertical
+            x       = self.player.rect.centerx
+            half    = self.images[ 1 ].get_width() // 2
+            enemies = [ e for e in self.view.values() if e[ 0 ] == 1 ]
+            target  = x
+            if enemies:
+                target = min( enemies,
+                              key=lambda e: abs( e[ 1 ] + half - x ) )[ 1 ]
+                target += half
+            target += self.random.randint( -20, 20 )
+            if self.seq % 30 == 0:
+                self.dy = self.random.choice( ( -1, 0, 0, 1 ) )
+            dx = -1 if target < x - 10 else 1 if target > x + 10 else 0
+            return ( dx, self.dy, 1 )
 
-        # Verifica se ascendeu de nível
-        self.change_level()
-    # manage()
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                return None
+        keys = pygame.key.get_pressed()
+        held = set( a for k, a in self.input_map.bindings.items()
+                    if keys[ k ] )
+        if "quit" in held:
+            return None
+        return ( ( "right" in held ) - ( "left" in held ),
+                 ( "down" in held ) - ( "up" in held ),
+                 int( "fire" in held or "autofire" in held ) )
+    # decide()
 
 
-    
-    def loop( self ):
-        
+
+    def draw( self, screen ):
+        if self.background is None:
+            self.background = Background( "tile.png" )
+            self.font       = pygame.font.Font( None, 24 )
+        self.background.update( self.sim_dt )
+        self.background.draw( screen )
+
+        images = self.images
+        screen.blits( [ ( images[ i ], ( x, y ) )
+                        for i, x, y in self.view.values() ], False )
+        for i, p in enumerate( self.players ):
+            if i != self.index and p[ 4 ]:
+                screen.blit( images[ 0 ], ( floor( p[ 0 ] ), floor( p[ 1 ] ) ) )
+        if self.player.get_lives():
+            screen.blit( images[ 0 ], self.player.rect )
+
+        rtt  = self.rtts[ -1 ] if self.rtts else 0.0
+        text = "Vidas: %d  XP: %d  Nível: %d  RTT: %0.1f ms" % \
+               ( self.player.get_lives(), self.player.get_XP(),
+                 self.level + 1, rtt )
+        screen.blit( self.font.render( text, True, ( 255, 255, 255 ) ),
+                     ( 10, 10 ) )
+    # draw()
+
+
+
+    async def run( self, ticks=None, screen=None ):
         """
-        Laço principal
+        Entra em uma sessão e joga por ticks ticks (ou até sair); com
+        screen, desenha o mundo a cada tick.
         """
-        # Criamos o fundo
-        self.background = Background( "tile.png" )
+        loop = asyncio.get_running_loop()
+        for attempt in range( 50 ):
+            self.transport.sendto( CoopServer.join.pack( b"J" ) )
+            for i in range( 10 ):
+                await asyncio.sleep( 0.01 )
+                if self.index is not None:
+                    break
+            if self.index is not None:
+                break
+        else:
+            raise ConnectionError( "no answer from the co-op server" )
 
-        # Inicializamos o relogio e o dt que vai limitar o valor de
-        # frames por segundo do jogo
-        clock         = pygame.time.Clock()
-        dt            = 16
-        self.ticks    = 0
-        self.interval = 1
+        if screen is not None and screen.get_size() != self.size:
+            screen = pygame.display.set_mode( self.size )
+        next = loop.time()
+        n    = 0
+        while ticks is None or n < ticks:
+            action = self.decide()
+            if action is None:
+                break
+            self.send_input( *action )
+            if screen is not None:
+                self.draw( screen )
+                pygame.display.flip()
+            n    += 1
+            next += self.sim_dt / 1000.0
+            await asyncio.sleep( max( 0.0, next - loop.time() ) )
+        self.transport.sendto( b"L" )
+    # run()
 
-        pos         = [ self.screen_size[ 0 ] // 2, self.screen_size[ 1 ] ]
-        self.player = Player( pos, lives=10 )
 
-        self.list = {
-            "player"       : pygame.sprite.RenderPlain( self.player ),
-            "enemies"      : pygame.sprite.RenderPlain( Enemy( [ 120, 0 ] ) ),
-            "fire"         : pygame.sprite.RenderPlain(),
-            "enemies_fire" : pygame.sprite.RenderPlain()
-            }
 
-     
-        # assim iniciamos o loop principal do programa
-        while self.run:
-            clock.tick( 1000 // dt )
-            self.interval += 1
+    def print_stats( self, name="Client" ):
+        print_net_stats( name, [ self ] )
+    # print_stats()
+# CoopClient
 
-            # Handle Input Events
-            self.handle_events()
 
-            # Atualiza Elementos
-            self.actors_update( dt )
 
-            # Faça os atores atuarem
-            self.actors_act()
+def print_net_stats( name, clients ):
+    """
+    Resumo da latência, da banda e da predição de um ou mais clientes.
+    """
+    rtts  = sorted( r for c in clients for r in c.rtts )
+    sizes = [ s for c in clients for s in c.sizes ]
+    print( "%s: %d snapshots received (%d full), %d stale, %d without base" %
+           ( name, len( sizes ), sum( c.full for c in clients ),
+             sum( c.stale for c in clients ),
+             sum( c.missing for c in clients ) ) )
+    if rtts:
+        print( "%s RTT (ms): p50 %0.2f  p99 %0.2f  max %0.2f" %
+               ( name, percentile( rtts, 50 ), percentile( rtts, 99 ),
+                 rtts[ -1 ] ) )
+    if sizes:
+        print( "%s bytes per tick: avg %0.1f, max %d" %
+               ( name, sum( sizes ) / len( sizes ), max( sizes ) ) )
+    print( "%s prediction: %d corrections, max error %0.2f px" %
+           ( name, sum( c.corrections for c in clients ),
+             max( c.max_error for c in clients ) ) )
+# print_net_stats()
+
+
+
+async def coop_test( sessions, ticks, budget=1200, seed=0,
+                     size=( 640, 480 ), sim_rate=62.5 ):
+    """
+    Roda um CoopServer e dois clientes automáticos por sessão no mesmo
+    processo, conversando por UDP em 127.0.0.1, e imprime a latência e a
+    banda medidas.
+    """
+    loop   = asyncio.get_running_loop()
+    server = CoopServer( sessions, 2, size, sim_rate, budget, seed )
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: server, local_addr=( "127.0.0.1", 0 ) )
+    addr = transport.get_extra_info( "sockname" )
+
+    clients    = []
+    transports = [ transport ]
+    for i in range( 2 * sessions ):
+        client = CoopClient( bot=seed + i )
+        t, p   = await loop.create_datagram_endpoint( lambda: client,
+                                                      remote_addr=addr )
+        clients.append( client )
+        transports.append( t )
+
+    start = time.perf_counter()
+    task  = asyncio.ensure_future( server.run() )
+    await asyncio.gather( *( c.run( ticks ) for c in clients ) )
+    server.stop()
+    await task
+    elapsed = time.perf_counter() - start
+    for t in transports:
+        t.close()
+
+    print( "Co-op test: %d sessions, %d clients, %d ticks in %0.2f s" %
+           ( sessions, len( clients ), ticks, elapsed ) )
+    server.print_stats()
+    print_net_stats( "Clients", clients )
+# coop_test()
+
+
+
+def serve( addr, sessions, budget, ticks=None, seed=0, size=( 640, 480 ),
+           sim_rate=62.5 ):
+    """
+    Roda um CoopServer em addr até ticks ticks ou Ctrl-C.
+    """
+    server = CoopServer( sessions, 2, size, sim_rate, budget, seed )
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: server, local_addr=addr )
+        print( "Co-op server on %s:%d, up to %d sessions" %
+               ( addr[ 0 ], addr[ 1 ], sessions ) )
+        try:
+            await server.run( ticks )
+        finally:
+            transport.close()
 
-            # Faça a manutenção do jogo, como criar inimigos, etc.
-            self.manage()
-            
-            # Desenhe para o back buffer
-            self.actors_draw()
+    try:
+        asyncio.run( run() )
+    except KeyboardInterrupt:
+        pass
+    server.print_stats()
+# serve()
 
 
-            self.draw_hud() 
-          
-            
-            # ao fim do desenho temos que trocar o front buffer e o back buffer
-            pygame.display.flip()
 
-            print("FPS: %0.2f" % clock.get_fps() + " - Lifes: %d" % self.player.get_lives() )
+def connect( addr, ticks=None, bot=None, bindings=None, screen=None ):
+    """
+    Joga em um CoopServer: com o teclado e uma janela, ou com bot (uma
+    semente) e sem desenho.
+    """
+    client = CoopClient( bot, bindings )
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: client, remote_addr=addr )
+        try:
+            await client.run( ticks, screen )
+        finally:
+            transport.close()
+
+    asyncio.run( run() )
+    client.print_stats()
+# connect()
+
+
+
+def simulate( seed, frames, size=( 640, 480 ) ):
+    """
+    Joga uma partida headless com o BotInput e retorna suas estatísticas.
+    Roda em um processo separado (veja run_batch()).
+    """
+    os.environ[ "SDL_VIDEODRIVER" ] = "dummy"
+    os.environ[ "SDL_AUDIODRIVER" ] = "dummy"
+
+    game = Game( size, False, headless=True, seed=seed, profile=True )
+    game.input = BotInput( game, seed )
+    game.loop( frames, quiet=True )
+
+    times = sorted( t * 1000.0 for t in game.frame_times )
+    return { "seed"         : seed,
+             "frames"       : game.frame,
+             "elapsed"      : game.elapsed,
+             "died"         : game.player.is_dead(),
+             "level"        : game.level,
+             "xp"           : game.player.get_XP(),
+             "level_frames" : game.level_frames,
+             "peaks"        : dict( game.profiler.peaks ),
+             "frame_p50"    : percentile( times, 50 ),
+             "frame_p99"    : percentile( times, 99 ) }
+# simulate()
+
+
+
+def run_batch( games, frames, jobs=None, seed=0 ):
+    """
+    Simula várias partidas em paralelo, uma semente para cada, usando todos
+    os processadores, e imprime um resumo dos resultados.
+    """
+    jobs  = jobs or os.cpu_count() or 1
+    seeds = range( seed, seed + games )
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor( max_workers=jobs ) as pool:
+        results = list( pool.map( simulate, seeds,
+                                  [ frames ] * games ) )
+    elapsed = time.perf_counter() - start
+
+    total = sum( r[ "frames" ] for r in results )
+    print( "Batch: %d games on %d processes in %0.2f s" %
+           ( games, jobs, elapsed ) )
+    print( "Throughput: %0.2f games/s, %0.1f simulated frames/s" %
+           ( games / elapsed, total / elapsed ) )
+    print( "Deaths: %d of %d games" %
+           ( sum( 1 for r in results if r[ "died" ] ), games ) )
+
+    for level in range( len( Game.levels ) ):
+        reached = [ r[ "level_frames" ][ level ] for r in results
+                    if len( r[ "level_frames" ] ) > level ]
+        if reached:
+            print( "Level %d: reached in %d games, mean %0.0f frames "
+                   "(min %d, max %d)" %
+                   ( level + 1, len( reached ), sum( reached ) / len( reached ),
+                     min( reached ), max( reached ) ) )
+        else:
+            print( "Level %d: never reached" % ( level + 1 ) )
+
+    for name in results[ 0 ][ "peaks" ]:
+        peaks = [ r[ "peaks" ][ name ] for r in results ]
+        print( "Peak %-12s max %d, mean %0.1f" %
+               ( name, max( peaks ), sum( peaks ) / len( peaks ) ) )
+
+    p50 = sorted( r[ "frame_p50" ] for r in results )
+    p99 = sorted( r[ "frame_p99" ] for r in results )
+    print( "Frame cost (ms): median p50 %0.3f, worst p99 %0.3f" %
+           ( percentile( p50, 50 ), p99[ -1 ] ) )
+    return results
+# run_batch()
 
-            print()
-            if self.player.get_XP() > 1 :
-                break;
-        # while self.run
-    # loop()
-# Game
 
 
 def usage():
@@ -684,6 +5856,90 @@ def usage():
     prog = sys.argv[ 0 ]
     print("Usage:")
     print("\t%s [-f|--fullscreen] [-r <XxY>|--resolution=<XxY>]" % prog)
+    print("\t\t[--headless] [--frames=<N>] [--seed=<S>] [--input=<random|FILE>]")
+    print("\t\t[--dirty] [--scroll-interval=<N>] [--batched-fire]")
+    print("\t\t[--prefetch=<eager|near|off>] [--sim-rate=<HZ>] [--fps=<HZ>]")
+    print("\t\t[--max-steps=<N>] [--interpolate] [--profile]")
+    print("\t\t[--profile-out=<FILE.csv|FILE.json>] [--record=<FILE>]")
+    print("\t\t[--replay=<FILE>] [--batch=<N>] [--jobs=<J>] [--atlas]")
+    print("\t\t[--pack] [--build-pack] [--bind=<KEY:ACTION>]")
+    print("\t\t[--autofire-interval=<MS>] [--exact=<PARES>]")
+    print("\t\t[--scale=<F|auto>] [--render-size=<XxY>] [--integer-scale]")
+    print("\t\t[--smooth] [--target-ms=<MS>] [--startup-profile]")
+    print("\t\t[--budget=<MS>] [--particles=<N>] [--threaded]")
+    print("\t\t[--buffers=<2|3>] [--serve=<[HOST:]PORT>] [--sessions=<N>]")
+    print("\t\t[--connect=<HOST:PORT>] [--coop-test=<N>] [--net-budget=<BYTES>]")
+    print()
+    print("\t--headless      roda sem janela (driver de vídeo dummy do SDL),")
+    print("\t                com dt fixo e sem limitar os quadros por segundo")
+    print("\t--frames=N      termina depois de N quadros")
+    print("\t--seed=S        semente dos números aleatórios")
+    print("\t--input=FONTE   'random' ou um arquivo com o roteiro de teclas")
+    print("\t--dirty         atualiza somente as regiões da tela que mudaram,")
+    print("\t                nos quadros em que o fundo não rola (com --dirty")
+    print("\t                o padrão de --scroll-interval passa a ser 4)")
+    print("\t--scroll-interval=N")
+    print("\t                rola o fundo a cada N quadros (0 = fundo parado,")
+    print("\t                padrão 1)")
+    print("\t--batched-fire  processa os tiros em lote com o NumPy")
+    print("\t--prefetch=MODO prepara os fundos dos níveis no início (eager),")
+    print("\t                perto da troca de nível (near) ou não (off)")
+    print("\t--sim-rate=HZ   passos de simulação por segundo (padrão 62.5)")
+    print("\t--fps=HZ        quadros desenhados por segundo (padrão: sim-rate)")
+    print("\t--max-steps=N   máximo de passos de simulação por quadro")
+    print("\t--interpolate   desenha os objetos entre dois passos da simulação")
+    print("\t--profile       mede o tempo de cada fase do quadro (F3 mostra)")
+    print("\t--profile-out=ARQUIVO")
+    print("\t                grava as medições em um arquivo .csv ou .json")
+    print("\t--record=ARQUIVO grava a semente e as teclas da partida")
+    print("\t--replay=ARQUIVO reproduz uma partida gravada (com --headless, na")
+    print("\t                velocidade máxima)")
+    print("\t--batch=N       simula N partidas headless com um jogador")
+    print("\t                automático, em paralelo, e mostra um resumo")
+    print("\t--jobs=J        número de processos (padrão: um por CPU)")
+    print("\t--atlas         desenha todas as imagens a partir de um atlas")
+    print("\t--build-pack    gera o pacote de imagens já decodificadas e sai")
+    print("\t--pack          carrega as imagens do pacote (mmap)")
+    print("\t--bind=TECLA:AÇÃO")
+    print("\t                associa uma tecla (nome do pygame, ex.: 'j') a")
+    print("\t                uma ação: %s" % ", ".join( InputMap.actions ))
+    print("\t--autofire-interval=MS")
+    print("\t                intervalo do tiro automático (padrão 176 ms)")
+    print("\t--exact=PARES   colisão exata (máscaras) para os pares de grupos")
+    print("\t                ator:alvo separados por vírgula, ou 'all'. Pares:")
+    print("\t                %s" % ", ".join( "%s:%s" % p
+                                             for p in Game.exact_pairs ))
+    print("\t--scale=F       desenha em uma tela interna F vezes menor que a")
+    print("\t                resolução e amplia para o display; 'auto'")
+    print("\t                escolhe o fator para caber em --target-ms")
+    print("\t--render-size=XxY")
+    print("\t                resolução interna fixa, ampliada para o display")
+    print("\t--integer-scale amplia somente por fatores inteiros (centralizado)")
+    print("\t--smooth        amplia com smoothscale (suave, mais caro)")
+    print("\t--target-ms=MS  custo máximo de desenho para --scale=auto")
+    print("\t                (padrão 8 ms)")
+    print("\t--startup-profile")
+    print("\t                mostra o tempo de cada fase da inicialização")
+    print("\t--budget=MS     reduz a qualidade (inimigos, tiros, rolagem do")
+    print("\t                fundo, ampliação, HUD) quando o quadro passa de")
+    print("\t                MS milissegundos, ex.: 16.6")
+    print("\t--particles=N   máximo de partículas das explosões (padrão")
+    print("\t                8192, 0 desliga)")
+    print("\t--threaded      simulação e desenho em threads separadas")
+    print("\t--buffers=N     quadros entre as threads: 2 (as duas andam")
+    print("\t                juntas) ou 3 (a simulação nunca espera, padrão)")
+    print("\t--serve=[HOST:]PORT")
+    print("\t                servidor co-op (UDP, padrão 127.0.0.1) com duas")
+    print("\t                naves por partida; --frames limita os ticks")
+    print("\t--sessions=N    partidas simultâneas no servidor (padrão 1)")
+    print("\t--connect=HOST:PORT")
+    print("\t                joga co-op em um servidor; com --headless um")
+    print("\t                jogador automático joga no lugar do teclado")
+    print("\t--coop-test=N   servidor e 2*N clientes automáticos no mesmo")
+    print("\t                processo, por 127.0.0.1, durante --frames ticks")
+    print("\t                (padrão 600); mostra latência e banda")
+    print("\t--net-budget=BYTES")
+    print("\t                tamanho máximo de um snapshot (padrão 1200)")
     print()
 # usage()
 
@@ -699,7 +5955,46 @@ def parse_opts( argv ):
                                         "hfr:",
                                         [ "help",
                                           "fullscreen",
-                                          "resolution=" ] )
+                                          "resolution=",
+                                          "headless",
+                                          "frames=",
+                                          "seed=",
+                                          "input=",
+                                          "dirty",
+                                          "scroll-interval=",
+                                          "batched-fire",
+                                          "prefetch=",
+                                          "sim-rate=",
+                                          "fps=",
+                                          "max-steps=",
+                                          "interpolate",
+                                          "profile",
+                                          "profile-out=",
+                                          "record=",
+                                          "replay=",
+                                          "batch=",
+                                          "jobs=",
+                                          "atlas",
+                                          "pack",
+                                          "build-pack",
+                                          "bind=",
+                                          "autofire-interval=",
+                                          "exact=",
+                                          "scale=",
+                                          "render-size=",
+                                          "integer-scale",
+                                          "smooth",
+                                          "target-ms=",
+                                          "startup-profile",
+                                          "budget=",
+                                          "particles=",
+                                          "threaded",
+                                          "buffers=",
+                                          "serve=",
+                                          "sessions=",
+                                          "connect=",
+                                          "coop-test=",
+                                          "net-budget=" ] )
     except getopt.GetoptError:
         # imprime informacao e sai
         usage()
@@ -708,6 +6003,45 @@ def parse_opts( argv ):
     options = {
         "fullscreen":  False,
         "resolution": ( 640, 480 ),
+        "headless":    False,
+        "frames":      None,
+        "seed":        None,
+        "input":       None,
+        "dirty":       False,
+        "scroll_interval": None,
+        "batched_fire": False,
+        "prefetch":    "near",
+        "sim_rate":    62.5,
+        "fps":         None,
+        "max_steps":   5,
+        "interpolate": False,
+        "profile":     False,
+        "profile_out": None,
+        "record":      None,
+        "replay":      None,
+        "batch":       None,
+        "jobs":        None,
+        "atlas":       False,
+        "pack":        False,
+        "build_pack":  False,
+        "bindings":    [],
+        "autofire_interval": 176,
+        "exact":       [],
+        "scale":       1,
+        "render_size": None,
+        "integer_scale": False,
+        "smooth":      False,
+        "target_ms":   8.0,
+        "startup_profile": False,
+        "budget":      None,
+        "particles":   8192,
+        "threaded":    False,
+        "buffers":     3,
+        "serve":       None,
+        "sessions":    1,
+        "connect":     None,
+        "coop_test":   None,
+        "net_budget":  1200,
         }
 
     for o, a in opts:
@@ -716,6 +6050,111 @@ def parse_opts( argv ):
         elif o in ( "-h", "--help" ):
             usage()
             sys.exit( 0 )
+        elif o == "--headless":
+            options[ "headless" ] = True
+        elif o == "--frames":
+            options[ "frames" ] = int( a )
+        elif o == "--seed":
+            options[ "seed" ] = int( a )
+        elif o == "--input":
+            options[ "input" ] = a
+        elif o == "--dirty":
+            options[ "dirty" ] = True
+        elif o == "--scroll-interval":
+            options[ "scroll_interval" ] = int( a )
+        elif o == "--batched-fire":
+            options[ "batched_fire" ] = True
+        elif o == "--prefetch":
+            if a not in ( "eager", "near", "off" ):
+                usage()
+                sys.exit( 2 )
+            options[ "prefetch" ] = a
+        elif o == "--sim-rate":
+            options[ "sim_rate" ] = float( a )
+        elif o == "--fps":
+            options[ "fps" ] = float( a )
+        elif o == "--max-steps":
+            options[ "max_steps" ] = int( a )
+        elif o == "--interpolate":
+            options[ "interpolate" ] = True
+        elif o == "--profile":
+            options[ "profile" ] = True
+        elif o == "--profile-out":
+            options[ "profile_out" ] = a
+        elif o == "--record":
+            options[ "record" ] = a
+        elif o == "--replay":
+            options[ "replay" ] = a
+        elif o == "--batch":
+            options[ "batch" ] = int( a )
+        elif o == "--jobs":
+            options[ "jobs" ] = int( a )
+        elif o == "--atlas":
+            options[ "atlas" ] = True
+        elif o == "--pack":
+            options[ "pack" ] = True
+        elif o == "--build-pack":
+            options[ "build_pack" ] = True
+        elif o == "--bind":
+            key, sep, action = a.rpartition( ":" )
+            if not sep or action not in InputMap.actions:
+                usage()
+                sys.exit( 2 )
+            options[ "bindings" ].append( ( key, action ) )
+        elif o == "--autofire-interval":
+            options[ "autofire_interval" ] = float( a )
+        elif o == "--exact":
+            if a == "all":
+                options[ "exact" ] = list( Game.exact_pairs )
+                continue
+            for pair in a.split( "," ):
+                pair = tuple( pair.split( ":" ) )
+                if pair not in Game.exact_pairs:
+                    usage()
+                    sys.exit( 2 )
+                options[ "exact" ].append( pair )
+        elif o == "--scale":
+            options[ "scale" ] = a if a == "auto" else float( a )
+            if a != "auto" and options[ "scale" ] <= 0:
+                usage()
+                sys.exit( 2 )
+        elif o == "--render-size":
+            r = a.lower().split( "x" )
+            if len( r ) != 2:
+                usage()
+                sys.exit( 2 )
+            options[ "render_size" ] = ( int( r[ 0 ] ), int( r[ 1 ] ) )
+        elif o == "--integer-scale":
+            options[ "integer_scale" ] = True
+        elif o == "--smooth":
+            options[ "smooth" ] = True
+        elif o == "--target-ms":
+            options[ "target_ms" ] = float( a )
+        elif o == "--startup-profile":
+            options[ "startup_profile" ] = True
+        elif o == "--budget":
+            options[ "budget" ] = float( a )
+        elif o == "--particles":
+            options[ "particles" ] = int( a )
+        elif o == "--threaded":
+            options[ "threaded" ] = True
+        elif o == "--buffers":
+            options[ "buffers" ] = int( a )
+            if options[ "buffers" ] not in ( 2, 3 ):
+                usage()
+                sys.exit( 2 )
+        elif o in ( "--serve", "--connect" ):
+            host, sep, port = a.rpartition( ":" )
+            if not port.isdigit() or ( o == "--connect" and not host ):
+                usage()
+                sys.exit( 2 )
+            options[ o[ 2 : ] ] = ( host or "127.0.0.1", int( port ) )
+        elif o == "--sessions":
+            options[ "sessions" ] = int( a )
+        elif o == "--coop-test":
+            options[ "coop_test" ] = int( a )
+        elif o == "--net-budget":
+            options[ "net_budget" ] = int( a )
         elif o in ( "-r", "--resolution" ):
             a = a.lower()
             r = a.split( "x" )
@@ -733,6 +6172,11 @@ def parse_opts( argv ):
                 options[ "resolution" ] = r
                 continue
     # for o, a in opts
+    # Com o fundo rolando a cada quadro o --dirty nunca teria um quadro
+    # parcial: sem intervalo explícito o fundo rola a cada 4 quadros
+    if options[ "scroll_interval" ] is None:
+        options[ "scroll_interval" ] = 4 if options[ "dirty" ] else 1
+
     r = options[ "resolution" ]
     options[ "resolution" ] = [ int( r[ 0 ] ), int( r[ 1 ] ) ]
     return options
@@ -749,8 +6193,116 @@ def main( argv ):
     os.chdir( dir )
 
     options = parse_opts( argv )
-    game = Game( options[ "resolution" ], options[ "fullscreen" ] )
-    game.loop()
+    if options[ "build_pack" ]:
+        pack = AssetPack()
+        print( "%s: %d images" % ( pack.filename, pack.build() ) )
+        return
+
+    if options[ "batch" ]:
+        run_batch( options[ "batch" ], options[ "frames" ] or 3600,
+                   options[ "jobs" ], options[ "seed" ] or 0 )
+        return
+
+    # O servidor co-op não tem janela
+    if options[ "serve" ] or options[ "coop_test" ]:
+        options[ "headless" ] = True
+
+    if options[ "headless" ]:
+        # O driver dummy do SDL permite rodar sem nenhum display
+        os.environ[ "SDL_VIDEODRIVER" ] = "dummy"
+        os.environ[ "SDL_AUDIODRIVER" ] = "dummy"
+        if options[ "input" ] is None and not options[ "replay" ]:
+            options[ "input" ] = "random"
+
+    # O pygame precisa estar inicializado para traduzir os nomes das teclas
+    pygame.init()
+    for key, action in options[ "bindings" ]:
+        try:
+            pygame.key.key_code( key )
+        except ValueError:
+            print( "unknown key name: %s" % key )
+            usage()
+            sys.exit( 2 )
+
+    if options[ "coop_test" ]:
+        asyncio.run( coop_test( options[ "coop_test" ],
+                                options[ "frames" ] or 600,
+                                options[ "net_budget" ],
+                                options[ "seed" ] or 0,
+                                options[ "resolution" ],
+                                options[ "sim_rate" ] ) )
+        return
+    if options[ "serve" ]:
+        serve( options[ "serve" ], options[ "sessions" ],
+               options[ "net_budget" ], options[ "frames" ],
+               options[ "seed" ] or 0, options[ "resolution" ],
+               options[ "sim_rate" ] )
+        return
+    if options[ "connect" ]:
+        # A janela precisa existir antes de carregar as imagens
+        screen = pygame.display.set_mode( options[ "resolution" ] )
+        pygame.display.set_caption( 'Título da Janela' )
+        if options[ "headless" ]:
+            connect( options[ "connect" ], options[ "frames" ],
+                     bot=options[ "seed" ] or 0 )
+        else:
+            connect( options[ "connect" ], options[ "frames" ],
+                     bindings=options[ "bindings" ], screen=screen )
+        return
+    if options[ "input" ] == "random":
+        input = RandomInput( options[ "seed" ] )
+    elif options[ "input" ]:
+        input = ScriptedInput.from_file( options[ "input" ] )
+    else:
+        input = None
+
+    if options[ "replay" ]:
+        # A gravação define tudo o que influencia a simulação
+        input = ReplayInput( options[ "replay" ] )
+        options[ "seed" ]       = input.seed
+        options[ "resolution" ] = input.size
+        options[ "sim_rate" ]   = input.sim_rate
+        for name, value in sorted( input.settings.items() ):
+            if options[ name ] != value:
+                print( "Replay: %s from the recording: %r" % ( name, value ) )
+            options[ name ] = value
+        if options[ "frames" ] is None:
+            options[ "frames" ] = input.frames
+    elif options[ "record" ]:
+        if options[ "seed" ] is None:
+            options[ "seed" ] = Random.randrange( 1 << 31 )
+        input = InputRecorder( input or LiveInput(), options[ "record" ],
+                               options[ "seed" ], options[ "resolution" ],
+                               options[ "sim_rate" ],
+                               dict( ( name, options[ name ] ) for name
+                                     in InputRecorder.settings ) )
+
+    game = Game( options[ "resolution" ], options[ "fullscreen" ],
+                 headless=options[ "headless" ], seed=options[ "seed" ],
+                 input=input, dirty=options[ "dirty" ],
+                 scroll_interval=options[ "scroll_interval" ],
+                 batched_fire=options[ "batched_fire" ],
+                 prefetch=options[ "prefetch" ],
+                 sim_rate=options[ "sim_rate" ], fps=options[ "fps" ],
+                 max_steps=options[ "max_steps" ],
+                 interpolate=options[ "interpolate" ],
+                 profile=options[ "profile" ],
+                 profile_out=options[ "profile_out" ],
+                 atlas=options[ "atlas" ], pack=options[ "pack" ],
+                 bindings=options[ "bindings" ],
+                 autofire_interval=options[ "autofire_interval" ],
+                 exact=options[ "exact" ],
+                 scale=options[ "scale" ],
+                 integer_scale=options[ "integer_scale" ],
+                 smooth=options[ "smooth" ],
+                 render_size=options[ "render_size" ],
+                 target_ms=options[ "target_ms" ],
+                 startup_profile=options[ "startup_profile" ],
+                 budget=options[ "budget" ],
+                 particles=options[ "particles" ],
+                 threaded=options[ "threaded" ],
+                 buffers=options[ "buffers" ] )
+    game.loop( options[ "frames" ] )
 # main()
         
 # este comando fala para o python chamar o main se estao executando o script
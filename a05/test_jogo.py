@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de ida e volta dos formatos binários do jogo: varint, gravação de
+partidas (InputRecorder/ReplayInput) e snapshots do co-op em rede.
+
+Rodam sem janela, com o driver de vídeo dummy do SDL:
+
+    python -m pytest -q
+"""
+import io
+import os
+
+os.environ.setdefault( "SDL_VIDEODRIVER", "dummy" )
+os.environ.setdefault( "SDL_AUDIODRIVER", "dummy" )
+
+import pygame
+import pytest
+from pygame.locals import KEYDOWN, KEYUP, QUIT, K_LEFT, K_SPACE, K_F3
+
+import jogo
+
+
+@pytest.fixture( autouse=True )
+def game_dir( monkeypatch ):
+    # As imagens são procuradas a partir do diretório do jogo
+    monkeypatch.chdir( os.path.dirname( os.path.abspath( jogo.__file__ ) ) )
+    pygame.init()
+    if pygame.display.get_surface() is None:
+        pygame.display.set_mode( ( 640, 480 ) )
+    jogo.GameObject.set_arena( ( 0, 0, 640, 480 ) )
+# game_dir()
+
+
+
+@pytest.mark.parametrize( "n", [ 0, 1, 127, 128, 255, 16383, 16384,
+                                 2 ** 21 - 1, 2 ** 21, 2 ** 32 - 1,
+                                 2 ** 63 ] )
+def test_varint_round_trip( n ):
+    f = io.BytesIO()
+    jogo.write_varint( f, n )
+    size = f.tell()
+    # 7 bits por byte
+    assert size == max( 1, ( n.bit_length() + 6 ) // 7 )
+    f.seek( 0 )
+    assert jogo.read_varint( f ) == n
+    assert f.tell() == size
+# test_varint_round_trip()
+
+
+
+def test_varint_sequence_and_eof():
+    values = [ 0, 127, 128, 300, 1, 2 ** 40 ]
+    f = io.BytesIO()
+    for n in values:
+        jogo.write_varint( f, n )
+    f.seek( 0 )
+    assert [ jogo.read_varint( f ) for n in values ] == values
+    with pytest.raises( EOFError ):
+        jogo.read_varint( f )
+
+    # Um varint cortado no meio também termina em EOFError
+    with pytest.raises( EOFError ):
+        jogo.read_varint( io.BytesIO( b"\x80\x80" ) )
+# test_varint_sequence_and_eof()
+
+
+
+class ListInput:
+    """
+    Fonte de entrada com uma lista fixa de eventos por quadro.
+    """
+    def __init__( self, script ):
+        self.script = script
+    # __init__()
+
+
+
+    def poll( self, frame ):
+        return [ pygame.event.Event( t, key=key ) if t != QUIT
+                 else pygame.event.Event( t )
+                 for t, key in self.script.get( frame, () ) ]
+    # poll()
+
+
+
+    def get_pressed( self ):
+        return jogo.HeldKeys()
+    # get_pressed()
+
+
+
+    def close( self ):
+        pass
+    # close()
+# ListInput
+
+
+
+def test_record_replay_round_trip( tmp_path ):
+    script = { 0    : [ ( KEYDOWN, K_SPACE ) ],
+               1    : [ ( KEYUP, K_SPACE ), ( KEYDOWN, K_LEFT ) ],
+               200  : [ ( KEYUP, K_LEFT ) ],
+               # distância grande entre quadros e tecla com código grande
+               5000 : [ ( KEYDOWN, K_F3 ), ( KEYUP, K_F3 ) ],
+               5001 : [ ( QUIT, 0 ) ] }
+    frames   = 5010
+    filename = str( tmp_path / "partida.bin" )
+
+    recorder = jogo.InputRecorder( ListInput( script ), filename, 1234,
+                                   ( 320, 240 ), 60.0 )
+    recorded = {}
+    for frame in range( frames ):
+        events = recorder.poll( frame )
+        if events:
+            recorded[ frame ] = [ ( e.type, getattr( e, "key", 0 ) )
+                                  for e in events ]
+    recorder.close()
+    assert recorded == script
+
+    replay = jogo.ReplayInput( filename )
+    assert replay.seed == 1234
+    assert replay.size == ( 320, 240 )
+    assert replay.sim_rate == 60.0
+    assert replay.frames == frames
+
+    replayed = {}
+    for frame in range( frames ):
+        events = replay.poll( frame )
+        if events:
+            replayed[ frame ] = [ ( e.type, getattr( e, "key", 0 ) )
+                                  for e in events ]
+        if frame == 100:
+            # As teclas seguradas vêm dos eventos gravados
+            assert replay.get_pressed()[ K_LEFT ]
+            assert not replay.get_pressed()[ K_SPACE ]
+    assert replayed == script
+# test_record_replay_round_trip()
+
+
+
+def test_replay_rejects_other_files( tmp_path ):
+    filename = tmp_path / "outro.bin"
+    filename.write_bytes( b"XXXX" + bytes( jogo.InputRecorder.header.size ) )
+    with pytest.raises( ValueError ):
+        jogo.ReplayInput( str( filename ) )
+# test_replay_rejects_other_files()
+
+
+
+def play( capsys, *args ):
+    jogo.main( [ jogo.__file__, "--headless", "--particles=0" ] +
+               list( args ) )
+    out = capsys.readouterr().out
+    return [ line for line in out.splitlines()
+             if line.startswith( "Player:" ) ][ 0 ]
+# play()
+
+
+
+def test_replay_uses_recorded_settings( tmp_path, capsys ):
+    filename = str( tmp_path / "partida.bin" )
+    recorded = play( capsys, "--frames=1500", "--seed=3",
+                     "--record=%s" % filename, "--exact=all",
+                     "--autofire-interval=60", "--bind=up:left" )
+
+    replay = jogo.ReplayInput( filename )
+    assert replay.settings == {
+        "autofire_interval" : 60.0,
+        "batched_fire"      : False,
+        "bindings"          : [ ( "up", "left" ) ],
+        "exact"             : list( jogo.Game.exact_pairs ) }
+
+    # As opções da simulação vêm da gravação; as de desenho são livres
+    replayed = play( capsys, "--replay=%s" % filename, "--seed=99",
+                     "--autofire-interval=500", "--scale=2", "--dirty" )
+    assert replayed == recorded
+# test_replay_uses_recorded_settings()
+
+
+
+@pytest.mark.parametrize( "n", [ 0, -1, 1, -64, 63, 64, -65, 10 ** 6,
+                                 -10 ** 6 ] )
+def test_zigzag_round_trip( n ):
+    f = io.BytesIO()
+    jogo.write_zigzag( f, n )
+    # Valores pequenos, positivos ou negativos, ocupam um byte
+    if -64 <= n < 64:
+        assert f.tell() == 1
+    f.seek( 0 )
+    assert jogo.read_zigzag( f ) == n
+# test_zigzag_round_trip()
+
+
+
+class FakeSession:
+    """
+    Só o que CoopServer.snapshot() lê de uma CoopSession.
+    """
+    def __init__( self, players ):
+        self.game = type( "FakeGame", (), {} )()
+        self.game.level   = 1
+        self.game.players = players
+        self.tick         = 0
+    # __init__()
+# FakeSession
+
+
+
+def coop_pair( budget=1200 ):
+    server = jogo.CoopServer( budget=budget )
+    player = jogo.Player( [ 320, 480 ] )
+    player.set_speed( ( 3, -3 ) )
+    player.set_XP( 7 )
+    session = FakeSession( [ player, jogo.Player( [ 100, 480 ] ) ] )
+    peer    = jogo.CoopPeer( ( "127.0.0.1", 1 ), session, 0 )
+
+    client = jogo.CoopClient()
+    client.receive_welcome( server.welcome.pack( b"W", 0, 0, 2, 640, 480,
+                                                 62.5 ) )
+    return server, session, peer, client
+# coop_pair()
+
+
+
+def send( server, session, peer, client, state ):
+    session.tick += 1
+    data = server.snapshot( session, peer, state )
+    client.receive_snapshot( data )
+    assert client.tick == session.tick
+    return data
+# send()
+
+
+
+def ack( peer, client ):
+    # O cliente confirma o último tick recebido na próxima entrada
+    peer.receive( jogo.CoopServer.input.pack( b"I", client.seq + 1,
+                                              client.tick, 0, 0, 0, 0.0 ) )
+    client.seq += 1
+# ack()
+
+
+
+def test_snapshot_full_then_delta():
+    server, session, peer, client = coop_pair()
+    state = { 1 : ( 1, 100, -40 ), 2 : ( 2, 300, 200 ),
+              3 : ( 3, 50, 400 ), 7 : ( 1, 600, 10 ) }
+    full = send( server, session, peer, client, state )
+    assert client.view == state
+    assert client.full == 1
+
+    # Jogadores chegam completos
+    fx, fy, vx, vy, lives, xp = client.players[ 0 ]
+    player = session.game.players[ 0 ]
+    assert ( fx, fy, vx, vy ) == ( player.fx, player.fy, 3, -3 )
+    assert ( lives, xp ) == ( player.get_lives(), 7 )
+
+    # Delta contra o tick confirmado: uma remoção, movimentos pequenos e
+    # negativos, uma troca de imagem e uma entidade nova
+    ack( peer, client )
+    state = { 1 : ( 1, 98, -37 ), 3 : ( 0, 50, 400 ), 7 : ( 1, 600, 10 ),
+              9 : ( 2, -5, 479 ) }
+    delta = send( server, session, peer, client, state )
+    assert client.view == state
+    assert client.full == 1
+    assert len( delta ) < len( full )
+    assert peer.views[ session.tick ] == state
+
+    # Sem novo ack a base continua a mesma, e o resultado também
+    state = dict( state )
+    del state[ 7 ]
+    send( server, session, peer, client, state )
+    assert client.view == state
+# test_snapshot_full_then_delta()
+
+
+
+def test_snapshot_budget_defers_far_entities():
+    server, session, peer, client = coop_pair( budget=120 )
+    x, y  = session.game.players[ 0 ].rect.center
+    # Entidades cada vez mais longe do jogador do cliente
+    state = dict( ( i, ( 1, x + i * 10, y - i * 10 ) )
+                  for i in range( 1, 60 ) )
+    data  = send( server, session, peer, client, state )
+    assert len( data ) <= server.budget
+    assert server.deferred > 0
+
+    # O cliente tem exatamente o que o servidor acha que mandou: as
+    # entidades mais próximas
+    sent = peer.views[ session.tick ]
+    assert client.view == sent
+    assert 0 < len( sent ) < len( state )
+    nearest = sorted( state )[ : len( sent ) ]
+    assert sorted( sent ) == nearest
+
+    # Com as confirmações, as que ficaram para trás vão chegando
+    for i in range( 20 ):
+        ack( peer, client )
+        data = send( server, session, peer, client, state )
+        assert len( data ) <= server.budget
+        assert client.view == peer.views[ session.tick ]
+        if client.view == state:
+            break
+    assert client.view == state
+# test_snapshot_budget_defers_far_entities()
+
+
+
+def test_snapshot_falls_back_to_full_when_ack_lags():
+    server, session, peer, client = coop_pair()
+    state = { 1 : ( 1, 10, 10 ) }
+    send( server, session, peer, client, state )
+    ack( peer, client )
+    session.tick += server.max_lag + 1
+    client.tick   = session.tick - 1
+    send( server, session, peer, client, state )
+    assert client.full == 2
+    assert client.view == state
+# test_snapshot_falls_back_to_full_when_ack_lags()
+
+
+
+def test_net_ids_change_when_a_bullet_is_reused():
+    group = pygame.sprite.Group()
+    fire  = jogo.fire_pool.acquire( ( 10, 10 ), ( 0, -5 ), None, group )
+    first = fire.net_id
+    fire.kill()
+    assert fire.net_id == 0
+    again = jogo.fire_pool.acquire( ( 10, 10 ), ( 0, -5 ), None, group )
+    assert again is fire
+    assert again.net_id not in ( 0, first )
+    again.kill()
+# test_net_ids_change_when_a_bullet_is_reused()
+
+
+
+def test_snapshot_players_carry_large_values():
+    server, session, peer, client = coop_pair()
+    session.game.players[ 1 ].set_XP( 70000 )
+    send( server, session, peer, client, {} )
+    assert client.players[ 1 ][ 5 ] == 70000
+# test_snapshot_players_carry_large_values()
+
+
+
+def test_snapshot_budget_counts_removals():
+    server, session, peer, client = coop_pair( budget=4000 )
+    state = dict( ( i, ( 1, i % 640, i % 480 ) )
+                  for i in range( 1000, 1400 ) )
+    send( server, session, peer, client, state )
+    assert client.view == state
+
+    # Todas somem de uma vez: as remoções também respeitam o orçamento
+    server.budget = 120
+    for i in range( 100 ):
+        ack( peer, client )
+        data = send( server, session, peer, client, {} )
+        assert len( data ) <= server.budget
+        assert client.view == peer.views[ session.tick ]
+        if not client.view:
+            break
+    assert client.view == {}
+# test_snapshot_budget_counts_removals()
+
+
+
+class FakeTransport:
+    def __init__( self ):
+        self.sent = []
+    # __init__()
+
+
+
+    def sendto( self, data, addr=None ):
+        self.sent.append( data )
+    # sendto()
+# FakeTransport
+
+
+
+def test_prediction_follows_repeated_inputs():
+    server = jogo.CoopServer( players=1 )
+    server.transport = FakeTransport()
+    server.add_peer( ( "127.0.0.1", 1 ) )
+    session = server.sessions[ 0 ]
+    peer    = server.peers[ ( "127.0.0.1", 1 ) ]
+
+    client = jogo.CoopClient()
+    client.transport = FakeTransport()
+    client.receive_welcome( server.transport.sent[ -1 ] )
+
+    # A primeira entrada chega a tempo; as duas seguintes atrasam e o
+    # servidor repete a primeira nos dois ticks seguintes
+    for i in range( 3 ):
+        client.send_input( 1, 0, 0 )
+    late = client.transport.sent[ 1 : ]
+    peer.receive( client.transport.sent[ 0 ] )
+    for i in range( 3 ):
+        session.step()
+    assert peer.repeated == 2
+    client.receive_snapshot( server.transport.sent[ -1 ] )
+    assert client.corrections == 0
+
+    # A previsão já conta as repetições: quando as entradas atrasadas são
+    # aplicadas, o servidor chega onde o cliente está
+    for data in late:
+        peer.receive( data )
+    for i in range( 2 ):
+        session.step()
+    player = session.game.players[ 0 ]
+    assert ( client.player.fx, client.player.fy ) == ( player.fx, player.fy )
+    client.receive_snapshot( server.transport.sent[ -1 ] )
+    assert client.corrections == 0
+# test_prediction_follows_repeated_inputs()